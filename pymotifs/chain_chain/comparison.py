@@ -40,6 +40,10 @@ from pymotifs.units.center_rotation import Loader as CenterRotationsLoader
 
 from pymotifs.nr.groups.simplified import Grouper
 
+from pymotifs.chain_chain.position_store import PositionStore
+from pymotifs.chain_chain.geometry_cache import ChainGeometry
+from pymotifs.chain_chain.geometry_cache import ChainGeometryCache
+
 def pick(preferences, key, iterable):
     """Pick the most preferred value from a list of possibilities.
 
@@ -80,6 +84,18 @@ class Loader(core.SimpleLoader):
     """We allow for no data to be written when appropriate."""
     allow_no_data = True
 
+    """Number of pairs of chains to compute discrepancies for at once."""
+    discrepancy_batch_size = 500
+
+    """Number of chain ids to look up in one query."""
+    chunk_size = 500
+
+    """Maximum number of units whose centers and rotations are cached."""
+    geometry_cache_units = 2000000
+
+    """Number of chains in each block when ordering pairs for the cache."""
+    geometry_block_size = 50
+
     """The dependencies for this stage"""
     dependencies = set([CorrespondenceLoader, ExpSeqUnitMappingLoader,
                         IfeLoader, CenterRotationsLoader])
@@ -169,8 +185,8 @@ class Loader(core.SimpleLoader):
         # while developing DNA equivalence classes, run those manually
         nr_molecule_parent_current = kwargs.get('nr_molecule_parent_current','')
 
-        # when DNA catches up to RNA, run rna each week and generate the .pickle files,
-        # and then run DNA and no need to generate the .pickle files
+        # when DNA catches up to RNA, run rna each week and update the position store,
+        # and then run DNA and no need to update the position store
         if nr_molecule_parent_current and 'dna' in nr_molecule_parent_current.lower():
             molecule_types = ['dna']
         else:
@@ -253,183 +269,195 @@ class Loader(core.SimpleLoader):
         if len(groups_of_chain_ids) == 0:
             raise core.Skip("No groups of chains to compare")
 
-        GeneratePickleFiles = False   # appropriate to use when debugging the rest of the program
-        GeneratePickleFiles = True    # must be used in production, to update the files each week
+        UpdatePositionStore = False   # appropriate to use when debugging the rest of the program
+        UpdatePositionStore = True    # must be used in production, to update the store each week
 
-        if len(pdbs) < 500:
-            GeneratePickleFiles = False
-            self.logger.info('Not generating pickle files for a small number of pdbs')
+        if UpdatePositionStore:
+            store = self.position_store()
 
-        if GeneratePickleFiles:
-            self.logger.info('Getting the unit_id to experimental sequence position table')
-            # query and write to disk unit correspondence data once per run of chain_chain/comparison.py
-            # takes about 2 1/3 minutes on production in December 2020
-            # takes over 15 minutes when re-written to check sym_op, alt_id, glycosidic center
+            # only query units for pdbs which are not already in the store,
+            # or which were revised since they were stored
+            known_pdbs = store.known_pdbs()
+            self.logger.info('Position store has mappings for %d pdb files' % len(known_pdbs))
+            revisions = self.revision_dates(pdbs)
+            stale_pdbs = store.stale_pdbs(revisions)
+            self.logger.info('Position store has %d revised pdb files' % len(stale_pdbs))
+            needed_pdbs = (set(pdbs) - known_pdbs) | stale_pdbs
 
-            known_pdbs = set()
-            chain_unit_to_position = defaultdict(dict)
+            self.logger.info('Updating unit to position mappings for %d pdbs' % len(needed_pdbs))
+            self.logger.info(sorted(needed_pdbs))
 
-            # read previous chain unit to position data, takes 45 seconds on production on 2024-06-17
-            if os.path.exists("unit_to_position.pickle"):
-                self.logger.info('Reading pickle file unit_to_position.pickle')
-                chain_unit_to_position = pickle.load(open("unit_to_position.pickle", "rb" ))
-                for chain in chain_unit_to_position.keys():
-                    known_pdbs.add(chain.split("|")[0])
-                self.logger.info('Read mappings for %d pdb files from unit_to_position.pickle' % len(known_pdbs))
+            for chunk in ut.grouper(1000, sorted(needed_pdbs)):
+                chunk = set(chunk)
+                chunk_revisions = dict((pdb, revisions.get(pdb)) for pdb in chunk)
+                count = store.add_units(self.unit_to_position_mappings(chunk), chunk_revisions)
+                self.logger.info('Added %d final unit to position mappings' % count)
 
-            needed_pdbs = set(pdbs) - known_pdbs
+            # only query positions for correspondences which are not already in the store
+            known_ids = store.known_correspondences()
+            with self.session() as session:
+                query = session.query(mod.CorrespondenceInfo.correspondence_id)
+                needed_ids = sorted(set(r.correspondence_id for r in query) - known_ids)
+            self.logger.info('Getting position to position mappings for %d correspondences' % len(needed_ids))
 
-            # the query below is slow when being run on 8000 pdbs, which would happen
-            # if the .pickle file above is deleted or corrupted
-            # mysql show processlist indicates that mysql uses a temporary table on disk
-            # on 2024-07-24 it took 22 minutes
-            # the query below could be split to do 1000 pdbs at a time
+            for chunk in ut.grouper(1000, needed_ids):
+                count = store.add_positions(chunk, self.position_to_position_pairs(chunk))
+                self.logger.info('Added %d position to position correspondences' % count)
 
-            self.logger.info('Updating unit_to_position.pickle for %d pdbs' % len(needed_pdbs))
-            self.logger.info(sorted(needed_pdbs))
+        return groups_of_chain_ids
 
-            # get correspondences between unit ids and experimental sequence positions
-            # sort to put no alt_id before A before B before C, etc.
-            with self.session() as session:
-                EM = mod.ExpSeqUnitMapping
-                UI = mod.UnitInfo
-                UC = mod.UnitCenters
-                query = session.query(EM.unit_id,EM.exp_seq_position_id,UI.sym_op).\
-                    join(UI, UI.unit_id == EM.unit_id).\
-                    join(UC, UC.unit_id == EM.unit_id).\
-                    filter(UC.name == 'glycosidic').\
-                    filter(UI.pdb_id.in_(needed_pdbs)).\
-                    order_by(UI.pdb_id,UI.model,UI.chain,UI.alt_id.is_(None).desc(),UI.alt_id)
-
-                chain_to_symmetries = defaultdict(set)
-                count = 0
-                for r in query:
-                    # self.logger.info('Unit id %s, position %s, sym_op %s' % (r.unit_id,r.exp_seq_position_id,r.sym_op))
-                    count += 1
-                    if r.unit_id and "|" in r.unit_id:    # not sure why, but some rows have None
-                        fields = r.unit_id.split("|")
-                        if len(fields) > 3:
-                            ## skip unexpected pdbs
-                            if not fields[0] in needed_pdbs:
-                                continue
-                            chain = "|".join(fields[0:3])   # pdb id, model, chain is the top level key
-                            chain_to_symmetries[chain].add(r.sym_op)
-                self.logger.info('Got %d raw unit to position mappings' % count)
-
-                for chain, symmetries in chain_to_symmetries.items():
-                    if '1_555' in symmetries:
-                        # use the default symmetry when available
-                        symmetry = '1_555'
-                    elif len(symmetries) >= 1:
-                        # otherwise use the lowest numbered one, whatever that means
-                        symmetry = sorted(symmetries)[0]
-                    else:
-                        symmetry = ''
-                        self.logger.info('No symmetry operators for %s' % chain)
-                    # record the symmetry to use for this chain
-                    chain_to_symmetries[chain] = symmetry
-
-                chain_to_simple_unit_id = defaultdict(set)
-                count = 0
-                # looping over the query again may be just as slow as the first time
-                for r in query:
-                    if r.unit_id and "|" in r.unit_id:    # not sure why, but some rows have None
-                        fields = r.unit_id.split("|")
-                        if len(fields) >= 5:
-                            ## skip unexpected pdbs, just in case
-                            if not fields[0] in pdbs_set:
-                                continue
-
-                            chain = "|".join(fields[0:3])   # pdb id, model, chain is the top level key
-                            # only store unit ids from the one designated symmetry operator
-                            if r.sym_op == chain_to_symmetries[chain]:
-                                lf = len(fields)
-                                if lf in [5,6,7]:
-                                    # plain or just an alt id
-                                    simple_unit_id = "|".join([fields[0],fields[1],fields[2],'',fields[4]])  # remove sequence
-                                elif lf == 8:
-                                    # insertion code, possibly with alt_id
-                                    # remove sequence and alt_id
-                                    simple_unit_id = "|".join([fields[0],fields[1],fields[2],'',fields[4],fields[5],'',fields[7]])
-                                else:
-                                    # symmetry, possibly with insertion code, possibly with alt_id
-                                    # remove sequence and alt_id
-                                    simple_unit_id = "|".join([fields[0],fields[1],fields[2],'',fields[4],fields[5],'',fields[7],fields[8]])
-
-                                # only store one version of each unit id
-                                if not simple_unit_id in chain_to_simple_unit_id[chain]:
-                                    chain_to_simple_unit_id[chain].add(simple_unit_id)
-                                    chain_unit_to_position[chain][r.unit_id] = r.exp_seq_position_id
-                                    count += 1
-                                else:
-                                    self.logger.info('Unit id %s would duplicate earlier %s' % (r.unit_id,simple_unit_id))
 
-                self.logger.info('Added %d final unit to position mappings' % count)
-                pickle.dump(chain_unit_to_position, open("unit_to_position.pickle", "wb" ), 2)
-                self.logger.info('Wrote pickle file unit_to_position.pickle')
-
-            del chain_unit_to_position     # clear this from memory
-
-        if GeneratePickleFiles:
-            # took about 6.5 minutes on production in December 2020
-            # took about 22 minutes on production in June 2024
-            # took 53 minutes with all RNA, DNA up to date on 2025-09-22
-            # Maybe it would be faster to update incrementally, only getting new correspondences,
-            # but it is hard to see how to do that.
-            # Plan: save a copy of the .pickle file (done)
-            #   in a later week, write code that will read the old .pickle file,
-            #   loop through the exp_seq_position_id_1 values to see what we already have,
-            #   then loop over chunks to query what exp_seq_position_id_1 values are new,
-            #   and only query for those
-            #   At any rate, only
-            self.logger.info('Getting the position to position mappings')
-
-            position_to_position = defaultdict(list)                                                            ## A dictionary-like object. It will not raise error. It will provides a default value for the key does not exist. In this case, it will return a empty list object if the key does not exist.
-            count = 0
-            i = 0
-            j = 1
-            chunk_size = 100000
-            newcount = 1
-            found_lines = False
-
-            self.logger.info('Total of %10d position to position correspondences, id up to %10d' % (0,0))
-
-            while j < 9999:
-                if newcount == 0 and found_lines:
-                    # already found data, but then got an empty set of data
-                    j = 9999            # this will be the last query, check for very large ids
-                else:
-                    j = i+1
+    def position_store(self):
+        """Open the store of unit to position and position to position
+        mappings. This is kept in the configured data directory.
 
-                with self.session() as session:
-                    CP = mod.CorrespondencePositions
-                    query = session.query(CP.exp_seq_position_id_1,CP.exp_seq_position_id_2).\
-                    filter(CP.exp_seq_position_id_1 < chunk_size*j).\
-                    filter(CP.exp_seq_position_id_1 >= chunk_size*i).\
-                    yield_per(100000)
+        Returns
+        -------
+        store : pymotifs.chain_chain.position_store.PositionStore
+            The store.
+        """
 
-                    newcount = 0
-                    for id1,id2 in query:
-                        position_to_position[id1].append(id2)
-                        newcount += 1
+        directory = os.path.join(self.config['locations']['data'],
+                                 'chain_chain_positions')
+        return PositionStore(directory)
 
-                    if newcount > 0:
-                        count += newcount
-                        found_lines = True
+    def revision_dates(self, pdbs):
+        """Get the date each of the given pdbs was last revised on, as
+        stored by pdbs.info.
 
-                    print('Total of %10d position to position correspondences, id up to %10d' % (count,chunk_size*j))
-                    self.logger.info('Total of %10d position to position correspondences, id up to %10d' % (count,chunk_size*j))
+        Parameters
+        ----------
+        pdbs : iterable
+            The pdb ids to get revision dates for.
 
-                i = i + 1
+        Returns
+        -------
+        revisions : dict
+            A dict from pdb id to revision date, None if it is not known.
+        """
 
-            pickle.dump(position_to_position, open("position_to_position.pickle", "wb" ), 2)                                ## save the position_to_position object
-            self.logger.info('Wrote pickle file position_to_position.pickle')
-            self.logger.info('Maximum exp_seq_position_id_1 is %d' % max(position_to_position.keys()))
+        revisions = dict((pdb, None) for pdb in pdbs)
+        with self.session() as session:
+            for chunk in ut.grouper(1000, sorted(revisions)):
+                query = session.query(mod.PdbInfo.pdb_id,
+                                      mod.PdbInfo.revision_date).\
+                    filter(mod.PdbInfo.pdb_id.in_(chunk))
+                revisions.update((r.pdb_id, r.revision_date) for r in query)
+        return revisions
+
+    def unit_to_position_mappings(self, needed_pdbs):
+        """Get the mapping from unit id to experimental sequence position for
+        all chains in the given pdbs. Only one symmetry operator is used per
+        chain, and only one alt id of each unit.
 
-            del position_to_position   # clear the memory
+        Parameters
+        ----------
+        needed_pdbs : set
+            The pdb ids to get mappings for.
 
-        return groups_of_chain_ids
+        Returns
+        -------
+        chain_unit_to_position : dict
+            A dict from chain, like '1S72|1|0', to a dict from unit id to
+            experimental sequence position id.
+        """
 
+        chain_unit_to_position = defaultdict(dict)
+
+        # get correspondences between unit ids and experimental sequence positions
+        # sort to put no alt_id before A before B before C, etc.
+        with self.session() as session:
+            EM = mod.ExpSeqUnitMapping
+            UI = mod.UnitInfo
+            UC = mod.UnitCenters
+            query = session.query(EM.unit_id,EM.exp_seq_position_id,UI.sym_op).\
+                join(UI, UI.unit_id == EM.unit_id).\
+                join(UC, UC.unit_id == EM.unit_id).\
+                filter(UC.name == 'glycosidic').\
+                filter(UI.pdb_id.in_(needed_pdbs)).\
+                order_by(UI.pdb_id,UI.model,UI.chain,UI.alt_id.is_(None).desc(),UI.alt_id)
+            rows = [(r.unit_id, r.exp_seq_position_id, r.sym_op) for r in query]
+
+        chain_to_symmetries = defaultdict(set)
+        for unit_id, position, sym_op in rows:
+            if unit_id and "|" in unit_id:    # not sure why, but some rows have None
+                fields = unit_id.split("|")
+                if len(fields) > 3:
+                    ## skip unexpected pdbs
+                    if not fields[0] in needed_pdbs:
+                        continue
+                    chain = "|".join(fields[0:3])   # pdb id, model, chain is the top level key
+                    chain_to_symmetries[chain].add(sym_op)
+        self.logger.info('Got %d raw unit to position mappings' % len(rows))
+
+        for chain, symmetries in chain_to_symmetries.items():
+            if '1_555' in symmetries:
+                # use the default symmetry when available
+                symmetry = '1_555'
+            elif len(symmetries) >= 1:
+                # otherwise use the lowest numbered one, whatever that means
+                symmetry = sorted(symmetries)[0]
+            else:
+                symmetry = ''
+                self.logger.info('No symmetry operators for %s' % chain)
+            # record the symmetry to use for this chain
+            chain_to_symmetries[chain] = symmetry
+
+        chain_to_simple_unit_id = defaultdict(set)
+        for unit_id, position, sym_op in rows:
+            if unit_id and "|" in unit_id:    # not sure why, but some rows have None
+                fields = unit_id.split("|")
+                if len(fields) >= 5:
+                    ## skip unexpected pdbs, just in case
+                    if not fields[0] in needed_pdbs:
+                        continue
+
+                    chain = "|".join(fields[0:3])   # pdb id, model, chain is the top level key
+                    # only store unit ids from the one designated symmetry operator
+                    if sym_op == chain_to_symmetries[chain]:
+                        lf = len(fields)
+                        if lf in [5,6,7]:
+                            # plain or just an alt id
+                            simple_unit_id = "|".join([fields[0],fields[1],fields[2],'',fields[4]])  # remove sequence
+                        elif lf == 8:
+                            # insertion code, possibly with alt_id
+                            # remove sequence and alt_id
+                            simple_unit_id = "|".join([fields[0],fields[1],fields[2],'',fields[4],fields[5],'',fields[7]])
+                        else:
+                            # symmetry, possibly with insertion code, possibly with alt_id
+                            # remove sequence and alt_id
+                            simple_unit_id = "|".join([fields[0],fields[1],fields[2],'',fields[4],fields[5],'',fields[7],fields[8]])
+
+                        # only store one version of each unit id
+                        if not simple_unit_id in chain_to_simple_unit_id[chain]:
+                            chain_to_simple_unit_id[chain].add(simple_unit_id)
+                            chain_unit_to_position[chain][unit_id] = position
+                        else:
+                            self.logger.info('Unit id %s would duplicate earlier %s' % (unit_id,simple_unit_id))
+
+        return chain_unit_to_position
+
+    def position_to_position_pairs(self, correspondence_ids):
+        """Get all pairs of corresponding experimental sequence positions for
+        the given correspondences.
+
+        Parameters
+        ----------
+        correspondence_ids : list
+            The correspondence ids to get positions for.
+
+        Returns
+        -------
+        pairs : list
+            A list of (exp_seq_position_id_1, exp_seq_position_id_2) tuples.
+        """
+
+        with self.session() as session:
+            CP = mod.CorrespondencePositions
+            query = session.query(CP.exp_seq_position_id_1,CP.exp_seq_position_id_2).\
+                filter(CP.correspondence_id.in_(correspondence_ids)).\
+                yield_per(100000)
+            return [(id1, id2) for id1, id2 in query if id1 is not None and id2 is not None]
 
     def is_missing(self, entry, **kwargs):
         """Determine if we do not have any data. If we have no data then we
@@ -491,9 +519,13 @@ class Loader(core.SimpleLoader):
         chain1 = info1['ife_id'].split('+')[0]
         chain2 = info2['ife_id'].split('+')[0]
 
+        # decode each chain once
+        units1 = unit_to_position.get(chain1,{})
+        units2 = unit_to_position.get(chain2,{})
+
         # number of resolved nucleotides
-        length1 = len(unit_to_position.get(chain1,[]))
-        length2 = len(unit_to_position.get(chain2,[]))
+        length1 = len(units1)
+        length2 = len(units2)
 
         if length1 == 0:
             self.logger.warning("No unit to position mapping for %s" % chain1)
@@ -508,14 +540,14 @@ class Loader(core.SimpleLoader):
             # have different ids for the same position
             positions2 = set()           # all positions in chain2
             positions2_to_unit2 = {}     # map those positions back to units
-            for unit,position in unit_to_position[chain2].items():
+            for unit,position in units2.items():
                 positions2.add(position)
                 positions2_to_unit2[position] = unit
 
             # Loop over units in chain1, map to positions, and intersect with
             # the positions that go with units in chain2
             # sort by position so it's easier to read and understand
-            for unit1,position1 in sorted(unit_to_position[chain1].items(), key=lambda x: x[1]):
+            for unit1,position1 in sorted(units1.items(), key=lambda x: x[1]):
                 positions1 = set(position_to_position[position1])
                 intersection = positions1 & positions2  # intersect positions from 1 and from 2
                 positions2 = positions2 - intersection
@@ -693,35 +725,83 @@ class Loader(core.SimpleLoader):
         return OK_pairs
 
 
-    def load_centers_rotations_pickle(self,info,allunitdictionary):
+    def load_chain_geometry(self, chain_string):
+        """Load the centers and rotations of all units in a chain from the
+        pickle file written by the units.center_rotation stage.
 
-        for chain_string in info['ife_id'].split('+'):
-            # unit directory relative to hub-core
-            unit_directory = 'data/units'
-            picklefile = os.path.join(unit_directory,chain_string.replace('|','-') + '_NA.pickle')
+        Parameters
+        ----------
+        chain_string : str
+            The chain, like '1S72|1|0'.
 
-            if not chain_string in allunitdictionary:
+        Returns
+        -------
+        geometry : ChainGeometry
+            The centers and rotations, or None if the file could not be read.
+        """
 
-                try:
-                    unit_ids, chainIndices, centers, rotations = pickle.load(open(picklefile,"rb"))
+        # unit directory relative to hub-core
+        unit_directory = 'data/units'
+        picklefile = os.path.join(unit_directory,chain_string.replace('|','-') + '_NA.pickle')
 
-                    allunitdictionary[chain_string] = True    # note that this chain was read
+        try:
+            with open(picklefile, "rb") as raw:
+                unit_ids, chainIndices, centers, rotations = pickle.load(raw)
+        except Exception:
+            self.logger.info("Could not read pickle file %s " % picklefile)
+            return None
 
-                    # add center, rotation pairs to the dictionary according to unit id
-                    for i in range(0,len(unit_ids)):
-                        if len(centers[i]) == 3 and len(rotations[i]) == 3:
-                            allunitdictionary[unit_ids[i]] = (centers[i],rotations[i])
-                        else:
-                            self.logger.info("Trouble with center/rotation for %s" % unit_ids[i])
-                            self.logger.info(str(centers[i]))
-                            self.logger.info(str(rotations[i]))
+        index = {}
+        good_centers = []
+        good_rotations = []
+        for i in range(0,len(unit_ids)):
+            if len(centers[i]) == 3 and len(rotations[i]) == 3:
+                index[unit_ids[i]] = len(good_centers)
+                good_centers.append(centers[i])
+                good_rotations.append(rotations[i])
+            else:
+                self.logger.info("Trouble with center/rotation for %s" % unit_ids[i])
+                self.logger.info(str(centers[i]))
+                self.logger.info(str(rotations[i]))
+
+        self.logger.info('load_chain_geometry: Loaded %s' % chain_string)
+        return ChainGeometry(index,
+                             np.array(good_centers, dtype=float).reshape(-1, 3),
+                             np.array(good_rotations, dtype=float).reshape(-1, 3, 3))
+
+    def geometry_cache(self):
+        """Create the cache of chain centers and rotations used while
+        computing the discrepancies of a group.
+        """
+        return ChainGeometryCache(self.load_chain_geometry,
+                                  max_units=self.geometry_cache_units)
+
+    def cache_friendly_order(self, required_pairs):
+        """Order the pairs of chains so that pairs which use the same chains
+        are computed near each other. The pairs are arranged in square blocks
+        of `geometry_block_size` chains, so only the chains of two blocks
+        need to be cached at once.
+
+        Parameters
+        ----------
+        required_pairs : list
+            A list of (corr_id, chain1_id, chain2_id) tuples.
+
+        Returns
+        -------
+        ordered : list
+            The same pairs in a cache friendly order.
+        """
 
-                    self.logger.info('load_centers_rotations_pickle: Loaded %s' % chain_string)
+        chains = sorted(set(it.chain.from_iterable(p[1:] for p in required_pairs)))
+        position = dict((chain, i) for i, chain in enumerate(chains))
+        size = self.geometry_block_size
 
-                except:
-                    self.logger.info("Could not read pickle file %s " % picklefile)
+        def key(pair):
+            first, second = sorted((position[pair[1]], position[pair[2]]))
+            return (first // size, second // size, first, second)
 
-        return allunitdictionary
+        return sorted(required_pairs, key=key)
 
     def compare_list_of_pairs(self,old_list,new_list):
         """
@@ -782,16 +862,91 @@ class Loader(core.SimpleLoader):
         return disc
 
 
+    def chains_info(self, chain_ids):
+        """Load the required information about many chains at once. Since we
+        want to use the results of this loader for the NR stages we use the
+        same data as was in the IFE's the given chains are a part of. This
+        uses two queries for each chunk of chain ids, instead of two queries
+        per chain.
+
+        Parameters
+        ----------
+        chain_ids : iterable
+            The chain ids to look up.
+
+        Returns
+        -------
+        chain_info : dict
+            A dict from chain id to a dict with a 'chain_name', 'chain_id',
+            `pdb`, `model`, `ife_id`, `sym_op`, 'alt_id', and `name` keys.
+            Chains that could not be loaded are not present.
+        """
+
+        chain_info = {}
+        for chunk in ut.grouper(self.chunk_size, sorted(set(chain_ids))):
+            with self.session() as session:
+                query = session.query(mod.ChainInfo.chain_name,
+                                      mod.ChainInfo.chain_id,
+                                      mod.ChainInfo.chain_length,
+                                      mod.IfeInfo.pdb_id.label('pdb'),
+                                      mod.IfeInfo.model,
+                                      mod.IfeInfo.ife_id,
+                                      ).\
+                    join(mod.IfeChains,
+                         mod.IfeChains.chain_id == mod.ChainInfo.chain_id).\
+                    join(mod.IfeInfo,
+                         mod.IfeInfo.ife_id == mod.IfeChains.ife_id).\
+                    filter(mod.IfeInfo.new_style == True).\
+                    filter(mod.ChainInfo.chain_id.in_(chunk))
+
+                ifes = {}
+                for row in query:
+                    if row.chain_id not in ifes:
+                        ifes[row.chain_id] = ut.row2dict(row)
+
+            with self.session() as session:
+                query = session.query(mod.ChainInfo.chain_id,
+                                      mod.UnitInfo.sym_op,
+                                      mod.UnitInfo.alt_id).\
+                    join(mod.UnitInfo,
+                         (mod.ChainInfo.pdb_id == mod.UnitInfo.pdb_id) &
+                         (mod.ChainInfo.chain_name == mod.UnitInfo.chain)).\
+                    join(mod.UnitCenters,
+                         mod.UnitCenters.unit_id == mod.UnitInfo.unit_id).\
+                    join(mod.UnitRotations,
+                         mod.UnitRotations.unit_id == mod.UnitInfo.unit_id).\
+                    filter(mod.ChainInfo.chain_id.in_(chunk)).\
+                    distinct()
+
+                units = defaultdict(list)
+                for row in query:
+                    units[row.chain_id].append(row)
+
+            for chain_id, ife in ifes.items():
+                if not units[chain_id]:
+                    continue
+                ife['sym_op'] = pick(['1_555', 'P_1'], 'sym_op', units[chain_id])
+                ife['alt_id'] = pick([None, 'A', 'B'], 'alt_id', units[chain_id])
+                ife['name'] = ife['ife_id'] + '+' + ife['sym_op']
+                chain_info[chain_id] = ife
+
+        return chain_info
+
+
     def get_chain_info(self, chain_id):
-        """Load the required information about a chain. Since we want to use
-        the results of this loader for the NR stages we use the same data as
-        was in the IFE's the given chain is a part of.
+        """Load the required information about a chain. See `chains_info`,
+        which should be used when loading many chains.
 
         Parameters
         ----------
         chain_id : int
             The chain id to look up.
 
+        Raises
+        ------
+        core.InvalidState
+            If the chain could not be loaded.
+
         Returns
         -------
         ife_info : dict
@@ -799,96 +954,77 @@ class Loader(core.SimpleLoader):
             `sym_op`, 'alt_id', and `name` keys.
         """
 
-        with self.session() as session:
-            query = session.query(mod.ChainInfo.chain_name,
-                                  mod.ChainInfo.chain_id,
-                                  mod.ChainInfo.chain_length,
-                                  mod.IfeInfo.pdb_id.label('pdb'),
-                                  mod.IfeInfo.model,
-                                  mod.IfeInfo.ife_id,
-                                  ).\
-                join(mod.IfeChains,
-                     mod.IfeChains.chain_id == mod.ChainInfo.chain_id).\
-                join(mod.IfeInfo,
-                     mod.IfeInfo.ife_id == mod.IfeChains.ife_id).\
-                filter(mod.IfeInfo.new_style == True).\
-                filter(mod.ChainInfo.chain_id == chain_id)
-
-            # the following lines were not indented this much, changed 2022-05-18
-            result = [row for row in query]
-
-            #if not query.count():
-            if len(result) == 0:
-                raise core.InvalidState("Could not load chain with id %s" %
-                                        chain_id)
-            ife = ut.row2dict(query.first())
-
-        with self.session() as session:
-            query = session.query(mod.UnitInfo.sym_op,
-                                  mod.UnitInfo.alt_id).\
-                join(mod.ChainInfo,
-                     (mod.ChainInfo.pdb_id == mod.UnitInfo.pdb_id) &
-                     (mod.ChainInfo.chain_name == mod.UnitInfo.chain)).\
-                join(mod.UnitCenters,
-                     mod.UnitCenters.unit_id == mod.UnitInfo.unit_id).\
-                join(mod.UnitRotations,
-                     mod.UnitRotations.unit_id == mod.UnitInfo.unit_id).\
-                filter(mod.ChainInfo.chain_id == chain_id).\
-                distinct()
-
-            result = [row for row in query]
+        chain_info = self.chains_info([chain_id])
+        if chain_id not in chain_info:
+            raise core.InvalidState("Could not get info for chain %s" %
+                                    chain_id)
+        return chain_info[chain_id]
 
-            #if not query.count():       # caused QueuePool limit of size 40 error
-            if len(result) == 0:
-                raise core.InvalidState("Could not get info for chain %s" %
-                                        chain_id)
-
-            ife['sym_op'] = pick(['1_555', 'P_1'], 'sym_op', query)
-            ife['alt_id'] = pick([None, 'A', 'B'], 'alt_id', query)
-            ife['name'] = ife['ife_id'] + '+' + ife['sym_op']
-            return ife
 
-
-    def __correspondence_query__(self, chain1, chain2):
-        """Create a query for correspondences between the two chains. This only
-        checks in the given direction.
+    def correspondence_ids(self, chain_ids):
+        """Load the correspondence ids between all given chains. This uses one
+        query per chunk of chain ids, instead of up to two queries for each
+        pair of chains.
 
         Parameters
         ----------
-        chain1 : int
-            The first chain id.
-        chain2 : int
-            The second chain id.
+        chain_ids : iterable
+            The chain ids to look up correspondences between.
+
+        Returns
+        -------
+        corr_ids : dict
+            A dict from a (chain1, chain2) tuple to the correspondence id of a
+            good alignment of the sequence of chain1 to the sequence of chain2.
+            Only the direction that is stored in the database is present, use
+            `lookup_corr_id` to look up a pair in either direction.
+        """
+
+        chain_ids = sorted(set(chain_ids))
+        corr_ids = {}
+        for chunk in ut.grouper(self.chunk_size, chain_ids):
+            with self.session() as session:
+                info = mod.CorrespondenceInfo
+                mapping1 = aliased(mod.ExpSeqChainMapping)
+                mapping2 = aliased(mod.ExpSeqChainMapping)
+                query = session.query(info.correspondence_id,
+                                      mapping1.chain_id.label('chain1'),
+                                      mapping2.chain_id.label('chain2')).\
+                    join(mapping1, mapping1.exp_seq_id == info.exp_seq_id_1).\
+                    join(mapping2, mapping2.exp_seq_id == info.exp_seq_id_2).\
+                    filter(mapping1.chain_id.in_(chunk)).\
+                    filter(mapping2.chain_id.in_(chain_ids)).\
+                    filter(info.good_alignment >= 1)
+
+                for result in query:
+                    key = (result.chain1, result.chain2)
+                    if key not in corr_ids:
+                        corr_ids[key] = result.correspondence_id
+        return corr_ids
+
+
+    def lookup_corr_id(self, corr_ids, chain_id1, chain_id2):
+        """Find the correspondence id between two chains in the result of
+        `correspondence_ids`, checking both directions.
 
         Returns
         -------
         corr_id : int
-            The correspondence id if there is an alignment between the two
-            chains.
+            The correspondence id or None if there is no alignment between the
+            two chains.
         """
 
-        with self.session() as session:
-            info = mod.CorrespondenceInfo
-            mapping1 = aliased(mod.ExpSeqChainMapping)
-            mapping2 = aliased(mod.ExpSeqChainMapping)
-            query = session.query(info.correspondence_id).\
-                join(mapping1, mapping1.exp_seq_id == info.exp_seq_id_1).\
-                join(mapping2, mapping2.exp_seq_id == info.exp_seq_id_2).\
-                filter(mapping1.chain_id == chain1).\
-                filter(mapping2.chain_id == chain2).\
-                filter(info.good_alignment >= 1)
-
-            result = query.first()
-            if result:
-                return result.correspondence_id
-            return None
+        corr_id = corr_ids.get((chain_id1, chain_id2))
+        if corr_id is None:
+            corr_id = corr_ids.get((chain_id2, chain_id1))
+        return corr_id
 
 
     def corr_id(self, chain_id1, chain_id2):
-        """Given two chain ids, load the correspondence id between them. This
-        will raise an exception if these chains have not been aligned, or if
-        there is more than one alignment between these chains. The chain ids
-        should be the ids used in the database.
+        """Given two chain ids, load the correspondence id between them. The
+        chain ids should be the ids used in the database. See
+        `correspondence_ids`, which should be used when looking up many
+        pairs.
 
         Parameters
         ----------
@@ -897,25 +1033,18 @@ class Loader(core.SimpleLoader):
         chain_id2 : int
             Second chain id.
 
-        Raises
-        ------
-        core.Skip
-            If there is no alignment between the two chains
-
         Returns
         -------
         corr_id : int
-            The correspondence id for the alignment between the two chains.
+            The correspondence id for the alignment between the two chains,
+            or None if there is no alignment between the two chains.
         """
 
         self.logger.debug("corr_id: chain_id1: %s" % chain_id1)
         self.logger.debug("corr_id: chain_id2: %s" % chain_id2)
 
-        corr_id = self.__correspondence_query__(chain_id1, chain_id2)
-        if corr_id is None:
-            corr_id = self.__correspondence_query__(chain_id2, chain_id1)
-
-        return corr_id
+        corr_ids = self.correspondence_ids([chain_id1, chain_id2])
+        return self.lookup_corr_id(corr_ids, chain_id1, chain_id2)
 
 
     def __check_matrices__(self, table, info):
@@ -967,11 +1096,12 @@ class Loader(core.SimpleLoader):
         return self.__check_matrices__(mod.UnitCenters, info) and \
             self.__check_matrices__(mod.UnitRotations, info)
 
-    def gather_matching_centers_rotations(self,unit_pairs,allunitdictionary):
+    def gather_matching_centers_rotations(self,unit_pairs,geometry):
 
         """
         loop over pairs of unit ids, pull out corresponding center and
-        rotation matrices for the pairs of unit ids.
+        rotation matrices for the pairs of unit ids from the
+        ChainGeometryCache geometry.
         """
 
         c1 = []
@@ -996,11 +1126,13 @@ class Loader(core.SimpleLoader):
                 seen1.add(unit1)
                 seen2.add(unit2)
 
-                if allunitdictionary.get(unit1) is not None and allunitdictionary.get(unit2) is not None:
-                    c1.append(allunitdictionary[unit1][0])
-                    c2.append(allunitdictionary[unit2][0])
-                    r1.append(allunitdictionary[unit1][1])
-                    r2.append(allunitdictionary[unit2][1])
+                data1 = geometry.unit(unit1)
+                data2 = geometry.unit(unit2)
+                if data1 is not None and data2 is not None:
+                    c1.append(data1[0])
+                    c2.append(data2[0])
+                    r1.append(data1[1])
+                    r2.append(data2[1])
 
         return np.array(c1), np.array(c2), np.array(r1), np.array(r2)
 
@@ -1056,14 +1188,38 @@ class Loader(core.SimpleLoader):
                 disc = -1
 
 
+        return self.discrepancy_entries(info1, info2, corr_id, disc, len(c1))
+
+    def discrepancy_entries(self, info1, info2, corr_id, discrepancy, count):
+        """Build the data to store for a computed discrepancy, in both orders.
+
+        Parameters
+        ----------
+        info1 : dict
+            The first chain.
+        info2 : dict
+            The second chain.
+        corr_id : int
+            The correspondence id.
+        discrepancy : float
+            The discrepancy between the chains.
+        count : int
+            The number of matched nucleotides used.
+
+        Returns
+        -------
+        entries : list
+            A list of two dictonaries as described in `calculate_discrepancy`.
+        """
+
         entry1 = {
             'chain_id_1': info1['chain_id'],
             'chain_id_2': info2['chain_id'],
             'model_1': info1['model'],
             'model_2': info2['model'],
             'correspondence_id': corr_id,
-            'discrepancy': float(disc),
-            'num_nucleotides': len(c1)
+            'discrepancy': float(discrepancy),
+            'num_nucleotides': count
         }
 
         entry2 = {
@@ -1072,12 +1228,61 @@ class Loader(core.SimpleLoader):
             'model_1': info2['model'],
             'model_2': info1['model'],
             'correspondence_id': corr_id,
-            'discrepancy': float(disc),
-            'num_nucleotides': len(c1)
+            'discrepancy': float(discrepancy),
+            'num_nucleotides': count
         }
 
         return [entry1, entry2]
 
+    def calculate_discrepancies(self, batch):
+        """
+        Compute the discrepancies for many pairs of chains at once. Pairs
+        with at least 3 matched nucleotides are computed together with
+        `pymotifs.utils.discrepancy.batch_matrix_discrepancy`, which gives
+        the same values as `calculate_discrepancy` does for each pair. If the
+        batched computation fails, each pair is computed on its own instead.
+
+        Parameters
+        ----------
+        batch : list
+            A list of (info1, info2, corr_id, c1, c2, r1, r2) tuples, with the
+            same meaning as the arguments to `calculate_discrepancy`.
+
+        Returns
+        -------
+        entries : list
+            A list with the result of `calculate_discrepancy` for each pair,
+            in the order given.
+        """
+
+        computable = [i for i, b in enumerate(batch) if len(b[3]) >= 3]
+        values = {}
+        if computable:
+            try:
+                stacked = [np.concatenate([batch[i][k] for i in computable])
+                           for k in range(3, 7)]
+                lengths = [len(batch[i][3]) for i in computable]
+                found = disc.batch_matrix_discrepancy(stacked[0], stacked[2],
+                                                      stacked[1], stacked[3],
+                                                      lengths)
+                values = dict(zip(computable, found))
+            except Exception as err:
+                self.logger.warning("Batched discrepancy failed, computing %d pairs one at a time" %
+                                    len(computable))
+                self.logger.exception(err)
+                values = {}
+
+        entries = []
+        for index, (info1, info2, corr_id, c1, c2, r1, r2) in enumerate(batch):
+            value = values.get(index)
+            if value is None or np.isnan(value):
+                entries.append(self.calculate_discrepancy(info1, info2, corr_id,
+                                                          c1, c2, r1, r2))
+            else:
+                entries.append(self.discrepancy_entries(info1, info2, corr_id,
+                                                        value, len(c1)))
+        return entries
+
     def data(self, chain_ids, **kwargs):
         """
         New in December 2020.
@@ -1137,18 +1342,26 @@ class Loader(core.SimpleLoader):
 
         required_pairs = []
         log_count = 0
+
+        # look up all correspondence ids and chain information with a few queries
+        corr_ids = {}
         chain_info = {}
+        if len(check_pairs) > 0:
+            corr_ids = self.correspondence_ids(chain_ids)
+            chain_info = self.chains_info(chain_ids)
+
+        def info(chain_id):
+            if chain_id not in chain_info:
+                raise core.InvalidState("Could not get info for chain %s" %
+                                        chain_id)
+            return chain_info[chain_id]
 
         for (chain1_id,chain2_id) in check_pairs:
-            corr_id = self.corr_id(chain1_id, chain2_id)
+            corr_id = self.lookup_corr_id(corr_ids, chain1_id, chain2_id)
             if corr_id is None:
                 if log_count < 20:
-                    if not chain1_id in chain_info:
-                        chain_info[chain1_id] = self.get_chain_info(chain1_id)
-                    if not chain2_id in chain_info:
-                        chain_info[chain2_id] = self.get_chain_info(chain2_id)
-                    info1 = chain_info[chain1_id]
-                    info2 = chain_info[chain2_id]
+                    info1 = info(chain1_id)
+                    info2 = info(chain2_id)
 
                     self.logger.info("No correspondence id between chains %s %s and %s %s" % (info1['ife_id'],chain1_id,info2['ife_id'],chain2_id))
                     log_count = log_count + 1
@@ -1173,29 +1386,22 @@ class Loader(core.SimpleLoader):
             # 50 seconds for T.th. SSU on rnatest in December 2020
 
             self.logger.info("Retrieving chain information once for each chain")
-            chain_info = {}
-            for chain_id in chain_ids:
-                chain_info[chain_id] = self.get_chain_info(chain_id)
+            chain_info = self.chains_info(chain_ids)
 
-            # takes about 44 seconds on rnatest in December 2020
-            # takes about 2 seconds on rnaprod2 in September 2024
-            self.logger.info("Loading unit to position correspondences")
-            unit_to_position = pickle.load(open("unit_to_position.pickle","rb"))
-
-            # takes about 45 seconds on rnatest in December 2020
-            # takes about 7 seconds on rnaprod2 in September 2024
-            self.logger.info("Loading position to position correspondences")
-            position_to_position = pickle.load(open("position_to_position.pickle","rb"))
+            # memory mapped, so only the chains and positions used are read
+            self.logger.info("Opening unit to position and position to position correspondences")
+            store = self.position_store()
+            unit_to_position = store.unit_to_position()
+            position_to_position = store.position_to_position()
 
             # Loop over needed pairs of chains, query for unit correspondences, and calculate discrepancies
             # The slowest part of the process is the query for unit correspondences.
             # One hope was that querying by corr_id and the two chains and then narrowing down to the desired
             # PDBs would be faster than doing them individually, but that is sometimes much slower.
 
-            allunitdictionary = defaultdict()            # store up centers and rotations
+            geometry = self.geometry_cache()             # cache of centers and rotations
 
             current = 1
-            chain1_seen = set()
 
             LL = min(len(already_computed_discrepancy),50)
 
@@ -1207,13 +1413,8 @@ class Loader(core.SimpleLoader):
                     self.logger.info("Re-computing discrepancy %d for this group" % (current))
                     current += 1
 
-                    chain1_seen.add(chain1_id)
-                    if len(chain1_seen) > 20:
-                        chain1_seen = set()
-                        allunitdictionary = defaultdict()    # avoid accumulating data forever; reset sometimes
-
-                    info1 = chain_info[chain1_id]
-                    info2 = chain_info[chain2_id]
+                    info1 = info(chain1_id)
+                    info2 = info(chain2_id)
 
                     # new method
                     self.logger.info("Intersect for matching units for chain %s, chain %s" % (info1['ife_id'],info2['ife_id']))
@@ -1223,17 +1424,11 @@ class Loader(core.SimpleLoader):
                     # unit_pairs = self.filter_unit_correspondences(new_unit_pairs,info1,info2)
 
                     # show some matched units to build confidence
-                    if len(unit_pairs) > 0:
-                        for i in range(0,min(5,len(unit_pairs))):
-                            self.logger.info("Matched unit ids %s and %s" % unit_pairs[i])
-
-                        # load center and rotation data for the current ifes, if not already loaded
-                        allunitdictionary = self.load_centers_rotations_pickle(info1,allunitdictionary)
-                        allunitdictionary = self.load_centers_rotations_pickle(info2,allunitdictionary)
-
+                    for i in range(0,min(5,len(unit_pairs))):
+                        self.logger.info("Matched unit ids %s and %s" % unit_pairs[i])
 
                     # gather matching centers and rotations for these chains
-                    [c1, c2, r1, r2] = self.gather_matching_centers_rotations(unit_pairs,allunitdictionary)
+                    [c1, c2, r1, r2] = self.gather_matching_centers_rotations(unit_pairs,geometry)
                     self.logger.info("Got matching centers and rotations")
 
                     # compute the discrepancy between these IFEs
@@ -1255,45 +1450,32 @@ class Loader(core.SimpleLoader):
 
         if not Recompute and len(required_pairs) > 0:
 
-            # takes about 44 seconds on rnatest in December 2020
-            self.logger.info("Loading unit to position correspondences")
-            unit_to_position = pickle.load(open("unit_to_position.pickle","rb"))
-
-            # takes about 45 seconds on rnatest in December 2020
-            self.logger.info("Loading position to position correspondences")
-            position_to_position = pickle.load(open("position_to_position.pickle","rb"))
+            # memory mapped, so only the chains and positions used are read
+            self.logger.info("Opening unit to position and position to position correspondences")
+            store = self.position_store()
+            unit_to_position = store.unit_to_position()
+            position_to_position = store.position_to_position()
 
             # Loop over needed pairs of chains, query for unit correspondences, and calculate discrepancies
             # The slowest part of the process is the query for unit correspondences.
             # One hope was that querying by corr_id and the two chains and then narrowing down to the desired
             # PDBs would be faster than doing them individually, but that is sometimes much slower.
 
-            allunitdictionary = defaultdict()            # store up centers and rotations
+            # centers and rotations are loaded once per chain and kept while
+            # they fit, so order the pairs to reuse the cached chains
+            geometry = self.geometry_cache()
+            required_pairs = self.cache_friendly_order(required_pairs)
 
             current = 0
-            chain1_seen = set()                          # count how many times a specific chain1 is seen
+            batch = []                                   # pairs waiting for their discrepancy
             for (corr_id,chain1_id,chain2_id) in required_pairs:
 
                 current += 1
                 self.logger.info("Computing discrepancy %d of %d for this group" % (current,len(required_pairs)))
 
-                chain1_seen.add(chain1_id)
-                if len(chain1_seen) > 20:
-                    chain1_seen = set()
-                    allunitdictionary = defaultdict()    # avoid accumulating data forever; reset sometimes
-
-                # Store chain info so that each one is only looked up once.
-                # It would seem to be better to just retrieve all of them at once,
-                # but that crashed the pipeline once with "QueuePool limit overflow"
-                # so it seems better to do them one by one.
-
-                if not chain1_id in chain_info:
-                    chain_info[chain1_id] = self.get_chain_info(chain1_id)
-                if not chain2_id in chain_info:
-                    chain_info[chain2_id] = self.get_chain_info(chain2_id)
-
-                info1 = chain_info[chain1_id]
-                info2 = chain_info[chain2_id]
+                # chain info was retrieved for all chains at once above
+                info1 = info(chain1_id)
+                info2 = info(chain2_id)
 
                 # Future work:
                 # Recognize multiple chains for IFEs made of more than one chain; currently only 1st chain is used
@@ -1320,22 +1502,21 @@ class Loader(core.SimpleLoader):
                 """
 
                 # show some matched units to build confidence
-                if len(unit_pairs) > 0:
-                    for i in range(0,min(5,len(unit_pairs))):
-                        self.logger.info("Matched unit ids %s and %s" % unit_pairs[i])
+                for i in range(0,min(5,len(unit_pairs))):
+                    self.logger.info("Matched unit ids %s and %s" % unit_pairs[i])
 
-                    # load center and rotation data for the current ifes, if not already loaded
-                    allunitdictionary = self.load_centers_rotations_pickle(info1,allunitdictionary)
-                    allunitdictionary = self.load_centers_rotations_pickle(info2,allunitdictionary)
-
-                # gather matching centers and rotations for these chains
-                [c1, c2, r1, r2] = self.gather_matching_centers_rotations(unit_pairs,allunitdictionary)
+                # gather matching centers and rotations for these chains,
+                # loading them if they are not already cached
+                [c1, c2, r1, r2] = self.gather_matching_centers_rotations(unit_pairs,geometry)
                 self.logger.info("Gathered %d matching centers and rotations for %s and %s, %d of %d in this group" % (len(c1),info1['ife_id'],info2['ife_id'],current,len(required_pairs)))
 
-                # compute the discrepancy between these IFEs
+                # compute the discrepancies between IFEs in batches
                 # if wrong numbers of matched nucleotides, discrepancy will be -1
-                discrepancies = self.calculate_discrepancy(info1, info2, corr_id, c1, c2, r1, r2)
-
-                self.logger.info("Discrepancy to load: %s" % discrepancies[0])
-                for d in discrepancies:
-                    yield mod.ChainChainSimilarity(**d)
+                batch.append((info1, info2, corr_id, c1, c2, r1, r2))
+                if len(batch) >= self.discrepancy_batch_size or current == len(required_pairs):
+                    for discrepancies in self.calculate_discrepancies(batch):
+                        self.logger.info("Discrepancy to load: %s" % discrepancies[0])
+                        for d in discrepancies:
+                            yield mod.ChainChainSimilarity(**d)
+                    batch = []
+                    self.logger.info("Geometry cache: %s" % geometry.stats())
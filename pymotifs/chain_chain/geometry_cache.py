@@ -0,0 +1,121 @@
+"""A size bounded cache of the base centers and rotation matrices of chains.
+Computing the discrepancies of a group of chains needs the centers and
+rotations of each chain many times, once for every pair it is a part of.
+Reading them from the pickle files each time dominates the run time, so they
+are kept here, as NumPy arrays, until the cache grows too large and the least
+recently used chains are dropped.
+"""
+
+import collections as coll
+
+
+class ChainGeometry(object):
+    """The centers and rotations of all units in one chain.
+
+    Attributes
+    ----------
+    index : dict
+        A dict from unit id to the row of that unit.
+    centers : numpy.array
+        A N x 3 array of base centers.
+    rotations : numpy.array
+        A N x 3 x 3 array of rotation matrices.
+    """
+
+    def __init__(self, index, centers, rotations):
+        self.index = index
+        self.centers = centers
+        self.rotations = rotations
+
+    def __len__(self):
+        return len(self.index)
+
+
+class ChainGeometryCache(object):
+    """A least recently used cache of `ChainGeometry` objects keyed by chain,
+    like '1S72|1|0'. The size of the cache is bounded by the total number of
+    units in all cached chains.
+
+    Attributes
+    ----------
+    loader : function
+        A function that takes a chain and returns a `ChainGeometry` or None if
+        it could not be loaded.
+    max_units : int
+        The maximum total number of units to keep.
+    hits : int
+        Number of lookups that found the chain in the cache.
+    misses : int
+        Number of lookups that had to load the chain.
+    evictions : int
+        Number of chains removed to stay within max_units.
+    """
+
+    def __init__(self, loader, max_units=2000000):
+        self.loader = loader
+        self.max_units = max_units
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._units = 0
+        self._chains = coll.OrderedDict()
+
+    def __len__(self):
+        return len(self._chains)
+
+    def get(self, chain):
+        """Get the geometry of a chain, loading it if needed.
+
+        Parameters
+        ----------
+        chain : str
+            The chain, given as pdb|model|chain.
+
+        Returns
+        -------
+        geometry : ChainGeometry
+            The geometry or None if it could not be loaded.
+        """
+
+        if chain in self._chains:
+            self.hits += 1
+            self._chains.move_to_end(chain)
+            return self._chains[chain]
+
+        self.misses += 1
+        geometry = self.loader(chain)
+        self._chains[chain] = geometry
+        self._units += len(geometry or [])
+        while self._units > self.max_units and len(self._chains) > 1:
+            _, evicted = self._chains.popitem(last=False)
+            self._units -= len(evicted or [])
+            self.evictions += 1
+        return geometry
+
+    def unit(self, unit_id):
+        """Get the center and rotation matrix of a unit.
+
+        Parameters
+        ----------
+        unit_id : str
+            The unit id.
+
+        Returns
+        -------
+        data : tuple
+            A (center, rotation) tuple or None if the unit is not known.
+        """
+
+        chain = '|'.join(unit_id.split('|')[0:3])
+        geometry = self.get(chain)
+        if geometry is None or unit_id not in geometry.index:
+            return None
+        row = geometry.index[unit_id]
+        return geometry.centers[row], geometry.rotations[row]
+
+    def stats(self):
+        """Describe the usage of the cache, for logging.
+        """
+        return ("%d hits, %d misses, %d evictions, %d chains with %d units" %
+                (self.hits, self.misses, self.evictions, len(self._chains),
+                 self._units))
@@ -0,0 +1,377 @@
+"""A persistent store of the mappings needed to match up units between chains.
+This replaces the unit_to_position.pickle and position_to_position.pickle
+files. Those had to be loaded completely, which takes several GB of memory,
+for each group of chains. Here the data is kept in NumPy files that are memory
+mapped, so only the parts that are looked up are read and several processes
+can share one copy through the page cache.
+
+The store is a directory with a manifest and a list of segments. Each update
+writes a new segment containing only the new data, either the units of new
+PDB files or the positions of new correspondences. Lookups consult every
+segment, and `compact` merges all segments into one when there are too many.
+The revision date of each PDB file is recorded with its units, so the units of
+files revised since can be replaced.
+"""
+
+import collections as coll
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+
+
+class UnitPositions(object):
+    """A read only mapping from a chain, like '1S72|1|0', to a dict of the
+    unit ids in that chain and the experimental sequence position id of each
+    unit. This mimics the dict that was stored in unit_to_position.pickle.
+    The most recently used chains are kept decoded, as each chain is looked up
+    for many pairs of chains in a row.
+
+    Attributes
+    ----------
+    max_decoded : int
+        The number of decoded chains to keep.
+    """
+
+    max_decoded = 16
+
+    def __init__(self, index, segments):
+        self._index = index
+        self._segments = segments
+        self._decoded = coll.OrderedDict()
+
+    def __contains__(self, chain):
+        return chain in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def keys(self):
+        return self._index.keys()
+
+    def __getitem__(self, chain):
+        if chain in self._decoded:
+            self._decoded.move_to_end(chain)
+            return self._decoded[chain]
+
+        name, start, stop = self._index[chain]
+        units, positions = self._segments[name]
+        decoded = dict(zip((u.decode('ascii') for u in units[start:stop]),
+                           (int(p) for p in positions[start:stop])))
+        self._decoded[chain] = decoded
+        if len(self._decoded) > self.max_decoded:
+            self._decoded.popitem(last=False)
+        return decoded
+
+    def get(self, chain, default=None):
+        if chain not in self._index:
+            return default
+        return self[chain]
+
+
+class PositionPositions(object):
+    """A read only mapping from an experimental sequence position id to the
+    list of all positions it corresponds to. Like the defaultdict that was
+    stored in position_to_position.pickle this gives an empty list for unknown
+    positions.
+    """
+
+    def __init__(self, segments):
+        self._segments = segments
+
+    def __getitem__(self, position):
+        found = []
+        for keys, offsets, values in self._segments:
+            index = np.searchsorted(keys, position)
+            if index < len(keys) and keys[index] == position:
+                start, stop = offsets[index], offsets[index + 1]
+                found.extend(int(v) for v in values[start:stop])
+        return found
+
+    def get(self, position, default=None):
+        return self[position] or default
+
+
+class PositionStore(object):
+    """The on disk store of unit to position and position to position
+    mappings.
+
+    Attributes
+    ----------
+    directory : str
+        The directory the store is kept in.
+    max_segments : int
+        Compact the position segments once there are more than this many.
+    """
+
+    max_segments = 8
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.manifest = self._load_manifest()
+
+    def _path(self, *names):
+        return os.path.join(self.directory, *names)
+
+    def _load_manifest(self):
+        filename = self._path('manifest.json')
+        if not os.path.exists(filename):
+            return {'units': [], 'positions': [], 'index': 'index.json',
+                    'revisions': {}}
+        with open(filename, 'r') as raw:
+            return json.load(raw)
+
+    def _save_manifest(self):
+        temp = self._path('manifest.json.tmp')
+        with open(temp, 'w') as raw:
+            json.dump(self.manifest, raw)
+        os.replace(temp, self._path('manifest.json'))
+
+    def _load(self, segment, name):
+        return np.load(self._path(segment, name + '.npy'), mmap_mode='r')
+
+    def _save(self, segment, **arrays):
+        os.makedirs(self._path(segment))
+        for name, array in arrays.items():
+            np.save(self._path(segment, name + '.npy'), array)
+
+    def _new_segment(self, prefix):
+        return '%s-%s' % (prefix, uuid.uuid4().hex[:12])
+
+    def chain_index(self):
+        """Load the index of which segment and rows hold each chain.
+
+        Returns
+        -------
+        index : dict
+            A dict from chain to a [segment, start, stop] list.
+        """
+
+        filename = self._path(self.manifest['index'])
+        if not os.path.exists(filename):
+            return {}
+        with open(filename, 'r') as raw:
+            return json.load(raw)
+
+    def known_pdbs(self):
+        """Get the PDB ids that have units in the store.
+
+        Returns
+        -------
+        pdbs : set
+            The set of PDB ids.
+        """
+        return set(chain.split('|')[0] for chain in self.chain_index())
+
+    def stale_pdbs(self, revisions):
+        """Find the stored PDB files which were revised since their units
+        were stored. Files stored without a revision date count as revised.
+
+        Parameters
+        ----------
+        revisions : dict
+            A dict from PDB id to its current revision date. PDB ids with no
+            known revision date are never stale.
+
+        Returns
+        -------
+        pdbs : set
+            The stale PDB ids.
+        """
+
+        stored = self.manifest.get('revisions', {})
+        known = self.known_pdbs()
+        return set(pdb for pdb, revision in revisions.items()
+                   if pdb in known and revision is not None and
+                   stored.get(pdb) != str(revision))
+
+    def known_correspondences(self):
+        """Get the correspondence ids whose positions are in the store.
+
+        Returns
+        -------
+        ids : set
+            The set of correspondence ids.
+        """
+
+        known = set()
+        for segment in self.manifest['positions']:
+            known.update(int(c) for c in self._load(segment, 'correspondences'))
+        return known
+
+    def add_units(self, chain_unit_to_position, revisions=None):
+        """Add the unit to position mappings of new chains. Chains which are
+        already known are replaced.
+
+        Parameters
+        ----------
+        chain_unit_to_position : dict
+            A dict from chain to a dict from unit id to position id.
+        revisions : dict, optional
+            A dict from PDB id to revision date of the PDB files the mappings
+            are for. All chains already stored for these files are removed
+            first, and the revision dates are recorded.
+
+        Returns
+        -------
+        count : int
+            The number of units written.
+        """
+
+        revisions = revisions or {}
+        chains = sorted(c for c, m in chain_unit_to_position.items() if m)
+        if not chains and not revisions:
+            return 0
+
+        units = []
+        positions = []
+        index = self.chain_index()
+        for chain in list(index):
+            if chain.split('|')[0] in revisions:
+                del index[chain]
+
+        segment = self._new_segment('units')
+        for chain in chains:
+            start = len(units)
+            for unit, position in chain_unit_to_position[chain].items():
+                units.append(unit.encode('ascii'))
+                positions.append(position)
+            index[chain] = [segment, start, len(units)]
+
+        if chains:
+            self._save(segment, units=np.array(units),
+                       positions=np.array(positions, dtype=np.int64))
+            self.manifest['units'].append(segment)
+
+        name = 'index-%s.json' % segment
+        with open(self._path(name), 'w') as raw:
+            json.dump(index, raw)
+
+        old = self.manifest['index']
+        self.manifest['index'] = name
+        stored = self.manifest.setdefault('revisions', {})
+        stored.update((pdb, None if revision is None else str(revision))
+                      for pdb, revision in revisions.items())
+        self._save_manifest()
+        if os.path.exists(self._path(old)):
+            os.remove(self._path(old))
+        self._remove_unused_units(index)
+        return len(units)
+
+    def _remove_unused_units(self, index):
+        used = set(entry[0] for entry in index.values())
+        unused = [s for s in self.manifest['units'] if s not in used]
+        if not unused:
+            return
+        self.manifest['units'] = [s for s in self.manifest['units']
+                                  if s in used]
+        self._save_manifest()
+        for segment in unused:
+            shutil.rmtree(self._path(segment), ignore_errors=True)
+
+    def add_positions(self, correspondence_ids, pairs):
+        """Add the position to position mappings of new correspondences.
+
+        Parameters
+        ----------
+        correspondence_ids : iterable
+            The correspondence ids the pairs belong to. These are recorded so
+            that they are not loaded again.
+        pairs : iterable
+            An iterable of (exp_seq_position_id_1, exp_seq_position_id_2)
+            pairs.
+
+        Returns
+        -------
+        count : int
+            The number of pairs written.
+        """
+
+        correspondence_ids = np.array(sorted(set(correspondence_ids)),
+                                      dtype=np.int64)
+        if not len(correspondence_ids):
+            return 0
+
+        data = np.array(list(pairs), dtype=np.int64).reshape(-1, 2)
+        segment = self._new_segment('positions')
+        self._save(segment, correspondences=correspondence_ids,
+                   **self._grouped(data[:, 0], data[:, 1]))
+        self.manifest['positions'].append(segment)
+        self._save_manifest()
+
+        if len(self.manifest['positions']) > self.max_segments:
+            self.compact()
+        return len(data)
+
+    def _grouped(self, first, second):
+        order = np.lexsort((second, first))
+        first = first[order]
+        second = second[order]
+        keys, starts = np.unique(first, return_index=True)
+        offsets = np.append(starts, len(first)).astype(np.int64)
+        return {'keys': keys, 'offsets': offsets, 'values': second}
+
+    def compact(self):
+        """Merge all position segments into a single segment.
+        """
+
+        old = list(self.manifest['positions'])
+        if len(old) < 2:
+            return
+
+        firsts = []
+        seconds = []
+        correspondences = []
+        for segment in old:
+            keys = self._load(segment, 'keys')
+            offsets = self._load(segment, 'offsets')
+            firsts.append(np.repeat(keys, np.diff(offsets)))
+            seconds.append(np.array(self._load(segment, 'values')))
+            correspondences.append(np.array(self._load(segment,
+                                                       'correspondences')))
+
+        segment = self._new_segment('positions')
+        self._save(segment,
+                   correspondences=np.unique(np.concatenate(correspondences)),
+                   **self._grouped(np.concatenate(firsts),
+                                   np.concatenate(seconds)))
+        self.manifest['positions'] = [segment]
+        self._save_manifest()
+        for name in old:
+            shutil.rmtree(self._path(name), ignore_errors=True)
+
+    def unit_to_position(self):
+        """Open the unit to position mapping.
+
+        Returns
+        -------
+        mapping : UnitPositions
+            The mapping from chain to units and their positions.
+        """
+
+        segments = {}
+        for segment in self.manifest['units']:
+            segments[segment] = (self._load(segment, 'units'),
+                                 self._load(segment, 'positions'))
+        return UnitPositions(self.chain_index(), segments)
+
+    def position_to_position(self):
+        """Open the position to position mapping.
+
+        Returns
+        -------
+        mapping : PositionPositions
+            The mapping from a position to all corresponding positions.
+        """
+
+        segments = []
+        for segment in self.manifest['positions']:
+            segments.append((self._load(segment, 'keys'),
+                             self._load(segment, 'offsets'),
+                             self._load(segment, 'values')))
+        return PositionPositions(segments)
+
@@ -6,12 +6,11 @@ the database. This works across several structures at once. This will merge the
 data into the database if run several times the same data.
 """
 
-import requests
-import time
-
 from pymotifs import core
 from pymotifs import models as mod
 from pymotifs.utils.pdb import CustomReportHelper
+from pymotifs.utils.graphql import EntryFetcher
+from pymotifs.utils.graphql import FetchFailed
 from pymotifs.pdbs.loader import Loader as PdbLoader
 
 
@@ -80,6 +79,11 @@ class Loader(core.SimpleLoader):
 
             return bool(query.count())
 
+    def entries_with_data(self, pdbs, **kwargs):
+        """Find which of the given PDBs have chains, in a few queries.
+        """
+        return self.entries_with_rows(mod.ChainInfo.pdb_id, pdbs)
+
     def query(self, session, pdb):
         """Generate a query to find all entries in chain_info for the given
         PDB id.  Added in November 2020 so this can be a SimpleLoader.
@@ -120,43 +124,139 @@ class Loader(core.SimpleLoader):
 
         return data
 
-    def data(self, pdbs, **kwargs):
-        """ after November 2020, use PDB graphQL to get data
-        about each chain in the PDB file
-        """
-
-        # The GraphQL query is defined as a multi-line string.
-        query = """
-        {
-          entry(entry_id:"XXXX") {
-            entry {
-              id
-            }
-            struct_keywords {
-              pdbx_keywords
-            }
-            polymer_entities {
-              rcsb_polymer_entity_container_identifiers {
-                entry_id
-                auth_asym_ids
-                entity_id
-              }
-              entity_poly {
-                rcsb_entity_polymer_type
-                rcsb_sample_sequence_length
-                pdbx_seq_one_letter_code_can
-                type
-              }
-              rcsb_polymer_entity {
-                pdbx_description
-              }
-              rcsb_entity_source_organism {
-                ncbi_scientific_name
-                ncbi_taxonomy_id
-              }
-            }
+    fields = """
+        entry {
+          id
+        }
+        struct_keywords {
+          pdbx_keywords
+        }
+        polymer_entities {
+          rcsb_polymer_entity_container_identifiers {
+            entry_id
+            auth_asym_ids
+            entity_id
+          }
+          entity_poly {
+            rcsb_entity_polymer_type
+            rcsb_sample_sequence_length
+            pdbx_seq_one_letter_code_can
+            type
+          }
+          rcsb_polymer_entity {
+            pdbx_description
+          }
+          rcsb_entity_source_organism {
+            ncbi_scientific_name
+            ncbi_taxonomy_id
           }
         }
+    """
+    """The GraphQL fields to get for each entry."""
+
+    entries = {}
+    """Entries fetched ahead of time by `to_process`, by PDB id."""
+
+    def to_process(self, pdbs, **kwargs):
+        """Get the PDBs to process, and fetch the chains of all that are
+        missing from PDB's graphQL service at once, in batched and concurrent
+        requests. The PDBs of any batch that could not be fetched are left
+        to `entry`, which fetches each of them on its own.
+        """
+
+        pdbs = super(Loader, self).to_process(pdbs, **kwargs)
+
+        missing = set(pdbs)
+        if not self.must_recompute(None, **kwargs):
+            with self.session() as session:
+                query = session.query(mod.ChainInfo.pdb_id).\
+                    filter(mod.ChainInfo.pdb_id.in_(pdbs)).\
+                    distinct()
+                missing.difference_update(r.pdb_id for r in query)
+
+        if len(missing) > 1:
+            self.logger.info("Fetching chain info for %d files", len(missing))
+            self.entries = self.fetcher()(missing, strict=False)
+        return pdbs
+
+    def fetcher(self):
+        """Create the `EntryFetcher` to use, configured with the
+        'pdb_graphql' section of the configuration.
+        """
+        return EntryFetcher.from_config(self.config, self.fields)
+
+    def entry(self, pdb):
+        """Get the graphQL entry of a PDB, using the entries fetched ahead of
+        time if possible.
+        """
+
+        if pdb in self.entries:
+            return self.entries[pdb]
+
+        try:
+            entry = self.fetcher()([pdb]).get(pdb.upper())
+        except FetchFailed as err:
+            self.logger.error(str(err))
+            entry = None
+
+        if not entry:
+            self.logger.error("Could not get chain info for %s" % pdb)
+            raise core.StageFailed("Could not load chain info for all pdbs")
+        return entry
+
+    def as_chains(self, pdb, entry):
+        """Turn a graphQL entry into the data for the chain_info table, one
+        dict per chain.
+        """
+
+        data = []
+        for chain_data in entry["polymer_entities"]:
+
+          # some polymer_entities have more than one auth_asym_ids, which have different coords, see 7C7A
+          for chain_id in chain_data["rcsb_polymer_entity_container_identifiers"]["auth_asym_ids"]:
+
+            if not "ybrid" in chain_data["entity_poly"]["type"]:
+              if "U" in chain_data["entity_poly"]["pdbx_seq_one_letter_code_can"]:
+                  if "deoxy" in chain_data["entity_poly"]["type"]:
+                    self.logger.info('DNA chain has U in it, type could be wrong')
+              elif "T" in chain_data["entity_poly"]["pdbx_seq_one_letter_code_can"]:
+                  if "olyribo" in chain_data["entity_poly"]["type"]:
+                    self.logger.info('RNA chain has T in it, type could be wrong')
+
+            renamed = {}
+            renamed["pdb_id"]             = pdb
+            renamed["chain_name"]         = chain_id
+            renamed["entity_name"]        = chain_data["rcsb_polymer_entity_container_identifiers"]["entity_id"]
+
+            renamed["classification"]     = None
+            # structures like 8ZZS do not have these entries
+            if "struct_keywords" in entry:
+                self.logger.info("struct_keywords: %s" % entry["struct_keywords"])
+                if entry["struct_keywords"]:
+                  if "pdbx_keywords" in entry["struct_keywords"]:
+                      renamed["classification"]     = entry["struct_keywords"]["pdbx_keywords"]
+
+            renamed["macromolecule_type"] = chain_data["entity_poly"]["rcsb_entity_polymer_type"]
+            renamed["sequence"]           = chain_data["entity_poly"]["pdbx_seq_one_letter_code_can"]
+            renamed["chain_length"]       = chain_data["entity_poly"]["rcsb_sample_sequence_length"]
+            renamed["entity_macromolecule_type"] = chain_data["entity_poly"]["type"]
+            ######
+            if chain_data["rcsb_entity_source_organism"] == None:
+              chain_data["rcsb_entity_source_organism"] = [{'ncbi_scientific_name': None, 'ncbi_taxonomy_id': None}]
+            renamed["taxonomy_id"]        = chain_data["rcsb_entity_source_organism"][0]["ncbi_taxonomy_id"]
+            renamed["source"]             = chain_data["rcsb_entity_source_organism"][0]["ncbi_scientific_name"]
+            ######
+            renamed["compound"]           = chain_data["rcsb_polymer_entity"]["pdbx_description"]
+
+            data.append(renamed)
+
+        return data
+
+    def data(self, pdbs, **kwargs):
+        """ after November 2020, use PDB graphQL to get data
+        about each chain in the PDB file. Entries are normally fetched for
+        all PDBs at once by `to_process`, any others are fetched here one at
+        a time.
         """
 
         if isinstance(pdbs, str):
@@ -165,73 +265,6 @@ class Loader(core.SimpleLoader):
         data = []    # will be a list over each pdb in pdbs and each chain in pdb
 
         for pdb in pdbs:
+            data.extend(self.as_chains(pdb, self.entry(pdb)))
 
-          currentquery = query.replace("XXXX",pdb)
-
-          # this is probably more robust than the url way below
-          try:
-            response = requests.post('https://data.rcsb.org/graphql', json={'query': currentquery})
-          except:
-              # sleep for 5 seconds and then try again, because the get failed
-              # once but then worked when the pipeline was run again
-              time.sleep(5)
-              response = requests.post('https://data.rcsb.org/graphql', json={'query': currentquery})
-
-          # here is a different way to do it
-          # currenturl = 'https://data.rcsb.org/graphql?query=' + currentquery
-
-          # try:
-          #     response = requests.get(currenturl)
-          # except:
-          #     # sleep for 5 seconds and then try again, because the get failed
-          #     # once but then worked when the pipeline was run again
-          #     time.sleep(5)
-          #     response = requests.get(currenturl)
-
-          if response.status_code == 200:
-              result = response.json()
-          else:
-              self.logger.error("Could not get chain info for %s" % pdb)
-              raise core.StageFailed("Could not load chain info for all pdbs")
-
-          for chain_data in result["data"]["entry"]["polymer_entities"]:
-
-            # some polymer_entities have more than one auth_asym_ids, which have different coords, see 7C7A
-            for chain_id in chain_data["rcsb_polymer_entity_container_identifiers"]["auth_asym_ids"]:
-
-              if not "ybrid" in chain_data["entity_poly"]["type"]:
-                if "U" in chain_data["entity_poly"]["pdbx_seq_one_letter_code_can"]:
-                    if "deoxy" in chain_data["entity_poly"]["type"]:
-                      self.logger.info('DNA chain has U in it, type could be wrong')
-                elif "T" in chain_data["entity_poly"]["pdbx_seq_one_letter_code_can"]:
-                    if "olyribo" in chain_data["entity_poly"]["type"]:
-                      self.logger.info('RNA chain has T in it, type could be wrong')
-
-              renamed = {}
-              renamed["pdb_id"]             = pdb
-              renamed["chain_name"]         = chain_id
-              renamed["entity_name"]        = chain_data["rcsb_polymer_entity_container_identifiers"]["entity_id"]
-
-              renamed["classification"]     = None
-              # structures like 8ZZS do not have these entries
-              if "struct_keywords" in result["data"]["entry"]:
-                  self.logger.info("struct_keywords: %s" % result["data"]["entry"]["struct_keywords"])
-                  if result["data"]["entry"]["struct_keywords"]:
-                    if "pdbx_keywords" in result["data"]["entry"]["struct_keywords"]:
-                        renamed["classification"]     = result["data"]["entry"]["struct_keywords"]["pdbx_keywords"]
-
-              renamed["macromolecule_type"] = chain_data["entity_poly"]["rcsb_entity_polymer_type"]
-              renamed["sequence"]           = chain_data["entity_poly"]["pdbx_seq_one_letter_code_can"]
-              renamed["chain_length"]       = chain_data["entity_poly"]["rcsb_sample_sequence_length"]
-              renamed["entity_macromolecule_type"] = chain_data["entity_poly"]["type"]
-              ######
-              if chain_data["rcsb_entity_source_organism"] == None:
-                chain_data["rcsb_entity_source_organism"] = [{'ncbi_scientific_name': None, 'ncbi_taxonomy_id': None}]
-              renamed["taxonomy_id"]        = chain_data["rcsb_entity_source_organism"][0]["ncbi_taxonomy_id"]
-              renamed["source"]             = chain_data["rcsb_entity_source_organism"][0]["ncbi_scientific_name"]
-              ######
-              renamed["compound"]           = chain_data["rcsb_polymer_entity"]["pdbx_description"]
-
-              data.append(renamed)
-
-        return data
\ No newline at end of file
+        return data
@@ -56,6 +56,13 @@ def run(ctx, name, ids, config=None, engine=None, **kwargs):
 
     mod.reflect(engine)
 
+    # workers are forked, which is not safe from the threads running stages
+    if (kwargs.get('workers') or 1) > 1 and \
+            (kwargs.get('concurrent_stages') or 1) > 1:
+        click.secho("Cannot use --workers with --concurrent-stages",
+                    err=True, fg='red')
+        ctx.exit(1)
+
     if kwargs.get('redo', False) is True:
         kwargs['recalculate'] = '.'
         kwargs['skip_dependencies'] = True
@@ -168,6 +175,10 @@ def cli(ctx, **options):
 @click.option('--comp-limit', type=int, help='Set maximum group size for discrepancy calcuations')
 @click.option('--data-limit', type=int, help='Maximum number of discrepancy calculations per group')
 @click.option('--nr_molecule_parent_current', type=str, help='molecule,parent release,current release like DNA,0.3,0.4')
+@click.option('--workers', default=1, type=int,
+              help='Number of processes to use for the entries of each stage')
+@click.option('--concurrent-stages', default=1, type=int,
+              help='Number of independent stages to run at the same time')
 @click.argument('name')
 @click.argument('ids', nargs=-1, type=PDB)
 @click.pass_context
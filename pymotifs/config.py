@@ -81,6 +81,34 @@ def defaults():
             "loops_mat_files": os.path.join(base, "MotifAtlas",
                                             "PrecomputedData"),  # no longer used
         },
+        'structure_cache': {
+            'max_megabytes': 4000,   # estimated memory of the parsed files kept
+            'directory': None,       # where to save parsed structures, if anywhere
+        },
+        'pdb_graphql': {
+            'url': 'https://data.rcsb.org/graphql',
+            'batch_size': 100,          # entries asked for in one request
+            'workers': 4,               # requests sent at once
+            'requests_per_second': 5,
+            'retries': 3,
+        },
+        'cif_download': {
+            'url': 'https://files.rcsb.org/download/{pdb}.cif.gz',
+            'workers': 4,               # files fetched at once
+            'retries': 3,
+            'timeout': 60,              # seconds to wait for more data
+        },
+        'motif_atlas': {
+            'search_workers': 1,     # processes running all against all searches
+            'search_shards': None,   # shards to split searches into, defaults
+                                     # to 4 per worker
+            'search_shard': None,    # only search this shard, then stop
+            'varna_workers': 4,      # VARNA commands drawing diagrams at once
+        },
+        'alignment': {
+            'cache': None,   # sqlite file of pairwise alignments, defaults
+                             # to alignments.sqlite in the cache location
+        },
         'recaculate': collections.defaultdict(lambda: False)
     }
 
@@ -12,6 +12,10 @@ savers
     Classes that abstract away saving to databases and files.
 stages
     The core classes and logic for all stages in the pipeline.
+parallel
+    Tools for processing the entries of a stage in several processes.
+structure_cache
+    A cache of parsed structures shared by all stages.
 """
 
 from pymotifs.core.base import *
@@ -0,0 +1,119 @@
+"""This contains the logic for processing the entries of a stage in several
+worker processes at once. The workers are forked, so each one starts with a
+copy of the stage as it is in the parent, including anything `to_process`
+has prefetched. Only the database access is replaced: each worker binds the
+session maker of the stage to a new engine of its own, so no connections are
+ever shared between processes. The per entry logic is the same as when
+running serially, only the bookkeeping of the results is done here.
+"""
+
+import multiprocessing as mp
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import as_completed
+
+from sqlalchemy import create_engine
+
+from pymotifs import models as mod
+from pymotifs.core.exceptions import InvalidState
+
+
+"""The stage used in each worker process."""
+_stage = None
+
+"""The keyword arguments each entry in a worker is processed with."""
+_kwargs = None
+
+
+def bind_new_engine(stage):
+    """Bind the session maker of the given stage to a new engine built from
+    its configuration. All stages and helpers built by the dispatcher share
+    the same session maker, so this moves all of them over to the new engine.
+    This is done in each worker, the engine of the parent, and the
+    connections it has open, are left alone.
+
+    Parameters
+    ----------
+    stage : pymotifs.core.stages.Stage
+        The stage to use the new engine with.
+
+    Returns
+    -------
+    engine : sqlalchemy.engine.Engine
+        The new engine, or None if the stage has no session maker to bind.
+    """
+
+    maker = getattr(stage.session, 'maker', None)
+    if maker is None or not hasattr(maker, 'configure'):
+        return None
+
+    engine = create_engine(stage.config['db']['uri'])
+    maker.configure(bind=engine)
+    mod.metadata.bind = engine
+    return engine
+
+
+def _initialize(stage, kwargs):
+    """Prepare the stage to use in this worker. This is run once per worker
+    process. The stage is the copy inherited from the parent when forking.
+    """
+
+    global _stage
+    global _kwargs
+
+    bind_new_engine(stage)
+    _stage = stage
+    _kwargs = kwargs
+
+
+def _process(entry):
+    """Process a single entry using the stage of this worker.
+    """
+    return _stage.process_entry(entry, **_kwargs)
+
+
+def process(stage, entries, workers, **kwargs):
+    """Process all entries with the given stage using a pool of worker
+    processes. The results are returned in the same order as the entries.
+
+    Parameters
+    ----------
+    stage : pymotifs.core.stages.Stage
+        The stage to process entries with.
+    entries : list
+        The entries to process.
+    workers : int
+        The number of worker processes to use.
+    **kwargs : dict
+        Keyword arguments passed on to `Stage.process_entry`.
+
+    Returns
+    -------
+    results : list
+        A list of (entry, status) tuples where status is one of the values
+        produced by `Stage.process_entry`.
+    """
+
+    if threading.current_thread() is not threading.main_thread():
+        raise InvalidState("Cannot fork workers for stage %s outside of the "
+                           "main thread" % stage.name)
+
+    context = mp.get_context('fork')
+    total = len(entries)
+    results = [None] * total
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_initialize,
+                             initargs=(stage, kwargs)) as pool:
+        futures = {}
+        for index, entry in enumerate(entries):
+            futures[pool.submit(_process, entry)] = index
+
+        done = 0
+        for future in as_completed(futures):
+            index = futures[future]
+            results[index] = (entries[index], future.result())
+            done += 1
+            stage.logger.info("Finished %s: %s/%s", entries[index], done,
+                              total)
+    return results
+
@@ -15,6 +15,11 @@ import csv
 import gzip
 import os
 import shutil
+import tempfile
+import time
+
+from sqlalchemy import text
+from sqlalchemy.orm import object_mapper
 
 from pymotifs import utils as ut
 
@@ -170,6 +175,193 @@ class DatabaseSaver(Saver):
             yield lambda data: fn(self.to_savable(data))
 
 
+def infile_value(value):
+    """Format a single value for a file read by MySQL's LOAD DATA. This uses
+    the default format, tab separated fields with backslash escapes and \\N
+    for NULL.
+
+    Parameters
+    ----------
+    value : object
+        The value to format.
+
+    Returns
+    -------
+    formatted : str
+        The value as it should be written to the file.
+    """
+
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, float):
+        return repr(value)
+    value = str(value)
+    return value.replace('\\', '\\\\').\
+        replace('\t', '\\t').\
+        replace('\n', '\\n')
+
+
+class BulkDatabaseSaver(DatabaseSaver):
+    """A saver that writes to the database without going through the ORM.
+    Each chunk of entries is turned into plain rows and written with one
+    executemany INSERT per table, which avoids the cost of the session's
+    identity map. If the stage merges data then this uses INSERT ... ON
+    DUPLICATE KEY UPDATE, which requires MySQL, other databases fall back to
+    merging each entry with the session.
+
+    If the stage sets `bulk_infile` to True then each chunk is instead written
+    to a temporary file and loaded with LOAD DATA LOCAL INFILE, or REPLACE if
+    merging. This is the fastest way to load very large tables, but requires
+    MySQL with local_infile enabled on both server and client.
+
+    Stages opt into this by setting `saver = core.BulkDatabaseSaver` and
+    should generally also raise `insert_max`, as each chunk is one
+    transaction. The number of rows written and the rate are logged.
+
+    Attributes
+    ----------
+    infile : bool
+        If chunks should be loaded from a temporary file.
+    rows : int
+        The total number of rows written.
+    seconds : float
+        The total time spent writing rows.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(BulkDatabaseSaver, self).__init__(*args, **kwargs)
+        self.infile = getattr(self.stage, 'bulk_infile', False)
+        self.rows = 0
+        self.seconds = 0.0
+
+    def as_row(self, entry):
+        """Turn an entry into the table it belongs in and a dict from column
+        name to value. Columns whose value is None are left out so the
+        database can fill in defaults, like auto increment ids.
+
+        Parameters
+        ----------
+        entry : object
+            An ORM object or a dict, if the stage has a table.
+
+        Returns
+        -------
+        table, row : sqlalchemy.Table, dict
+            The table and the row to insert.
+        """
+
+        entry = self.to_savable(entry)
+        mapper = object_mapper(entry)
+        row = {}
+        for prop in mapper.column_attrs:
+            value = getattr(entry, prop.key)
+            if value is not None:
+                row[prop.columns[0].name] = value
+        return mapper.local_table, row
+
+    def grouped(self, entries):
+        """Group rows by their table and the columns they set, in the order
+        the tables were first seen. Each group can be written with a single
+        statement.
+
+        Parameters
+        ----------
+        entries : list
+            The entries to group.
+
+        Returns
+        -------
+        groups : list
+            A list of (table, columns, rows) tuples.
+        """
+
+        groups = coll.OrderedDict()
+        for entry in entries:
+            table, row = self.as_row(entry)
+            columns = tuple(sorted(row))
+            groups.setdefault((table, columns), []).append(row)
+        return [(t, c, r) for (t, c), r in groups.items()]
+
+    def upsert(self, session, table, columns, rows):
+        """Write rows with INSERT ... ON DUPLICATE KEY UPDATE.
+        """
+
+        names = ', '.join('`%s`' % c for c in columns)
+        values = ', '.join(':%s' % c for c in columns)
+        updates = ', '.join('`%s` = VALUES(`%s`)' % (c, c) for c in columns)
+        sql = 'INSERT INTO `%s` (%s) VALUES (%s) ON DUPLICATE KEY UPDATE %s' % \
+            (table.name, names, values, updates)
+        session.execute(text(sql), rows)
+
+    def load_infile(self, session, table, columns, rows):
+        """Write rows to a temporary file and load it with LOAD DATA LOCAL
+        INFILE.
+        """
+
+        handle, filename = tempfile.mkstemp(suffix='.tsv')
+        try:
+            with os.fdopen(handle, 'w') as raw:
+                for row in rows:
+                    raw.write('\t'.join(infile_value(row[c]) for c in columns))
+                    raw.write('\n')
+
+            sql = "LOAD DATA LOCAL INFILE :filename %sINTO TABLE `%s` (%s)" % \
+                ('REPLACE ' if self.merge else '', table.name,
+                 ', '.join('`%s`' % c for c in columns))
+            session.execute(text(sql), {'filename': filename})
+        finally:
+            os.remove(filename)
+
+    def write(self, session, entries):
+        """Write a chunk of entries in the given session.
+
+        Parameters
+        ----------
+        session : sqlalchemy.orm.Session
+            The session to write with.
+        entries : list
+            The entries to write.
+        """
+
+        dialect = session.get_bind().dialect.name
+        if self.merge and dialect != 'mysql':
+            self.logger.debug("Merging entries, %s has no bulk upsert",
+                              dialect)
+            for entry in entries:
+                session.merge(self.to_savable(entry))
+            return
+
+        for table, columns, rows in self.grouped(entries):
+            if self.infile:
+                self.load_infile(session, table, columns, rows)
+            elif self.merge:
+                self.upsert(session, table, columns, rows)
+            else:
+                session.execute(table.insert(), rows)
+
+    @contextmanager
+    def writer(self, *args, **kwargs):
+        entries = []
+        yield entries.append
+
+        if entries:
+            start = time.time()
+            with self.session() as session:
+                self.write(session, entries)
+            self.rows += len(entries)
+            self.seconds += time.time() - start
+
+    def __call__(self, pdb, data, **kwargs):
+        super(BulkDatabaseSaver, self).__call__(pdb, data, **kwargs)
+        if self.rows:
+            rate = self.rows / max(self.seconds, 1e-6)
+            self.logger.info("Wrote %d rows for %s in %.2f seconds, "
+                             "%.0f rows/sec", self.rows, pdb, self.seconds,
+                             rate)
+
+
 class FileHandleSaver(Saver):
     """
     A saver that produces a file handle as a writer. This is intended to be
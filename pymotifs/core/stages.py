@@ -8,6 +8,7 @@ from contextlib import contextmanager
 import datetime
 import gzip
 import io as sio
+import itertools as it
 import os
 import pickle
 import sys
@@ -23,6 +24,8 @@ from pymotifs.core.exceptions import InvalidState
 from pymotifs import utils as ut
 from pymotifs import models as mod
 from pymotifs.core import savers
+from pymotifs.core import parallel
+from pymotifs.core import structure_cache
 
 from sqlalchemy import desc
 
@@ -57,6 +60,15 @@ class Stage(base.Base):
         Class to use for saving
     use_marks : bool, False
         Flag to use mark data when skipping.
+    allow_parallel : bool, True
+        Flag if entries may be processed in separate worker processes.
+    share_structures : bool, True
+        Flag if parsed files may be shared with other stages. Stages that
+        modify the structures they load must set this to False.
+    plan_chunk_size : int, 1000
+        Number of entries to look up in one query when planning.
+    mark_batch_size : int, 200
+        Number of marks to collect before writing them together.
     """
 
     update_gap = None
@@ -67,6 +79,28 @@ class Stage(base.Base):
     saver = None
     use_marks = False
     recompute = False
+    allow_parallel = True
+    share_structures = True
+    plan_chunk_size = 1000
+    mark_batch_size = 200
+
+    """
+    The entries the current plan covers, or None if there is no plan. See
+    `plan`.
+    """
+    planned = None
+
+    """
+    The time each planned entry was last marked, if it was marked, or None if
+    marks were not loaded when planning.
+    """
+    mark_times = None
+
+    """The planned entries which have data, or None if this is not known."""
+    with_data = None
+
+    """Marks not yet written, or None if marks are written as they are made."""
+    pending_marks = None
 
     def __init__(self, *args, **kwargs):
         """Build a new Stage.
@@ -142,7 +176,9 @@ class Stage(base.Base):
     def cif(self, pdb):
         """
         A method to load the cif file for a given pdb id. If given a CIF
-        file this will return the given CIF file.
+        file this will return the given CIF file. Parsed files are shared
+        with all other stages through the structure cache, unless
+        `share_structures` is False.
 
         Parameters
         ----------
@@ -159,6 +195,29 @@ class Stage(base.Base):
             return pdb
 
         filename = self._cif(pdb)
+        if not self.share_structures:
+            return self.read_cif(pdb, filename)
+
+        cache = structure_cache.shared(self.config)
+        return cache.get('cif', filename,
+                         lambda: self.read_cif(pdb, filename))
+
+    def read_cif(self, pdb, filename):
+        """
+        Parse the given cif file.
+
+        Parameters
+        ----------
+        pdb : str
+            The PDB id the file is for.
+        filename : str
+            The path to the file, which may be gzipped.
+
+        Returns
+        -------
+        cif : fr3d.cif.reader.Cif
+            The parsed mmCIF file.
+        """
 
         if ".gz" in filename:
             try:
@@ -201,7 +260,9 @@ class Stage(base.Base):
         the Structure data. If given a `fr3d.data.structure.Structure`, then
         this will simply return it. If given a `fr3d.reader.cif.Cif` data
         structure then this will return the structure that is part of that
-        file.
+        file. Structures are shared with all other stages through the
+        structure cache, unless `share_structures` is False, so they should
+        not be modified.
 
         Parameters
         ----------
@@ -216,7 +277,13 @@ class Stage(base.Base):
         if isinstance(pdb, Structure):
             return pdb
 
-        return self.cif(pdb).structure()
+        if isinstance(pdb, Cif) or not self.share_structures:
+            return self.cif(pdb).structure()
+
+        filename = self._cif(pdb)
+        cache = structure_cache.shared(self.config)
+        return cache.get('structure', filename,
+                         lambda: self.read_cif(pdb, filename).structure())
 
     def cache_filename(self, name):
         """Determine the path to cache file for the given name. This will
@@ -353,14 +420,19 @@ class Stage(base.Base):
         if not self.update_gap or ignore_time:
             return False
 
-        with self.session() as session:
-            current = session.query(mod.PdbAnalysisStatus).\
-                filter_by(pdb_id=pdb, stage=self.name).\
-                order_by(mod.PdbAnalysisStatus.time.desc()).\
-                first()
+        if self.mark_times is not None and self.is_planned(pdb):
+            current = self.mark_times.get(pdb)
             if not current:
                 return True
-            current = current.time
+        else:
+            with self.session() as session:
+                current = session.query(mod.PdbAnalysisStatus).\
+                    filter_by(pdb_id=pdb, stage=self.name).\
+                    order_by(mod.PdbAnalysisStatus.time.desc()).\
+                    first()
+                if not current:
+                    return True
+                current = current.time
         # If this has been marked as done in the far future do it anyway.
         # That is a silly thing to do
         diff = abs(datetime.datetime.now() - current)
@@ -376,12 +448,148 @@ class Stage(base.Base):
         :returns: True if this was done and marked in the past.
         """
 
+        if self.mark_times is not None and self.is_planned(pdb):
+            return pdb in self.mark_times
+
         with self.session() as session:
             query = session.query(mod.PdbAnalysisStatus).\
                 filter_by(pdb_id=pdb, stage=self.name).\
                 limit(1)
             return bool(query.count())
 
+    def is_planned(self, entry):
+        """Check if the current plan covers the given entry, in which case
+        what is known about it can be used instead of querying the database.
+        """
+        return isinstance(entry, str) and self.planned is not None and \
+            entry in self.planned
+
+    def chunked_queries(self, session, columns, column, values, *criteria):
+        """Build queries for rows whose column is any of the given values, a
+        chunk of `plan_chunk_size` values per query.
+
+        Parameters
+        ----------
+        session : Session
+            The session to query with.
+        columns : list
+            The columns to select.
+        column : Column
+            The column to restrict to the given values.
+        values : list
+            The values to look for.
+        *criteria : object
+            Further criteria for the rows.
+
+        Yields
+        ------
+        query : Query
+            The query for each chunk of values.
+        """
+
+        for chunk in ut.grouper(self.plan_chunk_size, values):
+            yield session.query(*columns).\
+                filter(column.in_(list(chunk)), *criteria)
+
+    def entries_with_rows(self, column, entries, *criteria):
+        """Find which entries have rows in the table of the given column, in
+        one query per chunk of entries. This is a helper for stages to
+        implement `entries_with_data`.
+
+        Parameters
+        ----------
+        column : Column
+            The column holding the entry, usually a pdb_id column.
+        entries : list
+            The entries to look for.
+        *criteria : object
+            Further criteria the rows must meet.
+
+        Returns
+        -------
+        found : set
+            The entries with at least one row.
+        """
+
+        found = set()
+        with self.session() as session:
+            queries = self.chunked_queries(session, [column], column, entries,
+                                           *criteria)
+            for query in queries:
+                found.update(row[0] for row in query.distinct())
+        return found
+
+    def entries_with_data(self, entries, **kwargs):
+        """Find which of the given entries already have data, with a few set
+        based queries. Stages which cannot do this return None, and then
+        `is_missing` is checked for each entry as it is processed.
+
+        Parameters
+        ----------
+        entries : list
+            The entries to check.
+
+        Returns
+        -------
+        found : set or None
+            The entries which have data, or None if not known.
+        """
+        return None
+
+    def uses_mark_times(self, ignore_time=False, **kwargs):
+        """Check if deciding to process an entry will look at its marks, which
+        is only done to check the update gap or to skip entries marked as done
+        despite having no data.
+        """
+        if self.update_gap and not ignore_time:
+            return True
+        return bool(self.use_marks and getattr(self, 'allow_no_data', False))
+
+    def plan(self, entries, **kwargs):
+        """Look up what is needed to decide which entries to process, for all
+        entries at once. This loads the latest mark time of every entry, and
+        which entries have data if `entries_with_data` can tell, in a few
+        queries. `should_process` then decides from these instead of querying
+        once or more for each entry. Marks are only loaded if they will be
+        used, see `uses_mark_times`. Only PDB ids, or other string entries,
+        are planned.
+
+        Parameters
+        ----------
+        entries : list
+            The entries that will be processed.
+        """
+
+        self.planned = None
+        self.mark_times = None
+        self.with_data = None
+
+        entries = sorted(set(e for e in entries if isinstance(e, str)))
+        if not entries or self.must_recompute(None, **kwargs):
+            return
+
+        if self.uses_mark_times(**kwargs):
+            self.mark_times = {}
+            status = mod.PdbAnalysisStatus
+            with self.session() as session:
+                queries = self.chunked_queries(session,
+                                               [status.pdb_id, status.time],
+                                               status.pdb_id, entries,
+                                               status.stage == self.name)
+                for query in queries:
+                    for row in query:
+                        known = self.mark_times.get(row.pdb_id)
+                        if known is None or (row.time and row.time > known):
+                            self.mark_times[row.pdb_id] = row.time
+        self.with_data = self.entries_with_data(entries, **kwargs)
+        self.planned = set(entries)
+        self.logger.info("Planned %d entries, %s marked, %s with data",
+                         len(entries),
+                         'unknown' if self.mark_times is None else
+                         len(self.mark_times),
+                         'unknown' if self.with_data is None else
+                         len(self.with_data))
+
     def should_process(self, entry, **kwargs):
         """
         Determine if we should process this entry. This is true if we are
@@ -447,12 +655,20 @@ class Stage(base.Base):
     def mark_processed(self, pdb, dry_run=False, **kwargs):
         """
         Mark that we have finished computing the results for the given pdb.
+        While `pending_marks` is a list, as it is when processing all entries
+        of the stage, the mark is only collected and written later together
+        with others by `write_marks`.
 
         :pdb: The pdb to mark done.
         """
 
         if dry_run:
             self.logger.debug("Marking %s as done", pdb)
+        elif self.pending_marks is not None:
+            self.pending_marks.append((pdb, datetime.datetime.now()))
+            if len(self.pending_marks) >= self.mark_batch_size:
+                self.write_marks()
+            return
         else:
             with self.session() as session:
                 status = mod.PdbAnalysisStatus(pdb_id=pdb, stage=self.name,
@@ -460,18 +676,152 @@ class Stage(base.Base):
                 session.merge(status)
         self.logger.info('Updated %s status for pdb %s', self.name, pdb)
 
+    def write_marks(self):
+        """
+        Write all collected marks in one transaction. The existing marks for
+        them are loaded with one query and updated, and new marks are
+        inserted together, instead of merging each mark on its own.
+        """
+
+        if not self.pending_marks:
+            return
+
+        marks = self.pending_marks
+        self.pending_marks = []
+        pdbs = sorted(set(pdb for pdb, _ in marks))
+        status = mod.PdbAnalysisStatus
+        with self.session() as session:
+            known = {}
+            queries = self.chunked_queries(session, [status], status.pdb_id,
+                                           pdbs, status.stage == self.name)
+            for query in queries:
+                for current in query:
+                    known[current.pdb_id] = current
+
+            for pdb, time in marks:
+                if pdb in known:
+                    known[pdb].time = time
+                else:
+                    known[pdb] = status(pdb_id=pdb, stage=self.name,
+                                        time=time)
+                    session.add(known[pdb])
+        self.logger.info('Updated %s status for %d pdbs', self.name,
+                         len(marks))
+
+    def process_entry(self, entry, **kwargs):
+        """Run the complete processing of a single entry. This checks if the
+        entry should be processed, processes it and marks it as processed. If
+        processing fails this will attempt to clean up with `remove`. This
+        is used both when running entries serially and in worker processes.
+
+        Parameters
+        ----------
+        entry : object
+            The entry to process.
+        **kwargs : dict
+            Keyword arguments passed on to various methods.
+
+        Raises
+        ------
+        InvalidState
+            If processing failed and the data could not be cleaned up.
+
+        Returns
+        -------
+        status : str
+            One of 'processed', 'unneeded', 'skipped' or 'failed'.
+        """
+
+        try:
+            if not self.should_process(entry, **kwargs):
+                self.logger.debug("No need to process %s", entry)
+                return 'unneeded'
+            before = ut.peak_memory()
+            self.process(entry, **kwargs)
+            self.report_memory(entry, before)
+
+        except Skip as err:
+            self.logger.warn("Skipping entry %s. Reason %s",
+                             str(entry), str(err))
+            return 'skipped'
+
+        except Exception as err:
+            self.logger.error("Error raised in processing of %s", entry)
+            self.logger.exception(err)
+
+            try:
+                self.remove(entry, **kwargs)
+            except Exception as err:
+                raise InvalidState("Could not clean up failed data %s",
+                                   entry)
+            return 'failed'
+
+        if self.mark:
+            self.mark_processed(entry, **kwargs)
+        return 'processed'
+
+    def report_memory(self, entry, before):
+        """Log the peak memory of this process after processing an entry, and
+        how much processing it raised the peak. In worker processes this is
+        the peak of the worker.
+
+        Parameters
+        ----------
+        entry : object
+            The entry that was processed.
+        before : float
+            The peak memory before processing the entry, in megabytes.
+        """
+
+        after = ut.peak_memory()
+        if after is None or before is None:
+            return
+        self.logger.info("Peak memory of %s after %s: %.1f MB (+%.1f MB)",
+                         self.name, entry, after, after - before)
+
+    def worker_count(self, entries, workers=None, **kwargs):
+        """Determine the number of worker processes to use for the given
+        entries. Stages which set `allow_parallel` to False, or which have only
+        a single entry, always run serially.
+
+        Parameters
+        ----------
+        entries : list
+            The entries to process.
+        workers : int, optional
+            The requested number of worker processes.
+
+        Returns
+        -------
+        workers : int
+            The number of worker processes to use, 1 means run serially.
+        """
+
+        if not workers or workers < 2:
+            return 1
+        if not self.allow_parallel:
+            self.logger.info("Stage %s is not safe to run in parallel",
+                             self.name)
+            return 1
+        return min(workers, len(entries))
+
     def __call__(self, given, **kwargs):
         """Process all given inputs. This will first transform all inputs with
         the `to_process` method. If there are no entries then a critical
         exception is raised. We then use `should_process` to determine if we
         should process each entry. If this returns
-        true then we call `process`. Once done we call `mark_processed`.
+        true then we call `process`. Once done we call `mark_processed`. If
+        given the keyword argument `workers` the entries will be processed by
+        that many worker processes.
 
         :given: A list of pdbs to process.
         :kwargs: Keyword arguments passed on to various methods.
         :returns: Nothing
         """
 
+        # workers only controls how entries are processed, it is not passed on
+        requested = kwargs.pop('workers', None)
+
         entries = None
         try:
             entries = self.to_process(given, **kwargs)
@@ -483,39 +833,27 @@ class Stage(base.Base):
             self.logger.critical("Nothing to process")
             raise InvalidState("Nothing to process")
 
-        failed = []
-        processed = []
-        for index, entry in enumerate(entries):
-            self.logger.info("Processing %s: %s/%s", entry, index + 1,
-                             len(entries))
-
+        self.plan(entries, **kwargs)
+        workers = self.worker_count(entries, workers=requested)
+        if workers > 1:
+            self.logger.info("Processing %s entries with %s workers",
+                             len(entries), workers)
+            results = parallel.process(self, entries, workers, **kwargs)
+        else:
+            results = []
+            self.pending_marks = []
             try:
-                if not self.should_process(entry, **kwargs):
-                    self.logger.debug("No need to process %s", entry)
-                    continue
-                self.process(entry, **kwargs)
-
-            except Skip as err:
-                self.logger.warn("Skipping entry %s. Reason %s",
-                                 str(entry), str(err))
-                continue
-
-            except Exception as err:
-                self.logger.error("Error raised in processing of %s", entry)
-                self.logger.exception(err)
-
-                try:
-                    self.remove(entry, **kwargs)
-                except Exception as err:
-                    raise InvalidState("Could not clean up failed data %s",
-                                       entry)
-                else:
-                    failed.append(entry)
-                    continue
-
-            if self.mark:
-                self.mark_processed(entry, **kwargs)
-            processed.append(entry)
+                for index, entry in enumerate(entries):
+                    self.logger.info("Processing %s: %s/%s", entry,
+                                     index + 1, len(entries))
+                    status = self.process_entry(entry, **kwargs)
+                    results.append((entry, status))
+            finally:
+                self.write_marks()
+                self.pending_marks = None
+
+        failed = [e for e, status in results if status == 'failed']
+        processed = [e for e, status in results if status == 'processed']
 
         if failed:
             ids = ' '.join(str(f) for f in failed)
@@ -580,6 +918,8 @@ class Loader(Stage):
         :kwargs: Keyword arguments
         :returns: A boolean if the requested data is missing or not.
         """
+        if self.with_data is not None and self.is_planned(entry):
+            return entry not in self.with_data
         return not self.has_data(entry, **kwargs)
 
     def store(self, pdb, data, **kwargs):
@@ -601,11 +941,34 @@ class Loader(Stage):
         saver = self.saver(self.config, self.session, stage=self)
         saver(pdb, data, **kwargs)
 
+    def stream(self, data):
+        """
+        Prepare data from `data` for storing. Generators, and other iterators,
+        are not read into memory, but are passed on to the saver which writes
+        them in chunks as they are produced. To tell if a generator produces
+        anything, its first entry is read ahead.
+
+        :data: The data produced by `data`.
+        :returns: The data, or an iterator over all of the generated entries,
+        or None if a generator produced nothing.
+        """
+
+        if not hasattr(data, '__iter__') or iter(data) is not data:
+            return data
+
+        try:
+            first = next(data)
+        except StopIteration:
+            return None
+        return it.chain([first], data)
+
     def process(self, entry, **kwargs):
         """
         Get the data for a particular entry. This will get the data and then
         store it. It will remove data as needed and makes sure that data is
-        produced if required.
+        produced if required. If `data` is a generator then entries are only
+        computed as the saver writes them, so at most `insert_max` entries
+        are held in memory at a time.
 
         :entry: The entry to process.
         :kwargs: Generic keyword arguments to be passed along to other methods.
@@ -617,7 +980,7 @@ class Loader(Stage):
             else:
                 self.remove(entry)
 
-        data = self.data(entry, **kwargs)
+        data = self.stream(self.data(entry, **kwargs))
 
         if not data:
             if not self.allow_no_data:
@@ -709,6 +1072,9 @@ class MassLoader(Loader):
 
     __metaclass__ = abc.ABCMeta
 
+    allow_parallel = False
+    """ All pdbs are processed as a single entry. """
+
     def been_long_enough(self, pdbs, **kwargs):
         """Determine if it has been long enough to recompute the data for the
         given pdbs. This requires that it has been long enough for at least 1
@@ -717,6 +1083,12 @@ class MassLoader(Loader):
         parent = super(MassLoader, self).been_long_enough
         return any(parent(pdb, **kwargs) for pdb in pdbs)
 
+    def plan(self, entries, **kwargs):
+        """Plan for all pdbs in the given collections of pdbs.
+        """
+        pdbs = [pdb for entry in entries for pdb in entry]
+        super(MassLoader, self).plan(pdbs, **kwargs)
+
     def to_process(self, pdbs, **kwargs):
         return [tuple(super(MassLoader, self).to_process(pdbs))]
 
@@ -799,6 +1171,9 @@ class Exporter(Loader):
     saver = savers.CsvSaver
     """The class for writing CSV files."""
 
+    allow_parallel = False
+    """Entries may write to the same file."""
+
     @abc.abstractmethod
     def filename(self, entry, **kwargs):
         """Compute the filename for the given entry.
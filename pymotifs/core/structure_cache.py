@@ -0,0 +1,252 @@
+"""A cache of parsed mmCIF files shared by all stages in one pipeline run.
+Many stages need the same `fr3d` Cif and Structure for a PDB file, and parsing
+a large file takes seconds, so parsed files are kept here until the cache
+grows too large. The cache lives in the process, so every stage run by one
+dispatcher uses it, including stages run in concurrent threads.
+
+The memory used by a parsed file cannot be measured cheaply, so it is
+estimated from the number of atoms in it, which is what most of the memory
+goes to. Values whose atoms cannot be counted are estimated from the size of
+the file they were parsed from, as a number of atoms per byte of the file.
+
+Optionally parsed structures are also written, pickled, to a directory. Later
+runs then load the pickle instead of parsing the file again. Each pickle
+records the modification time and size of the file it came from, and is only
+used while these still match.
+"""
+
+import collections as coll
+import logging
+import os
+import pickle
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+"""Estimated memory used by each parsed atom, with its residue and file
+data."""
+BYTES_PER_ATOM = 1500
+
+"""Bytes of an mmCIF file for each atom, for plain and gzipped files."""
+FILE_BYTES_PER_ATOM = 90
+GZIP_BYTES_PER_ATOM = 15
+
+
+def count_atoms(value):
+    """Count the atoms of a parsed value, if it can list them.
+
+    Parameters
+    ----------
+    value : object
+        A parsed value, like a `fr3d.data.Structure`.
+
+    Returns
+    -------
+    count : int
+        The number of atoms, or None if they could not be counted.
+    """
+
+    atoms = getattr(value, 'atoms', None)
+    if not callable(atoms):
+        return None
+    try:
+        return sum(1 for _ in atoms())
+    except Exception:
+        return None
+
+
+def estimate_size(filename, value):
+    """Estimate the memory used by a value parsed from a file.
+
+    Parameters
+    ----------
+    filename : str
+        The file the value was parsed from.
+    value : object
+        The parsed value.
+
+    Returns
+    -------
+    size : int
+        The estimated size in bytes.
+    """
+
+    atoms = count_atoms(value)
+    if atoms is None:
+        per_atom = FILE_BYTES_PER_ATOM
+        if filename.endswith('.gz'):
+            per_atom = GZIP_BYTES_PER_ATOM
+        atoms = os.path.getsize(filename) // per_atom
+    return atoms * BYTES_PER_ATOM
+
+
+class StructureCache(object):
+    """A least recently used cache of parsed files, bounded by the estimated
+    memory used by the parsed files.
+
+    Attributes
+    ----------
+    max_bytes : int
+        The maximum total estimated size of the cached values.
+    directory : str
+        The directory to store pickled structures in, or None to never store
+        them.
+    hits : int
+        Number of lookups that found the value in the cache.
+    misses : int
+        Number of lookups that had to parse the file.
+    size : function
+        A function of a filename and the value parsed from it, which estimates
+        the memory the value uses. Defaults to `estimate_size`.
+    """
+
+    def __init__(self, max_bytes, directory=None, size=estimate_size):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._size = 0
+        self._entries = coll.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stamp(self, filename):
+        """Get what identifies the current version of a file.
+        """
+        info = os.stat(filename)
+        return (info.st_mtime, info.st_size)
+
+    def _lookup(self, key, stamp):
+        with self._lock:
+            if key in self._entries and self._entries[key][0] == stamp:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, self._entries[key][1]
+            self.misses += 1
+            return False, None
+
+    def _store(self, key, stamp, value):
+        size = self.size(key[1], value)
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._entries.pop(key)[2]
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (stamp, value, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, (_, _, old_size) = self._entries.popitem(last=False)
+                self._size -= old_size
+
+    def get(self, kind, filename, load):
+        """Get the parsed form of a file, parsing it if needed.
+
+        Parameters
+        ----------
+        kind : str
+            The kind of value, like 'cif' or 'structure'. One file can have
+            one cached value of each kind.
+        filename : str
+            The file the value is parsed from.
+        load : function
+            A function of no arguments which parses the file.
+
+        Returns
+        -------
+        value : object
+            The parsed value.
+        """
+
+        key = (kind, filename)
+        stamp = self.stamp(filename)
+        found, value = self._lookup(key, stamp)
+        if found:
+            return value
+
+        value = self._read(key, stamp)
+        if value is None:
+            value = load()
+            self._write(key, stamp, value)
+        self._store(key, stamp, value)
+        return value
+
+    def _pickle_filename(self, key):
+        kind, filename = key
+        name = os.path.basename(filename).split('.')[0]
+        return os.path.join(self.directory, '%s-%s.pickle' % (name, kind))
+
+    def _read(self, key, stamp):
+        if not self.directory or key[0] != 'structure':
+            return None
+
+        filename = self._pickle_filename(key)
+        if not os.path.exists(filename):
+            return None
+
+        try:
+            with open(filename, 'rb') as raw:
+                saved_stamp, value = pickle.load(raw)
+        except Exception as err:
+            logger.warning("Could not load saved structure %s: %s",
+                           filename, err)
+            return None
+
+        if tuple(saved_stamp) != stamp:
+            return None
+        return value
+
+    def _write(self, key, stamp, value):
+        if not self.directory or key[0] != 'structure':
+            return
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        filename = self._pickle_filename(key)
+        temp = '%s.%d.tmp' % (filename, os.getpid())
+        try:
+            with open(temp, 'wb') as raw:
+                pickle.dump((stamp, value), raw, pickle.HIGHEST_PROTOCOL)
+            os.rename(temp, filename)
+        except Exception as err:
+            logger.warning("Could not save structure %s: %s", filename, err)
+            if os.path.exists(temp):
+                os.remove(temp)
+
+    def clear(self):
+        """Remove everything from the cache, but not from the directory.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+"""The cache used by all stages in this process."""
+_shared = None
+
+
+def shared(config):
+    """Get the cache shared by all stages, creating it from the
+    'structure_cache' section of the configuration the first time.
+
+    Parameters
+    ----------
+    config : dict
+        The pipeline configuration.
+
+    Returns
+    -------
+    cache : StructureCache
+        The shared cache.
+    """
+
+    global _shared
+    if _shared is None:
+        settings = config.get('structure_cache', {})
+        max_bytes = int(settings.get('max_megabytes', 4000) * 1024 * 1024)
+        _shared = StructureCache(max_bytes, settings.get('directory'))
+    return _shared
@@ -4,9 +4,18 @@ pairs for all given structures. It does not create comparisons to structures
 not included with the given pdbs.
 
 It pairs rna with rna, dna with dna, hybrid with hybrid
+
+Only pairs which can pass the length and species checks are generated. RNA
+sequences are put into blocks by species, with sequences of no or synthetic
+species in a block that is paired with every other one, and sorted by length
+inside each block so only the lengths allowed by `length_match` are looked
+at. DNA sequences are blocked by length.
 """
 
+import bisect
+import collections as coll
 import itertools as it
+import time
 
 from pymotifs import core
 from pymotifs import utils as ut
@@ -303,15 +312,217 @@ class Loader(core.MassLoader):
         # the lower sequence id first
         return sorted(seqs, key=lambda s: s['id'])
 
+    def max_partner_length(self, length):
+        """
+        The largest length of an RNA sequence that a sequence of the given
+        length can be paired with, following the rules in `length_match`.
+        """
+
+        if length < self.exact_cutoff:
+            return length
+        if length < self.huge_cutoff:
+            return min(2 * length, self.huge_cutoff)
+        return 2 * length
+
+    def min_partner_length(self, length):
+        """
+        The smallest length of an RNA sequence that a sequence of the given
+        length can be paired with, the smallest one whose
+        `max_partner_length` reaches the given length.
+        """
+
+        low, high = 0, length
+        while low < high:
+            middle = (low + high) // 2
+            if self.max_partner_length(middle) >= length:
+                high = middle
+            else:
+                low = middle + 1
+        return low
+
+    def species_key(self, seq):
+        """
+        The species block of a sequence, or None for sequences that may be
+        paired with any species, those with no, synthetic or several species.
+        """
+
+        taxonomy = seq['taxonomy_id']
+        if len(taxonomy) != 1 or None in taxonomy or \
+                SYNTHETIC_SPECIES_ID in taxonomy:
+            return None
+        return next(iter(taxonomy))
+
+    def ordered(self, first, second):
+        if first['id'] < second['id']:
+            return (first, second)
+        return (second, first)
+
+    def window_pairs(self, block):
+        """
+        Generate the pairs within a block of RNA sequences whose lengths may
+        match.
+        """
+
+        block = sorted(block, key=lambda s: s['length'])
+        lengths = [seq['length'] for seq in block]
+        for index, seq in enumerate(block):
+            end = bisect.bisect_right(lengths,
+                                      self.max_partner_length(seq['length']))
+            for other in block[index + 1:end]:
+                yield self.ordered(seq, other)
+
+    def cross_pairs(self, block, others):
+        """
+        Generate the pairs of one sequence from block and one from others
+        whose lengths may match.
+        """
+
+        others = sorted(others, key=lambda s: s['length'])
+        lengths = [seq['length'] for seq in others]
+        for seq in block:
+            start = bisect.bisect_left(lengths,
+                                       self.min_partner_length(seq['length']))
+            end = bisect.bisect_right(lengths,
+                                      self.max_partner_length(seq['length']))
+            for other in others[start:end]:
+                yield self.ordered(seq, other)
+
+    def exception_pairs(self, seqs):
+        """
+        Generate the pairs allowed by the special case for 9GUT in
+        `length_match`, which the length windows do not cover.
+        """
+
+        for seq in seqs:
+            if seq['pdb_id'] != '9GUT':
+                continue
+            key = self.species_key(seq)
+            for other in seqs:
+                if other['id'] >= seq['id']:
+                    continue
+                other_key = self.species_key(other)
+                if None not in (key, other_key) and key != other_key:
+                    continue
+                lengths = sorted([seq['length'], other['length']])
+                if lengths[1] == 3082 and 1100 < lengths[0] < 1600:
+                    yield (other, seq)
+
+    def rna_pairs(self, seqs):
+        """
+        Generate the pairs of distinct RNA sequences that may match, using
+        blocks of species and length.
+        """
+
+        blocks = coll.defaultdict(list)
+        for seq in seqs:
+            blocks[self.species_key(seq)].append(seq)
+        anything = blocks.pop(None, [])
+
+        for block in blocks.values():
+            for pair in self.window_pairs(block):
+                yield pair
+            for pair in self.cross_pairs(block, anything):
+                yield pair
+        for pair in self.window_pairs(anything):
+            yield pair
+        for pair in self.exception_pairs(seqs):
+            yield pair
+
+    def dna_pairs(self, seqs):
+        """
+        Generate the pairs of distinct DNA sequences of equal length.
+        """
+
+        blocks = coll.defaultdict(list)
+        for seq in seqs:
+            blocks[seq['length']].append(seq)
+        for block in blocks.values():
+            for first, second in it.combinations(block, 2):
+                yield self.ordered(first, second)
+
+    def candidate_pairs(self, seqs):
+        """
+        Compute the pairs of the given sequences that may match. This is
+        every pair `all_pairs` gives that can pass `length_match` and
+        `species_matches`, without generating the others. Hybrid sequences
+        are few, so all their pairs are given.
+
+        :param list seqs: Unique sequences as from `sequences`.
+        :returns: A list of pairs, sorted by the sequence ids.
+        """
+
+        by_type = coll.defaultdict(list)
+        for seq in seqs:
+            by_type[seq['entity_type']].append(seq)
+
+        pairs = [zip(seqs, seqs)]
+        for entity_type, typed in by_type.items():
+            if entity_type == 'rna':
+                pairs.append(self.rna_pairs(typed))
+            elif entity_type == 'dna':
+                pairs.append(self.dna_pairs(typed))
+            elif entity_type == 'hybrid':
+                pairs.append(it.combinations(typed, 2))
+
+        return sorted(it.chain.from_iterable(pairs),
+                      key=lambda p: (p[0]['id'], p[1]['id']))
+
+    def benchmark(self, seqs):
+        """
+        Compare the time to find all matching pairs of the given sequences by
+        filtering `all_pairs` and by filtering `candidate_pairs`. To measure
+        on the full sequence set, use `sequences` on all PDB ids.
+
+        :param list seqs: Unique sequences as from `sequences`.
+        :returns: A dictionary of the counts and times.
+        """
+
+        start = time.time()
+        old = [p for p in self.all_pairs(seqs) if self.is_match(p)]
+        old_time = time.time() - start
+
+        start = time.time()
+        candidates = self.candidate_pairs(seqs)
+        new = [p for p in candidates if self.is_match(p)]
+        new_time = time.time() - start
+
+        def ids(pairs):
+            return [(p[0]['id'], p[1]['id']) for p in pairs]
+
+        result = {
+            'sequences': len(seqs),
+            'candidates': len(candidates),
+            'matches': len(new),
+            'all_pairs_seconds': old_time,
+            'blocked_seconds': new_time,
+            'same': ids(old) == ids(new),
+        }
+        self.logger.info("Benchmark of %(sequences)d sequences: "
+                         "%(matches)d matches from %(candidates)d candidates, "
+                         "all pairs %(all_pairs_seconds).2f s, "
+                         "blocked %(blocked_seconds).2f s, same %(same)s",
+                         result)
+        return result
+
     def pairs(self, pdbs):
         """
-        Compute all pairs for the given pdbs
+        Compute all pairs for the given pdbs which may match.
 
         :param list pdbs: The list pdbs to process.
         :returns: The list pairs
         """
+        return self.candidate_pairs(self.sequences(pdbs))
+
+    def all_pairs(self, seqs):
+        """
+        Compute all pairs of the given sequences of the same entity type,
+        including each sequence with itself, whether or not they may match.
+        This is how pairs used to be found, it is kept as a reference for
+        `candidate_pairs`.
 
-        seqs = self.sequences(pdbs)                                         ## seqs is a list of dicts with information about sequences.
+        :param list seqs: Unique sequences as from `sequences`.
+        :returns: The list pairs
+        """
         # self.logger.info("show the seqs info of pairs function: %s" % seqs[0]) ## [{'species': set(4932), 'length': 76, 'id': 4177, 'entity_type': 'rna'}]
         # pairs = it.combinations(seqs, 2)                                    ## just a guess, the function will return a list of diff combinations if we have more than 2 seqs. Thus, if we only have one seq, it will return [].
         # Thus, the problem is here, we can add condiction for each entity type.
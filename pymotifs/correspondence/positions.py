@@ -1,8 +1,18 @@
 """
 This is a stage to align pairs of experimental sequences from the
 correspondence_info table and store the alignment between each nucleotide.
+
+RNA sequences are aligned in process and each alignment is kept in a cache
+file, keyed by the md5 of both sequences, so that aligning the same pair of
+sequences again, in a later run, is only a lookup. The file is set with
+'cache' in the 'alignment' section of the configuration and defaults to
+alignments.sqlite in the cache location.
 """
 
+import os
+
+from sqlalchemy.orm import aliased
+
 from pymotifs import core
 from pymotifs import models as mod
 
@@ -12,6 +22,7 @@ from pymotifs.exp_seq.positions import Loader as PositionLoader
 
 from pymotifs.utils.alignment import align
 from pymotifs.utils.alignment import one_to_one_alignment
+from pymotifs.utils.alignment import AlignmentCache
 
 
 class Loader(core.Loader):
@@ -22,6 +33,16 @@ class Loader(core.Loader):
     mark = False
     dependencies = set([CorrLoader, InfoLoader, PositionLoader])
 
+    def __init__(self, *args, **kwargs):
+        super(Loader, self).__init__(*args, **kwargs)
+        self.alignment_cache = None
+        filename = self.config['alignment'].get('cache')
+        if not filename and self.config['locations'].get('cache'):
+            filename = os.path.join(self.config['locations']['cache'],
+                                    'alignments.sqlite')
+        if filename:
+            self.alignment_cache = AlignmentCache(filename)
+
     def to_process(self, pdbs, **kwargs):
         """
         Ignore the list of pdbs passed in.
@@ -120,17 +141,40 @@ class Loader(core.Loader):
         :param int corr_id: The id of the correspondence to lookup.
         :returns: A tuple of experimental sequences used.
         """
+        return self.pair_info(corr_id)[0:2]
+
+    def pair_info(self, corr_id):
+        """
+        Look up the sequence ids used in the given correspondence and the
+        entity type of each sequence, in one query.
 
+        :param int corr_id: The id of the correspondence to lookup.
+        :returns: A tuple of both experimental sequence ids and both entity
+        types.
+        """
+
+        info1 = aliased(mod.ExpSeqInfo)
+        info2 = aliased(mod.ExpSeqInfo)
         with self.session() as session:
-            query = session.query(mod.CorrespondenceInfo).\
-                filter_by(correspondence_id=corr_id)
-            if not query.count():
+            query = session.query(mod.CorrespondenceInfo.exp_seq_id_1,
+                                  mod.CorrespondenceInfo.exp_seq_id_2,
+                                  info1.entity_type.label('entity_type_1'),
+                                  info2.entity_type.label('entity_type_2'),
+                                  ).\
+                outerjoin(info1, info1.exp_seq_id ==
+                          mod.CorrespondenceInfo.exp_seq_id_1).\
+                outerjoin(info2, info2.exp_seq_id ==
+                          mod.CorrespondenceInfo.exp_seq_id_2).\
+                filter(mod.CorrespondenceInfo.correspondence_id == corr_id)
+
+            result = query.first()
+            if result is None:
                 raise core.InvalidState("Unknown correspondence %s" % corr_id)
 
-            result = query.one()
-            return (result.exp_seq_id_1, result.exp_seq_id_2)
+            return (result.exp_seq_id_1, result.exp_seq_id_2,
+                    result.entity_type_1, result.entity_type_2)
 
-    def align_sequences(self, corr_id, ref, target, seq_id_1, seq_id_2):
+    def align_sequences(self, corr_id, ref, target, entity_types):
         """
         Run the alignment on two sequences. This will do an alignment and
         return lists that contain the ids for aligned positions only.
@@ -138,29 +182,20 @@ class Loader(core.Loader):
         :param int corr_id: The correspondence id to use.
         :param dict ref: The reference sequence.
         :param dict target: The target sequence.
+        :param tuple entity_types: The entity types of both sequences.
         :returns: A list of dictionaries for each position in the alignment. It
         lists which positions are aligned.
         """
 
-        with self.session() as session:
-            query = session.query(mod.ExpSeqInfo.entity_type).\
-                filter(mod.ExpSeqInfo.exp_seq_id.in_([seq_id_1,seq_id_2]))
-
-            entity_type_check = set()
-            # this is a double check for entity types because we have checked sequence
-            # pairs when we are making sequence pairs.
-            for result in query:
-                if result.entity_type == 'rna':
-                    entity_type_check.add('rna')
-                elif result.entity_type == 'dna':
-                    entity_type_check.add('dna')
-                elif result.entity_type == 'hybrid':
-                    entity_type_check.add('hybrid')
+        # this is a double check for entity types because we have checked sequence
+        # pairs when we are making sequence pairs.
+        entity_type_check = set(entity_types)
+        entity_type_check.intersection_update(['rna', 'dna', 'hybrid'])
 
         if len(entity_type_check) > 1:
             raise core.InvalidState('The entity types of the sequence pair are not identical')
         elif list(entity_type_check) == ['rna']:
-            results = align([ref, target])
+            results = align([ref, target], cache=self.alignment_cache)
             data = []
             for index, result in enumerate(results):
                 data.append({
@@ -239,10 +274,11 @@ class Loader(core.Loader):
         :yields: The correspondences by positions in both directions.
         """
 
-        exp_id1, exp_id2 = self.info(corr_id)
+        exp_id1, exp_id2, type1, type2 = self.pair_info(corr_id)
         sequence1 = self.sequence(exp_id1)
         sequence2 = self.sequence(exp_id2)
-        alignment = self.align_sequences(corr_id, sequence1, sequence2, exp_id1, exp_id2)
+        alignment = self.align_sequences(corr_id, sequence1, sequence2,
+                                         (type1, type2))
         ## self.logger.info('alignment %s'%alignment)
         for position in alignment:
             yield mod.CorrespondencePositions(**position)
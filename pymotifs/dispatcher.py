@@ -5,6 +5,9 @@ order.
 
 import logging
 import itertools as it
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
 
 from pymotifs import core
 from pymotifs.cli import introspect as intro
@@ -36,11 +39,15 @@ class Dispatcher(object):
             A list, set or tuple of stage names to exclude. This will also
             exclude all dependencies of the stage if they are only used for the
             stage.
+        concurrent_stages : int, optional
+            The maximum number of stages to run at the same time. Defaults to
+            1, which runs all stages one after another.
         """
 
         self.name = name
         self._args = args
         self.skip_dependencies = kwargs.get('skip_dependencies')
+        self.concurrent_stages = kwargs.get('concurrent_stages') or 1
         self.exclude = set(kwargs.get('exclude', []) or [])
         self.logger = logging.getLogger(__name__)
 
@@ -198,10 +205,124 @@ class Dispatcher(object):
 
         return self.flatten(deps, exclude, allowed)
 
+    def requirements(self, stages):
+        """Compute what stages must be completed before each of the given
+        stages may be run. This only considers the given stages, but will
+        follow the dependencies through any stages which are not given, so
+        that excluded stages do not break the ordering.
+
+        Parameters
+        ----------
+        stages : list
+            The list of built stages that will be run.
+
+        Returns
+        -------
+        requirements : dict
+            A dict mapping each stage name to the set of names of the given
+            stages it must wait for.
+        """
+
+        names = dict((stage.__class__, stage.name) for stage in stages)
+        deps = self.dependencies(list(names.keys()))
+
+        requirements = {}
+        for stage in stages:
+            required = set()
+            seen = set()
+            stack = list(deps.get(stage.__class__, set()))
+            while stack:
+                current = stack.pop()
+                if current in seen:
+                    continue
+                seen.add(current)
+                if current in names:
+                    required.add(names[current])
+                stack.extend(deps.get(current, set()))
+            requirements[stage.name] = required
+        return requirements
+
+    def run_stage(self, stage, entries, **kwargs):
+        """Run a single stage with the given entries, logging any failure.
+        """
+
+        try:
+            self.logger.info("Running stage: %s", stage.name)
+            stage(entries, **kwargs)
+        except Exception as err:
+            self.logger.error("Uncaught exception with stage: %s",
+                              stage.name)
+            raise err
+
+    def run_concurrently(self, stages, requirements, entries, **kwargs):
+        """Run the given stages, running up to `concurrent_stages` of them at
+        once. A stage is started as soon as all stages it requires have
+        finished, so independent stages, such as all stages in one level, run
+        at the same time. If any stage fails no new stages are started, the
+        running ones are allowed to finish and then the error is raised.
+
+        Parameters
+        ----------
+        stages : list
+            The stages to run, in the order they would be run serially.
+        requirements : dict
+            The requirements of each stage as produced by `requirements`.
+        entries : list
+            The entries to use as input.
+        **kwargs : dict
+            Keyword arguments to pass to each stage.
+        """
+
+        pending = list(stages)
+        running = {}
+        finished = set()
+        failure = None
+        manual = dict(kwargs.get('manual') or {})
+        with ThreadPoolExecutor(max_workers=self.concurrent_stages) as pool:
+            while pending or running:
+                if failure is None:
+                    for stage in list(pending):
+                        if len(running) >= self.concurrent_stages:
+                            break
+                        if not requirements[stage.name] <= finished:
+                            continue
+                        pending.remove(stage)
+                        args = dict(kwargs)
+                        args['manual'] = dict(manual)
+                        future = pool.submit(self.run_stage, stage, entries,
+                                             **args)
+                        running[future] = stage
+                        manual.pop('ml_release_id', None)
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    try:
+                        future.result()
+                    except Exception as err:
+                        if failure is None:
+                            failure = err
+                        continue
+                    finished.add(stage.name)
+
+        if failure is not None:
+            skipped = ', '.join(s.name for s in pending)
+            if skipped:
+                self.logger.error("Not running stages: %s", skipped)
+            raise failure
+
+        if pending:
+            raise core.InvalidState("Could not run stages %s" %
+                                    ', '.join(s.name for s in pending))
+
     def __call__(self, entries, **kwargs):
         """Call the specified stages using the given entries as input. This
         will determine what stages to run using the name property and then run
-        them in the correct order.
+        them in the correct order. If `concurrent_stages` is larger than 1
+        then independent stages are run at the same time.
 
         :param list entries: The entries to use as input.
         :kwargs: Keyword arguments to pass to each stage.
@@ -211,16 +332,16 @@ class Dispatcher(object):
         self.logger.info('Running stages: %s',
                          ', '.join(s.name for s in stages))
 
-        for stage in stages:
-            try:
-                self.logger.info("Running stage: %s", stage.name)
-                stage(entries, **kwargs)
-            except Exception as err:
-                self.logger.error("Uncaught exception with stage: %s",
-                                  self.name)
-                raise err
-            if 'ml_release_id' in kwargs['manual']:
-                del kwargs['manual']['ml_release_id']
+        if self.concurrent_stages > 1:
+            self.logger.info("Running up to %s stages at once",
+                             self.concurrent_stages)
+            requirements = self.requirements(stages)
+            self.run_concurrently(stages, requirements, entries, **kwargs)
+        else:
+            for stage in stages:
+                self.run_stage(stage, entries, **kwargs)
+                if 'ml_release_id' in kwargs['manual']:
+                    del kwargs['manual']['ml_release_id']
 
         self.logger.info("Finished pipeline")
         print("Finished pipeline")
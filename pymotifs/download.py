@@ -2,15 +2,19 @@
 Download CIF files.
 
 This will download compressed cif files and place under PDBFiles in the defined
-FR3D directory.
+FR3D directory. Files are fetched several at once, and files whose entry was
+revised since they were fetched are fetched again, using a conditional request
+so only files which have changed are sent. What was fetched is recorded in a
+manifest next to the files, see `pymotifs.utils.mirror`.
 """
 
 from contextlib import contextmanager
 import os
-import urllib.request
 
 from pymotifs import core
 from pymotifs import utils
+from pymotifs import models as mod
+from pymotifs.utils import mirror
 
 
 class Writer(core.FileHandleSaver):
@@ -27,43 +31,128 @@ class Downloader(core.Loader):
     dependencies = set()
     saver = Writer
 
+    """
+    Each worker process would save its own copy of the manifest of the
+    mirror, losing the entries of the others. The mirror already fetches
+    several files at once.
+    """
+    allow_parallel = False
+
+    """
+    Revision dates of the PDBs being processed, looked up ahead of time.
+    """
+    revisions = {}
+
+    """
+    Outcomes of the files fetched ahead of time, by PDB id.
+    """
+    fetched = {}
+
     def __init__(self, *args, **kwargs):
         super(Downloader, self).__init__(*args, **kwargs)
         self.FH = utils.FetchHelper(allow_fail=True)
         self.location = self.config['locations']['cif_files']
 
+        settings = self.config.get('cif_download', {})
+        self.file_url = settings.get('url', self.file_url)
+        self.mirror = mirror.FileMirror(self.url('{name}'),
+                                        os.path.realpath(self.location),
+                                        suffix='.cif.gz',
+                                        workers=settings.get('workers', 4),
+                                        retries=settings.get('retries', 3),
+                                        timeout=settings.get('timeout', 60))
+        self.revisions = {}
+        self.fetched = {}
+
     def filename(self, name, **kwargs):
         return os.path.realpath(os.path.normpath(os.path.join(self.location, name + '.cif.gz')))
 
     def url(self, name, **kwargs):
         return self.file_url.format(pdb=name)
 
+    def revision_date(self, pdb):
+        """Get the date the given PDB was last revised on, as stored by
+        pdbs.info, or None if it is not known.
+        """
+
+        if pdb in self.revisions:
+            return self.revisions[pdb]
+
+        with self.session() as session:
+            query = session.query(mod.PdbInfo.revision_date).\
+                filter_by(pdb_id=pdb)
+            found = query.first()
+            if found is None:
+                return None
+            return found.revision_date
+
+    def to_process(self, pdbs, **kwargs):
+        """Get the PDBs to process, and fetch all files that are missing or
+        out of date at once, several at a time.
+
+        Parameters
+        ----------
+        pdbs : list
+            A list of PDB ids
+
+        Returns
+        -------
+        pdbs : list
+            The PDB ids to process.
+        """
+
+        pdbs = super(Downloader, self).to_process(pdbs, **kwargs)
+        if len(pdbs) < 2 or self.must_recompute(None, **kwargs):
+            return pdbs
+
+        self.revisions = dict((pdb, None) for pdb in pdbs)
+        with self.session() as session:
+            query = session.query(mod.PdbInfo.pdb_id,
+                                  mod.PdbInfo.revision_date).\
+                filter(mod.PdbInfo.pdb_id.in_(pdbs))
+            self.revisions.update((r.pdb_id, r.revision_date) for r in query)
+
+        stale = [pdb for pdb in pdbs if not self.has_data(pdb)]
+        if len(stale) > 1 and not kwargs.get('dry_run'):
+            self.logger.info("Fetching %d of %d files", len(stale), len(pdbs))
+            self.fetched = self.mirror(stale)
+        return pdbs
+
     def remove(self, entry, **kwargs):
-        if self.has_data(entry) and not kwargs.get('dry_run'):
-            os.remove(self.filename(entry))
+        if not kwargs.get('dry_run'):
+            self.mirror.remove(entry)
+            self.mirror.manifest.save()
 
     def has_data(self, entry, **kwargs):
-        return os.path.exists(self.filename(entry))
+        """Check if the file exists and was fetched after the entry was last
+        revised.
+        """
+        return self.mirror.is_current(entry, self.revision_date(entry))
 
     def data(self, name, **kwargs):
-        downloaded = False
-        try:
-            # skip the helpers and saver stage and just get it done
-            url = self.url(name, **kwargs)
-            filename = self.filename(name, **kwargs)
-            self.logger.info('Downloading %s from %s' % (filename,url))
-            # next line failed on 2/18/2025, timeout
-            urllib.request.urlretrieve(url, filename)
-            downloaded = True
-        except Exception as err:
-            self.logger.error('%s could not be downloaded', name)
-            self.logger.exception(err)
+        """Fetch the file, unless it was fetched ahead of time. The file is
+        saved as it is fetched, so this always raises Skip to tell what
+        happened.
+        """
+
+        if name in self.fetched:
+            status = self.fetched.pop(name)
+        else:
+            self.logger.info('Downloading %s from %s',
+                             self.filename(name), self.url(name))
+            try:
+                status = self.mirror.fetch(name)
+            except Exception as err:
+                self.logger.error('%s could not be downloaded', name)
+                self.logger.exception(err)
+                status = None
+            finally:
+                self.mirror.manifest.save()
+
+        if status is None:
             raise core.Skip("Couldn't get %s" % name)
-
-        if downloaded:
-            raise core.Skip("Downloaded to %s" % filename)
-
-        # if not content:
-        #     core.Skip("Downloaded empty file %s" % name)
-
-        # return content
+        if status == mirror.MISSING:
+            raise core.Skip("No file for %s at %s" % (name, self.url(name)))
+        if status == mirror.NOT_MODIFIED:
+            raise core.Skip("File %s is unchanged" % self.filename(name))
+        raise core.Skip("Downloaded to %s" % self.filename(name))
@@ -3,6 +3,7 @@ This module contains the logic to create IFE-level CQS
 (Composite Quality Scoring) data for import into the database.
 """
 
+from collections import defaultdict
 from copy import deepcopy
 import numpy as np
 import operator as op
@@ -13,6 +14,7 @@ from sqlalchemy.orm import aliased
 
 from pymotifs import core
 from pymotifs import models as mod
+import pymotifs.utils as ut
 from pymotifs.ife.helpers import IfeLoader
 from pymotifs.ife.info import Loader as IfeInfoLoader
 from pymotifs.quality.loader import Loader as QualityLoader
@@ -21,6 +23,30 @@ from pymotifs.nr.representatives.using_quality import CompScore
 from pymotifs.utils import row2dict
 
 
+def count_atoms_in(coordinates):
+    """Count the C, N, O and P atoms in the coordinates of one unit, as stored
+    in the unit_coordinates table.
+
+    Parameters
+    ----------
+    coordinates : str
+        The mmCIF atom lines of the unit.
+
+    Returns
+    -------
+    count : int
+        The number of C, N, O and P atoms.
+    """
+
+    counted_atoms = set(['C', 'N', 'O', 'P'])
+    count = 0
+    for line in coordinates.split('\n'):
+        parts = line.split()
+        if len(parts) > 2 and parts[2] in counted_atoms:
+            count += 1
+    return count
+
+
 class IfeQualityLoader(core.SimpleLoader):
     """
     Loader to store non-release-dependent (i.e., IFE-based)
@@ -41,6 +67,13 @@ class IfeQualityLoader(core.SimpleLoader):
     testing = False
     fixing = False
 
+    """Compute the inputs of all IFEs to process with a few grouped queries,
+    instead of several queries for each IFE."""
+    mass_mode = True
+
+    """Number of PDB ids to look up in one query in mass mode."""
+    chunk_size = 100
+
     def to_process(self, pdbs, **kwargs):
         """
         Look up the list of IFEs to process, from among pdb ids in pdbs
@@ -81,6 +114,10 @@ class IfeQualityLoader(core.SimpleLoader):
         if len(need_to_process) == 0:
             raise core.Skip("No new IFEs to process for CQS")
 
+        self.cqs_inputs = {}
+        if self.mass_mode:
+            self.cqs_inputs = self.mass_inputs(need_to_process)
+
         return sorted(need_to_process)
 
 
@@ -146,30 +183,85 @@ class IfeQualityLoader(core.SimpleLoader):
             filter(table.unit_type_id.in_(['rna','dna'])).\
             filter(table.chain_index != None)
 
+    def coordinates_version(self, pdb):
+        """Find when the unit coordinates of a structure were last stored,
+        which is when units.coordinates was last marked for it.
+
+        Parameters
+        ----------
+        pdb : str
+            The PDB id.
+
+        Returns
+        -------
+        time : datetime.datetime
+            The time of the latest mark, or None if there is none.
+        """
+
+        with self.session() as session:
+            return session.query(func.max(mod.PdbAnalysisStatus.time)).\
+                filter(mod.PdbAnalysisStatus.pdb_id == pdb).\
+                filter(mod.PdbAnalysisStatus.stage == 'units.coordinates').\
+                scalar()
+
+    def unit_atom_counts(self, pdb, unit_ids=()):
+        """Get the number of C, N, O and P atoms in each RNA and DNA unit of
+        a structure. The counts are computed from the stored coordinates and
+        then kept in the cache directory, along with the time the coordinates
+        were stored. They are computed again when the coordinates have been
+        stored since, or when any of the requested units is not in the cached
+        counts.
+
+        Parameters
+        ----------
+        pdb : str
+            The PDB id.
+        unit_ids : list, optional
+            The unit ids the counts are needed for.
+
+        Returns
+        -------
+        counts : dict
+            A dict from unit id to number of atoms.
+        """
+
+        name = 'cqs_atom_counts_%s' % pdb
+        version = self.coordinates_version(pdb)
+        cached = self.cached(name)
+        if isinstance(cached, dict) and cached.get('version') == version:
+            counts = cached['counts']
+            if all(u in counts for u in unit_ids):
+                return counts
+
+        counts = {}
+        with self.session() as session:
+            query = session.query(mod.UnitInfo.unit_id,
+                                  mod.UnitCoordinates.coordinates).\
+                outerjoin(mod.UnitCoordinates,
+                          mod.UnitCoordinates.unit_id == mod.UnitInfo.unit_id).\
+                filter(mod.UnitInfo.pdb_id == pdb).\
+                filter(mod.UnitInfo.unit_type_id.in_(['rna','dna']))
+            for row in query:
+                counts[row.unit_id] = count_atoms_in(row.coordinates or '')
+
+        if counts:
+            self.cache(name, {'version': version, 'counts': counts})
+        return counts
+
     def count_atoms(self, info):
         with self.session() as session:
-            query = session.query(mod.UnitCoordinates).\
-                join(mod.UnitInfo,
-                     mod.UnitInfo.unit_id == mod.UnitCoordinates.unit_id)
+            query = session.query(mod.UnitInfo.unit_id)
             query = self.__chain_query__(query, info)
-            counted_atoms = set(['C', 'N', 'O', 'P'])
-            count = 0
-            for row in query:
-                current = 0
-                for line in row.coordinates.split('\n'):
-                    parts = line.split()
-                    if len(parts) >= 2 and parts[2] in counted_atoms:
-                        current += 1
+            unit_ids = [r.unit_id for r in query]
 
-                #if not current:
-                #    self.logger.error("No atoms in %s" % row.unit_id)
-                count += current
+        counts = self.unit_atom_counts(info['pdb'], unit_ids)
+        count = sum(counts.get(unit_id, 0) for unit_id in unit_ids)
 
-            if not count:
-                # self.logger.error("No atoms found for %s" % str(info))
-                return 100.0
+        if not count:
+            # self.logger.error("No atoms found for %s" % str(info))
+            return 100.0
 
-            return float(count)
+        return float(count)
 
     def count_clashes(self, info):
         with self.session() as session:
@@ -323,20 +415,19 @@ class IfeQualityLoader(core.SimpleLoader):
         # filter(mod.UnitInfo.unit.in_(['A', 'C', 'G', 'U'])).\
         # That recorded 0 for DNA chains, and ignored modified RNA nucleotides.
 
-    def data(self, ife_id, **kwargs):
-        """
-        Process one ife id to get data needed to compute the
-        composite quality score.
+    def ife_info_dict(self, ife_id):
+        """Build the dictionary describing an IFE that all inputs of the
+        composite quality score are computed from.
 
         Parameters
         ----------
-        entry : str
-            The IFE for which to collect IFE-level composite
-            quality score data.
+        ife_id : str
+            The IFE id.
 
         Returns
         -------
-            The required data for the database update step.
+        info : dict
+            A dict with the ife_id, pdb, model and chains of the IFE.
         """
 
         # collect information about this ife in a dictionary
@@ -357,6 +448,25 @@ class IfeQualityLoader(core.SimpleLoader):
             if len(fields) >= 3:
                 chains.append(fields[2])
         info['chains'] = chains
+        return info
+
+    def inputs(self, ife_id):
+        """Compute the inputs of the composite quality score for one IFE with
+        separate queries for each input.
+
+        Parameters
+        ----------
+        ife_id : str
+            The IFE id.
+
+        Returns
+        -------
+        info : dict
+            The IFE information with observed_length, sym_op, average_rsr,
+            average_rscc, percent_clash, rfree and resolution added.
+        """
+
+        info = self.ife_info_dict(ife_id)
 
         # count the number of observed nucleotides in the first chain
         # also get the symmetry operator to use
@@ -372,6 +482,223 @@ class IfeQualityLoader(core.SimpleLoader):
         c, info['percent_clash'] = self.percent_clash(info)
         d, info['rfree'] = self.rfree(info)
         e, info['resolution'] = self.resolution(info)
+        return info
+
+    def mass_units(self, session, pdbs):
+        """Get the RNA and DNA units with a chain index in the given PDBs.
+        """
+
+        query = session.query(mod.UnitInfo.unit_id,
+                              mod.UnitInfo.pdb_id,
+                              mod.UnitInfo.model,
+                              mod.UnitInfo.chain,
+                              mod.UnitInfo.chain_index,
+                              mod.UnitInfo.sym_op).\
+            filter(mod.UnitInfo.pdb_id.in_(pdbs)).\
+            filter(mod.UnitInfo.unit_type_id.in_(['rna','dna'])).\
+            filter(mod.UnitInfo.chain_index != None)
+        return query
+
+    def mass_quality(self, session, pdbs):
+        """Get the RSR and RSCC sums and counts of each chain and symmetry
+        operator in the given PDBs.
+        """
+
+        unit = mod.UnitInfo
+        quality = mod.UnitQuality
+        query = session.query(unit.pdb_id, unit.model, unit.sym_op,
+                              unit.chain,
+                              func.count().label('rows'),
+                              func.count(quality.real_space_r).label('rsr_count'),
+                              func.sum(quality.real_space_r).label('rsr_sum'),
+                              func.count(quality.rscc).label('rscc_count'),
+                              func.sum(quality.rscc).label('rscc_sum')).\
+            join(unit, unit.unit_id == quality.unit_id).\
+            filter(unit.pdb_id.in_(pdbs)).\
+            filter(unit.unit_type_id.in_(['rna','dna'])).\
+            filter(unit.chain_index != None).\
+            group_by(unit.pdb_id, unit.model, unit.sym_op, unit.chain)
+        return query
+
+    def mass_clashes(self, session, pdbs):
+        """Count the clashes between heavy atoms of each pair of chains with
+        the same model and symmetry operator in the given PDBs.
+        """
+
+        u1 = aliased(mod.UnitInfo)
+        u2 = aliased(mod.UnitInfo)
+        query = session.query(u1.pdb_id, u1.model, u1.sym_op,
+                              u1.chain.label('chain_1'),
+                              u2.chain.label('chain_2'),
+                              func.count().label('clashes')).\
+            select_from(mod.UnitClashes).\
+            join(u1, u1.unit_id == mod.UnitClashes.unit_id_1).\
+            join(u2, u2.unit_id == mod.UnitClashes.unit_id_2).\
+            filter(~mod.UnitClashes.atom_name_1.like('%H%')).\
+            filter(~mod.UnitClashes.atom_name_2.like('%H%')).\
+            filter(u1.pdb_id.in_(pdbs)).\
+            filter(u2.pdb_id == u1.pdb_id).\
+            filter(u2.model == u1.model).\
+            filter(u2.sym_op == u1.sym_op).\
+            filter(u1.unit_type_id.in_(['rna','dna'])).\
+            filter(u2.unit_type_id.in_(['rna','dna'])).\
+            filter(u1.chain_index != None).\
+            filter(u2.chain_index != None).\
+            group_by(u1.pdb_id, u1.model, u1.sym_op, u1.chain, u2.chain)
+        return query
+
+    def mass_inputs(self, ife_ids):
+        """Compute the inputs of the composite quality score for many IFEs
+        at once. This uses a few grouped queries for each chunk of PDB ids,
+        and the cached atom counts of each unit, and then combines the
+        values of the chains of each IFE. The results are the same as those
+        of `inputs`.
+
+        Parameters
+        ----------
+        ife_ids : iterable
+            The IFE ids.
+
+        Returns
+        -------
+        inputs : dict
+            A dict from IFE id to the dict `inputs` would produce. IFEs
+            whose structure has no resolution are left out, so they are
+            computed, and fail, one at a time.
+        """
+
+        by_pdb = defaultdict(list)
+        for ife_id in ife_ids:
+            info = self.ife_info_dict(ife_id)
+            by_pdb[info['pdb']].append(info)
+
+        inputs = {}
+        for pdbs in ut.grouper(self.chunk_size, sorted(by_pdb)):
+            pdbs = list(pdbs)
+            self.logger.info("Computing CQS inputs for %d structures", len(pdbs))
+
+            with self.session() as session:
+                units = list(self.mass_units(session, pdbs))
+
+            unit_ids = defaultdict(list)
+            for row in units:
+                unit_ids[row.pdb_id].append(row.unit_id)
+            counts = dict((pdb, self.unit_atom_counts(pdb, unit_ids[pdb]))
+                          for pdb in pdbs)
+
+            atoms = defaultdict(int)
+            positions = defaultdict(set)
+            for row in units:
+                key = (row.pdb_id, str(row.model), row.chain)
+                positions[key].add((row.chain_index, row.sym_op))
+                atoms[key + (row.sym_op,)] += counts[row.pdb_id].get(row.unit_id, 0)
+
+            with self.session() as session:
+                quality = {}
+                for row in self.mass_quality(session, pdbs):
+                    key = (row.pdb_id, str(row.model), row.chain, row.sym_op)
+                    quality[key] = row
+
+                clashes = defaultdict(int)
+                for row in self.mass_clashes(session, pdbs):
+                    key = (row.pdb_id, str(row.model), row.sym_op)
+                    clashes[key + (row.chain_1, row.chain_2)] += row.clashes
+
+                resolution = {}
+                query = session.query(mod.PdbInfo.pdb_id,
+                                      mod.PdbInfo.resolution).\
+                    filter(mod.PdbInfo.pdb_id.in_(pdbs))
+                for row in query:
+                    resolution[row.pdb_id] = row.resolution
+
+                rfree = {}
+                query = session.query(mod.PdbQuality.pdb_id,
+                                      mod.PdbQuality.dcc_rfree).\
+                    filter(mod.PdbQuality.pdb_id.in_(pdbs))
+                for row in query:
+                    rfree.setdefault(row.pdb_id, row.dcc_rfree)
+
+            for pdb in pdbs:
+                if pdb not in resolution:
+                    continue
+                for info in by_pdb[pdb]:
+                    self.combine_inputs(info, positions, atoms, quality,
+                                        clashes, resolution, rfree)
+                    inputs[info['ife_id']] = info
+
+        return inputs
+
+    def combine_inputs(self, info, positions, atoms, quality, clashes,
+                       resolution, rfree):
+        """Fill in the inputs of one IFE from the per chain values found by
+        `mass_inputs`, in the same way the per IFE methods compute them.
+        """
+
+        pdb = info['pdb']
+        model = info['model']
+        chains = sorted(set(info['chains']))
+
+        sym_op_to_count = defaultdict(int)
+        for chain in chains:
+            for chain_index, sym_op in positions[(pdb, model, chain)]:
+                sym_op_to_count[sym_op] += 1
+
+        if '1_555' in sym_op_to_count or len(sym_op_to_count) == 0:
+            sym_op = '1_555'
+        else:
+            sym_op = max(sym_op_to_count.items(), key=op.itemgetter(1))[0]
+        info['observed_length'] = sym_op_to_count.get(sym_op, 0)
+        info['sym_op'] = sym_op
+
+        rows = [quality[(pdb, model, c, sym_op)] for c in chains
+                if (pdb, model, c, sym_op) in quality]
+        info['average_rsr'] = 40
+        rsr_count = sum(r.rsr_count for r in rows)
+        if rsr_count:
+            info['average_rsr'] = float(sum(r.rsr_sum for r in rows if r.rsr_sum is not None)) / rsr_count
+        info['average_rscc'] = -1
+        rscc_count = sum(r.rscc_count for r in rows)
+        if rscc_count:
+            info['average_rscc'] = float(sum(r.rscc_sum for r in rows if r.rscc_sum is not None)) / rscc_count
+
+        clash_count = 0
+        atom_count = 0
+        for chain_1 in chains:
+            atom_count += atoms[(pdb, model, chain_1, sym_op)]
+            for chain_2 in chains:
+                clash_count += clashes[(pdb, model, sym_op, chain_1, chain_2)]
+        if not atom_count:
+            atom_count = 100.0
+        info['percent_clash'] = 100 * float(clash_count) / atom_count
+
+        info['rfree'] = rfree.get(pdb)
+        if info['rfree'] is None:
+            info['rfree'] = 1.0
+        info['resolution'] = resolution[pdb]
+        if info['resolution'] is None:
+            info['resolution'] = 100
+        return info
+
+    def data(self, ife_id, **kwargs):
+        """
+        Process one ife id to get data needed to compute the
+        composite quality score.
+
+        Parameters
+        ----------
+        entry : str
+            The IFE for which to collect IFE-level composite
+            quality score data.
+
+        Returns
+        -------
+            The required data for the database update step.
+        """
+
+        # use the inputs computed for all IFEs at once, if there are any
+        info = getattr(self, 'cqs_inputs', {}).get(ife_id)
+        if info is None:
+            info = self.inputs(ife_id)
 
         if self.testing or self.fixing:
             # print('Processed %s' % ife_id)
@@ -14,7 +14,6 @@ Special rules are needed there.
 import itertools as it
 import collections as coll
 from collections import defaultdict
-from sqlalchemy.orm import aliased
 
 from pymotifs import core
 from pymotifs.constants import IFE_EXTERNAL_INTERNAL_FRACTION as CUTOFF
@@ -34,80 +33,66 @@ def get_chains_and_counts(self, pdb_id):
     helper = st.Structure(self.session.maker)
     chains = sorted(helper.na_chains(pdb_id))
 
-    # query for all basepairs in the structure
-    # find the model with the most basepairs and use that
+    # count the cWW basepairs in the structure with one grouped query
+    # for each model, pair of chains and pair of symmetry operators
     # join with unit_info to make sure chain_index is not null
-    with self.session() as session:
-        UPI = mod.UnitPairsInteractions2024
-        UI1 = aliased(mod.UnitInfo)
-        UI2 = aliased(mod.UnitInfo)
-        query = session.query(UPI.unit_id_1, UPI.unit_id_2, UI1.sym_op, UI2.sym_op).\
-            join(UI1, UPI.unit_id_1 == UI1.unit_id).\
-            join(UI2, UPI.unit_id_2 == UI2.unit_id).\
-            filter(UPI.pdb_id == pdb_id).\
-            filter(UPI.f_lwbp == 'cWW').\
-            filter(UPI.program == 'fr3d').\
-            filter(UI1.chain_index != None).\
-            filter(UI2.chain_index != None)
-
-        # find the number of basepairs for each model
-        model_to_count = defaultdict(int)
-        sym_ops = set()
-        for row in query:
-            fields = row.unit_id_1.split('|')
-            model = fields[1]
-            model_to_count[model] += 1
-            sym_ops.add(row.sym_op)
-
-        if not model_to_count:
-            # if no basepairs, then we have no model information
-            with self.session() as session:
-                UI = mod.UnitInfo
-                mquery = session.query(UI.model).\
-                    filter(UI.pdb_id == pdb_id).\
-                    distinct()
+    loader = IfeLoader(self.config, self.session.maker)
+    counts = loader.cww_counts(pdb_id)
+
+    # find the number of basepairs for each model
+    # and find the model with the most basepairs and use that
+    model_to_count = defaultdict(int)
+    sym_ops = set()
+    for (model, _, _, sym_op1, _), count in counts.items():
+        model_to_count[str(model)] += count
+        sym_ops.add(sym_op1)
+
+    if not model_to_count:
+        # if no basepairs, then we have no model information
+        with self.session() as session:
+            UI = mod.UnitInfo
+            mquery = session.query(UI.model).\
+                filter(UI.pdb_id == pdb_id).\
+                distinct()
             for row in mquery:
-                model_to_count[row.model] += 1
-
-        if not model_to_count:
-            model = '1'
-        else:
-            model = str(min(model_to_count, key=lambda x: (-model_to_count[x], x)))
-
-        if '1_555' in sym_ops or len(sym_ops) == 0:
-            sym_op = '1_555'
-        else:
-            sym_op = sorted(sym_ops)[0]
-
-        # prepare a place for chain counts
-        chain_chain_to_count = {}
-        for chain1 in chains:
-            chain_chain_to_count[chain1] = {}
-            for chain2 in chains:
-                chain_chain_to_count[chain1][chain2] = 0
-
-        # count the interactions within and between chains
-        for row in query:
-            fields1 = row.unit_id_1.split('|')
-            if fields1[1] == model:
-                # only work with the chosen model
-                if len(fields1) < 9 or row.sym_op == sym_op:
-                    # skip units with a symmetry operator
-                    # we don't join those into IFEs
-                    fields2 = row.unit_id_2.split('|')
-                    if len(fields2) < 9 or row.sym_op == sym_op:
-                        chain1 = fields1[2]
-                        chain2 = fields2[2]
-                        if chain1 in chains and chain2 in chains:
-                            # avoid chains like 5DGF|1|C that is Protein#RNA
-                            # but we do include PNA chains
-                            # but 7KZL|1|B is all PNA but labeled polypeptide(L), so it's not perfect
-                            # also 7UID
-                            chain_chain_to_count[chain1][chain2] += 1
-
-        # same chain interactions get counted twice, so fix
-        for chain in chains:
-            chain_chain_to_count[chain][chain] /= 2
+                model_to_count[str(row.model)] += 1
+
+    if not model_to_count:
+        model = '1'
+    else:
+        model = str(min(model_to_count, key=lambda x: (-model_to_count[x], x)))
+
+    if '1_555' in sym_ops or len(sym_ops) == 0:
+        sym_op = '1_555'
+    else:
+        sym_op = sorted(sym_ops)[0]
+
+    # prepare a place for chain counts
+    chain_chain_to_count = {}
+    for chain1 in chains:
+        chain_chain_to_count[chain1] = {}
+        for chain2 in chains:
+            chain_chain_to_count[chain1][chain2] = 0
+
+    # count the interactions within and between chains
+    # only work with the chosen model, and skip units with another symmetry
+    # operator, we don't join those into IFEs
+    allowed = set(['1_555', sym_op])
+    for (pair_model, chain1, chain2, sym_op1, sym_op2), count in counts.items():
+        if str(pair_model) != model:
+            continue
+        if sym_op1 not in allowed or sym_op2 not in allowed:
+            continue
+        if chain1 in chains and chain2 in chains:
+            # avoid chains like 5DGF|1|C that is Protein#RNA
+            # but we do include PNA chains
+            # but 7KZL|1|B is all PNA but labeled polypeptide(L), so it's not perfect
+            # also 7UID
+            chain_chain_to_count[chain1][chain2] += count
+
+    # same chain interactions get counted twice, so fix
+    for chain in chains:
+        chain_chain_to_count[chain][chain] /= 2
 
     # get additional information about all of the chains
     with self.session() as session:
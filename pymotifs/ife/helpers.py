@@ -3,6 +3,9 @@ import itertools as it
 import functools as ft
 import operator as op
 
+from sqlalchemy import func
+from sqlalchemy.orm import aliased
+
 from pymotifs import core
 from pymotifs import utils as ut
 from pymotifs import models as mod
@@ -59,7 +62,78 @@ class IfeLoader(core.Base):
                 one().\
                 sym_op
 
-    def load(self, pdb, chain, model=1, sym_op='1_555'):
+    def interaction_counts(self, pdb, model=1, sym_op='1_555'):
+        """
+        Count the basepairs within and between all chains of a structure
+        with a few grouped queries, instead of some queries per chain and one
+        per pair of chains.
+
+        :pdb: The pdb id to use.
+        :model: The model to count all basepairs in.
+        :sym_op: The symmetry operator to use.
+        :returns: A dictionary with 'internal', the cWW count of each chain,
+        'bps', the basepair count of each chain, and 'cross', a dictionary
+        of the cWW counts between chains like { 'A': { 'B': 10 } }.
+        """
+
+        helper = st.BasePairQueries(self.session)
+        bps = helper.chain_counts(pdb, model=model, sym_op=sym_op)
+        internal = helper.chain_counts(pdb, family='cWW', sym_op=sym_op)
+        cross = helper.chain_counts(pdb, family='cWW', symmetry=False,
+                                    sym_op=sym_op)
+
+        counts = {'internal': {}, 'bps': {}, 'cross': defaultdict(dict)}
+        for (chain1, chain2), count in bps.items():
+            if chain1 == chain2:
+                counts['bps'][chain1] = count
+        for (chain1, chain2), count in internal.items():
+            if chain1 == chain2:
+                counts['internal'][chain1] = count
+        for (chain1, chain2), count in cross.items():
+            if chain1 != chain2:
+                counts['cross'][chain1][chain2] = count
+        counts['cross'] = dict(counts['cross'])
+        return counts
+
+    def cww_counts(self, pdb):
+        """
+        Count the cWW basepairs of a structure between each pair of chains,
+        for every model and pair of symmetry operators, with one grouped
+        query. Units without a chain index are left out.
+
+        :pdb: The pdb id to use.
+        :returns: A dictionary from (model, chain1, chain2, sym_op1, sym_op2)
+        to the number of cWW pairs from a unit in chain1 to one in chain2.
+        Both directions of each pair are counted.
+        """
+
+        inter = mod.UnitPairsInteractions2024
+        u1 = aliased(mod.UnitInfo)
+        u2 = aliased(mod.UnitInfo)
+        with self.session() as session:
+            query = session.query(u1.model.label('model'),
+                                  u1.chain.label('chain1'),
+                                  u2.chain.label('chain2'),
+                                  u1.sym_op.label('sym_op1'),
+                                  u2.sym_op.label('sym_op2'),
+                                  func.count().label('count')).\
+                select_from(inter).\
+                join(u1, inter.unit_id_1 == u1.unit_id).\
+                join(u2, inter.unit_id_2 == u2.unit_id).\
+                filter(inter.pdb_id == pdb).\
+                filter(inter.f_lwbp == 'cWW').\
+                filter(inter.program == 'fr3d').\
+                filter(u1.chain_index != None).\
+                filter(u2.chain_index != None).\
+                group_by(u1.model, u1.chain, u2.chain, u1.sym_op, u2.sym_op)
+
+            counts = {}
+            for r in query:
+                key = (r.model, r.chain1, r.chain2, r.sym_op1, r.sym_op2)
+                counts[key] = r.count
+            return counts
+
+    def load(self, pdb, chain, model=1, sym_op='1_555', counts=None):
         """
         This loads all information about a chain into a dictionary.
         This will load generic information about a chain, such as resolved, length,
@@ -68,6 +142,9 @@ class IfeLoader(core.Base):
 
         :pdb: The pdb to search.
         :chain: The chain to search.
+        :counts: The basepair counts of all chains, as from
+        `interaction_counts`. If not given the counts of this chain are
+        queried.
         :returns: A dictionary with
         """
 
@@ -104,6 +181,11 @@ class IfeLoader(core.Base):
 
         # print('Starting BasePairQueries for %s %s' % (pdb, chain))
 
+        if counts is not None:
+            data['internal'] = counts['internal'].get(data['chain'], 0)
+            data['bps'] = counts['bps'].get(data['chain'], 0)
+            return IfeChain(**data)
+
         helper = st.BasePairQueries(self.session)
         rep = helper.representative
         data['internal'] = rep(data['pdb'], data['chain'], count=True,
@@ -116,12 +198,14 @@ class IfeLoader(core.Base):
 
         return IfeChain(**data)
 
-    def cross_chain_interactions(self, ifes, sym_op='1_555'):
+    def cross_chain_interactions(self, ifes, sym_op='1_555', counts=None):
         """
         Create a dictionary of the interactions between the listed chains.
         This will get only the counts.
 
         :chains: A list of chain dictionaries.
+        :counts: The basepair counts of all chains, as from
+        `interaction_counts`. If not given they are queried.
         :returns: A dictionary of like { 'A': { 'B': 10 }, 'B': { 'A': 10 } }.
         """
 
@@ -130,22 +214,28 @@ class IfeLoader(core.Base):
 
         pdb = ifes[0].pdb
 
-        # following lines apparently took 11.8 hours on 4V5X with 160 chains
-        # not super clear how to know it is going to take that long
-        helper = st.BasePairQueries(self.session)
+        # this used to be one query per pair of chains, which took 11.8 hours
+        # on 4V5X with 160 chains, now all pairs are counted in one query
+        if counts is None:
+            helper = st.BasePairQueries(self.session)
+            found = helper.chain_counts(pdb, family='cWW', symmetry=False,
+                                        sym_op=sym_op)
+        else:
+            found = {}
+            for name1, others in counts['cross'].items():
+                for name2, count in others.items():
+                    found[(name1, name2)] = count
+
         interactions = defaultdict(dict)
         pairs = it.product((ife.chain for ife in ifes), repeat=2)
-        counter = ft.partial(helper.cross_chain, pdb, count=True, family='cWW',
-                             sym_op=sym_op)
         for name1, name2 in pairs:
-            count = counter(name1, name2)
+            count = found.get((name1, name2), 0)
             if name1 == name2:
                 count = 0
             interactions[name1][name2] = count
 
         return dict(interactions)
 
-
     def __call__(self, pdb):
         helper = st.Structure(self.session.maker)
         names = helper.na_chains(pdb)
@@ -160,13 +250,16 @@ class IfeLoader(core.Base):
 
         # print(model)
 
-        load = ft.partial(self.load, pdb, model=model, sym_op=sym_op)
+        counts = self.interaction_counts(pdb, model=model, sym_op=sym_op)
+        load = ft.partial(self.load, pdb, model=model, sym_op=sym_op,
+                          counts=counts)
         chains = [load(name) for name in names]
 
         # print(chains)
         # print('Getting cross_chain_interactions')
 
-        cci = self.cross_chain_interactions(chains, sym_op=sym_op)
+        cci = self.cross_chain_interactions(chains, sym_op=sym_op,
+                                            counts=counts)
 
         return chains, cci
 
@@ -16,6 +16,9 @@ class Loader(core.SimpleLoader):
     allow_no_data = True
     dependencies = set([UnitLoader, PdbLoader])
 
+    # hydrogens are added to the structure, so it must not be shared
+    share_structures = False
+
     @property
     def table(self):
         return mod.UnitAaInteractions
@@ -24,6 +24,10 @@ class Loader(core.SimpleLoader):
     allow_no_data = True
     dependencies = set([PdbLoader, UnitLoader, ChainLoader])
 
+    # annotating adds hydrogens and other data to the structure, so it must
+    # not be shared
+    share_structures = False
+
     @property
     def table(self):
         return mod.UnitPairsInteractions2024
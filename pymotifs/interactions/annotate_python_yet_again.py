@@ -27,6 +27,10 @@ class Loader(core.SimpleLoader):
 
     recompute = True  # force recompute of data; slow but thorough; deletes previous data
 
+    # annotating adds hydrogens and other data to the structure, so it must
+    # not be shared
+    share_structures = False
+
     # annotate structures with modified nts having no glycosidic center, because
     # these are the ones that may have been recently added to fr3d-python
     # This stage must be run before filling in the centers in order to work!
@@ -60,6 +60,130 @@ class AssessmentData(nt('AssessmentData', ['incomplete', 'pairs', 'rsrz', 'Q_sco
     pass
 
 
+def normalize_unit_id(unit_id):
+    """
+    Remove the alternate id from a unit id, along with any empty trailing
+    fields. Some unit ids are stored with an alternate id, like
+    1S72|1|0|A|5||A, but are referred to without one.
+    """
+
+    fields = unit_id.split('|')
+    if len(fields) > 6:
+        fields[6] = ''
+    while fields and fields[-1] == '':
+        fields.pop()
+    return '|'.join(fields)
+
+
+class UnitIndex(object):
+    """
+    All units of one structure and their experimental sequence positions,
+    loaded once so that the loop checks can look units up without going back
+    to the database.
+
+    Attributes
+    ----------
+    pdb : str
+        The PDB id the units are from.
+    units : dict
+        A dict from unit id to the unit_info data of the unit.
+    positions : dict
+        A dict from unit id to the experimental sequence position of the unit.
+    normalized : dict
+        A dict from unit id without an alternate id to the first unit id
+        that has a position.
+    by_index : dict
+        A dict from (model, chain, sym_op, chain_index) to the list of unit
+        ids at that index, one per alternate id.
+    non_cww : dict
+        A dict from unit id to the set of unit ids it forms a basepair with
+        that is not near and not cWW.
+    """
+
+    def __init__(self, pdb, units, positions, non_cww):
+        self.pdb = pdb
+        self.units = {}
+        self.by_index = {}
+        for unit in units:
+            self.units[unit['unit_id']] = unit
+            key = (unit['model'], unit['chain'], unit['sym_op'],
+                   unit['chain_index'])
+            self.by_index.setdefault(key, []).append(unit['unit_id'])
+
+        self.positions = {}
+        self.normalized = {}
+        for position in positions:
+            unit_id = position.pop('unit_id')
+            self.positions[unit_id] = position
+            self.normalized.setdefault(normalize_unit_id(unit_id), unit_id)
+
+        self.non_cww = defaultdict(set)
+        for unit1, unit2 in non_cww:
+            self.non_cww[unit1].add(unit2)
+
+    def __contains__(self, unit_id):
+        return unit_id in self.units
+
+    def covers(self, unit_id):
+        """
+        Check if a unit id is from the structure this index was built for.
+        """
+
+        return unit_id.split('|')[0] == self.pdb
+
+    def unit_info(self, unit_id):
+        """
+        Get the unit_info data of a unit, like `Loader.unit_info`.
+        """
+
+        info = dict(self.units[unit_id])
+        info.pop('unit_id')
+        return info
+
+    def position_info(self, unit_id):
+        """
+        Get the experimental sequence position of a unit, falling back to a
+        unit with the same id apart from the alternate id. Gives None if
+        neither is known.
+        """
+
+        if unit_id in self.positions:
+            return dict(self.positions[unit_id])
+        other = self.normalized.get(normalize_unit_id(unit_id))
+        if other is None:
+            return None
+        return dict(self.positions[other])
+
+    def units_between(self, unit1, unit2):
+        """
+        Get the unit ids between two units of the same chain, in the order of
+        chain_index. Units with several alternate ids are all included.
+        """
+
+        first = self.units[unit1]
+        second = self.units[unit2]
+        for key in ['pdb_id', 'model', 'chain', 'sym_op']:
+            if first[key] != second[key]:
+                return []
+
+        found = []
+        for index in range(int(first['chain_index']) + 1,
+                           int(second['chain_index'])):
+            key = (first['model'], first['chain'], first['sym_op'], index)
+            found.extend(self.by_index.get(key, []))
+        return found
+
+    def has_non_cWW(self, unit_ids):
+        """
+        Check if any two of the given units form a basepair that is not near
+        and not cWW.
+        """
+
+        unit_ids = set(unit_ids)
+        return any(self.non_cww[u] & unit_ids
+                   for u in unit_ids if u in self.non_cww)
+
+
 class Loader(core.SimpleLoader):
     dependencies = set([SaveLoopsLoader,
                         ExpSeqPositionLoader, ExpSeqMappingLoader,
@@ -73,6 +197,12 @@ class Loader(core.SimpleLoader):
     re_process_files = True   # force query to not skip files
     re_process_files = False  # only process new files, with no entries in loop_qa
 
+    """
+    The `UnitIndex` of the structure being processed, or None to query the
+    database for each unit.
+    """
+    index = None
+
     @property
     def table(self):
         return mod.LoopQa
@@ -380,6 +510,12 @@ class Loader(core.SimpleLoader):
         using a unit id.
         """
 
+        if self.index is not None and self.index.covers(unit):
+            result = self.index.position_info(unit)
+            if not result:
+                self.logger.info('No experimental sequence position for ' + unit)
+            return result
+
         self.logger.info("Finding position for %s" % unit)
         try:
             with self.session() as session:
@@ -431,6 +567,9 @@ class Loader(core.SimpleLoader):
         Get the information about a unit using a unit id.
         """
 
+        if self.index is not None and unit_id in self.index:
+            return self.index.unit_info(unit_id)
+
         with self.session() as session:
             units = mod.UnitInfo
             query = session.query(units.pdb_id,
@@ -478,6 +617,15 @@ class Loader(core.SimpleLoader):
 
         between = list(range(start+1, stop))
 
+        if self.index is not None and unit1 in self.index:
+            entries = []
+            for unit_id in self.index.units_between(unit1, unit2):
+                info = self.index.units[unit_id]
+                entry = Entry(**dict((k, info[k]) for k in Entry._fields))
+                if entry not in entries:
+                    entries.append(entry)
+            return entries
+
         with self.session() as session:
             units = mod.UnitInfo
             query = session.query(units.pdb_id,
@@ -594,6 +742,9 @@ class Loader(core.SimpleLoader):
         Check if there are non-cWW interactions within the loop.
         """
 
+        if self.index is not None and loop['pdb'] == self.index.pdb:
+            return not self.index.has_non_cWW(loop['unit_ids'])
+
         with self.session() as session:
             inters = mod.UnitPairsInteractions2024
             bps = mod.BpFamilyInfo
@@ -672,6 +823,15 @@ class Loader(core.SimpleLoader):
 
             between = list(range(int(unit1_info["chain_index"])+1, int(unit2_info["chain_index"])))
 
+            if self.index is not None and u1 in self.index:
+                chain_indices = sorted(set(
+                    self.index.units[u]['chain_index']
+                    for u in self.index.units_between(u1, u2)))
+                for i in range(1,len(chain_indices)):
+                    if chain_indices[i] - chain_indices[i-1] > 1:
+                        return True
+                continue
+
             with self.session() as session:
                 units = mod.UnitInfo
                 query = session.query(units.chain_index).\
@@ -1028,6 +1188,71 @@ class Loader(core.SimpleLoader):
         }
 
 
+    def unit_index(self, pdb):
+        """
+        Load all units of a structure, their experimental sequence positions
+        and their non-cWW basepairs in a few queries.
+
+        Parameters
+        ----------
+        pdb : str
+            The PDB id to use.
+
+        Returns
+        -------
+        index : UnitIndex
+            The index of all units in the structure.
+        """
+
+        with self.session() as session:
+            units = mod.UnitInfo
+            query = session.query(units.unit_id,
+                                  units.pdb_id,
+                                  units.model,
+                                  units.chain,
+                                  units.number,
+                                  units.unit,
+                                  units.alt_id,
+                                  units.ins_code,
+                                  units.chain_index,
+                                  units.sym_op
+                                  ).\
+                filter(units.pdb_id == pdb)
+            unit_data = [row2dict(r) for r in query]
+
+        with self.session() as session:
+            pos = mod.ExpSeqPosition
+            mapping = mod.ExpSeqUnitMapping
+            query = session.query(mapping.unit_id,
+                                  pos.index,
+                                  pos.exp_seq_id,
+                                  mod.UnitInfo.chain,
+                                  mod.UnitInfo.model,
+                                  mod.UnitInfo.sym_op,
+                                  ).\
+                join(mapping,
+                     mapping.exp_seq_position_id == pos.exp_seq_position_id).\
+                join(mod.UnitInfo,
+                     mod.UnitInfo.unit_id == mapping.unit_id).\
+                filter(mod.UnitInfo.pdb_id == pdb)
+            positions = [row2dict(r) for r in query]
+
+        with self.session() as session:
+            inters = mod.UnitPairsInteractions2024
+            bps = mod.BpFamilyInfo
+            query = session.query(inters.unit_id_1, inters.unit_id_2).\
+                join(bps, bps.bp_family_id == inters.f_lwbp).\
+                filter(inters.pdb_id == pdb).\
+                filter(inters.program == 'fr3d').\
+                filter(bps.is_near == 0).\
+                filter(bps.bp_family_id != 'cWW')
+            non_cww = [(r.unit_id_1, r.unit_id_2) for r in query]
+
+        self.logger.info("Indexed %d units and %d positions of %s",
+                         len(unit_data), len(positions), pdb)
+        return UnitIndex(pdb, unit_data, positions, non_cww)
+
+
     def assessment_data(self, pdb):
         return AssessmentData(incomplete=self.incomplete(pdb),
                               pairs=self.paired(pdb),
@@ -1045,9 +1270,13 @@ class Loader(core.SimpleLoader):
 
         assess = self.assessment_data(pdb)
 
-        quality_data = []
-        for loop in self.loops(pdb):
-            qd = self.quality(assess, loop)
-            self.logger.info('Loop %s has quality status %s' % (loop['id'], qd['status']))
-            quality_data.append(qd)
+        self.index = self.unit_index(pdb)
+        try:
+            quality_data = []
+            for loop in self.loops(pdb):
+                qd = self.quality(assess, loop)
+                self.logger.info('Loop %s has quality status %s' % (loop['id'], qd['status']))
+                quality_data.append(qd)
+        finally:
+            self.index = None
         return quality_data
@@ -258,7 +258,17 @@ class ClusterMotifs(core.Base):
 
         # self.logger.info('X-ray PDB list: %s' % x_ray_pdb_list)
 
-        cluster_loops(loop_position_to_border_unit_id, output_dir, molecule_type, x_ray_pdb_list)
+        settings = self.config.get('motif_atlas', {})
+        cluster_loops(loop_position_to_border_unit_id, output_dir, molecule_type, x_ray_pdb_list,
+                      search_workers=settings.get('search_workers', 1),
+                      search_shards=settings.get('search_shards'),
+                      search_shard=settings.get('search_shard'),
+                      varna_workers=settings.get('varna_workers', 4))
+
+        if settings.get('search_shard') is not None:
+            self.logger.info('Only searched shard %s of %s loops',
+                             settings['search_shard'], loop_type)
+            raise core.Skip("Only searched one shard, nothing was clustered")
 
         self.logger.info('Successful clustering of %s' % loop_type)
 
@@ -6,12 +6,11 @@ Then, cluster the loops based on the matches.
 Return a set of motif groups.
 """
 
-from collections import defaultdict, OrderedDict
-import gzip
+from collections import defaultdict, OrderedDict, namedtuple
+import multiprocessing
 import networkx as nx
 import numpy as np
 import os.path
-import pickle
 import shutil
 import sys
 from sys import maxsize
@@ -31,6 +30,11 @@ from pymotifs.motif_atlas.clustering_utilities import writeCSVOutput
 from pymotifs.motif_atlas.clustering_utilities import get_matrix_for_consensus_interactions
 from pymotifs.motif_atlas.chain_to_rfam_family import read_equiv_class_csv_into_dict # to get quality rank of chains
 from pymotifs.motif_atlas.motifToVARNA import motif_to_varna
+from pymotifs.motif_atlas.varna import DiagramRenderer
+from pymotifs.motif_atlas.varna import previous_diagram_dir
+from pymotifs.motif_atlas.search_results import SearchResultStore
+from pymotifs.motif_atlas.search_results import distance_matrices
+from pymotifs.motif_atlas.search_results import results_to_columns
 
 from fr3d.search.file_reading import readNAPairsFile
 from fr3d.search.file_reading import readNAPositionsFile
@@ -977,40 +981,36 @@ def load_previous_search_results_one_pdb(loop_type,pdb_id, path = DATAPATHRESULT
         os.mkdir(path)
         return results
 
-    file_name = loop_type + "_" + pdb_id + "_search_results.pickle.gz"
-    file_path = os.path.join(path,file_name)
+    results = SearchResultStore(path, loop_type).load(pdb_id)
 
-    if os.path.exists(file_path):
-        with gzip.open(file_path, 'rb') as f:
-            results = pickle.load(f)
+    for (query,search_space),value in results.items():
+        # Load No-match result as [{'dq': 0, 'discrepancy': 99}] instead of an integer
 
-        for (query,search_space),value in results.items():
-            # Load No-match result as [{'dq': 0, 'discrepancy': 99}] instead of an integer
+        # if query == 'J3_5J7L_036':
+        #     print(query,search_space,value)
 
-            # if query == 'J3_5J7L_036':
-            #     print(query,search_space,value)
-
-            if isinstance(value,int):
-                results[(query,search_space)] = [{'dq': [value], 'discrepancy': 99}]
+        if isinstance(value,int):
+            results[(query,search_space)] = [{'dq': [value], 'discrepancy': 99}]
 
     return results
 
 
-def save_search_results_one_pdb(loop_type, pdb_id, results, path = DATAPATHRESULTS):
+def append_search_results_one_pdb(loop_type, pdb_id, results, unsaved_pairs, path = DATAPATHRESULTS):
+    """
+    Save the search results for one PDB which are not saved yet;
+    unsaved_pairs is the set of (query_id, search_space_id) pairs searched
+    since the last save, including pairs searched again, and is emptied
+    once they are saved
+    """
+
     if not os.path.exists(path):
         os.mkdir(path)
 
-    file_name = loop_type + '_' + pdb_id + '_search_results.pickle.gz'
-    file_path = os.path.join(path, file_name)
+    count = len(unsaved_pairs)
+    SearchResultStore(path, loop_type).append(pdb_id, dict((pair, results[pair]) for pair in unsaved_pairs))
+    unsaved_pairs.clear()
 
-    if sys.version_info[0] < 3:
-        with gzip.open(file_path,'wb') as f:
-            pickle.dump(results, f)
-    else:
-        with gzip.open(file_path,'wb') as f:
-            pickle.dump(results, f, protocol = 4)
-
-    return
+    return count
 
 
 def list_all_chains_in(loops_from_structure, best_quality_chains = False):
@@ -1358,32 +1358,200 @@ def analyze_single_bulged_base_loops(candidates, query, search_space):
     return temp_result
 
 
-def all_against_all_searches(loop_type,queries,search_spaces,flanking_bp_queries,load_saved_searches = True,reversed_search=False, save_path = DATAPATHRESULTS):
+"""
+The parts of a loop that decide if it can possibly match another loop.
+length counts all nucleotides, core counts the non-bulged ones, and for
+single bulged base IL, bulge is the parent of the bulged base.  flanking
+counts the pairs of nucleotides which could be matched to the cWW pairs
+that every query requires, see count_flanking_pairs.
+"""
+LoopSignature = namedtuple('LoopSignature', ['strands', 'length', 'bulged', 'core', 'single_bulge', 'bulge', 'flanking'])
+
+"""
+The interactions and base combinations allowed for the pairs which close
+each strand of a query, as in make_req_interactions.
+"""
+FLANKING_INTERACTIONS = {'cWW', 'ncWW'}
+FLANKING_SEQUENCES = {'GC', 'CG', 'AU', 'UA', 'GU', 'UG'}
+
+
+def count_flanking_pairs(ifedata):
     """
-    Search all loops against all loops
+    Count the pairs of nucleotides of a loop annotated cWW or ncWW, leaving
+    out pairs of two standard bases that are not GC, AU or GU.  A query with
+    n strands requires n such pairs between different nucleotides, one
+    closing each strand, so it cannot be found in a loop with fewer.
+    Modified bases count as their parent, and other bases are always kept.
+    """
+
+    unit_ids = ifedata['ids']
+    pairs = set()
+    for (i, j), interactions in ifedata['pairToInteractions'].items():
+        if i == j or not FLANKING_INTERACTIONS.intersection(interactions):
+            continue
+        bases = []
+        for k in (i, j):
+            base = unit_ids[k].split("|")[3]
+            bases.append(modified_base_to_parent.get(base, base))
+        if all(base in ['A', 'C', 'G', 'U'] for base in bases) and ''.join(bases) not in FLANKING_SEQUENCES:
+            continue
+        pairs.add((min(i, j), max(i, j)))
+    return len(pairs)
+
+
+def make_loop_signature(loop, length):
+    """
+    Make the signature of a loop with the given number of nucleotides
+    """
+
+    bulged = len(loop['loop_info']['bulged'])
+    single_bulge = bulged == 1 and length == 5
+    return LoopSignature(strands = len(loop['loop_info']['strand']),
+        length = length,
+        bulged = bulged,
+        core = length - bulged,
+        single_bulge = single_bulge,
+        bulge = get_bulge(loop) if single_bulge else "",
+        flanking = count_flanking_pairs(loop['ifedata']))
+
+
+def make_query_signature(query):
+    return make_loop_signature(query, len(query['Q']['fullUnits']))
+
+
+def make_search_space_signature(search_space):
+    return make_loop_signature(search_space, len(search_space['ifedata']['index_to_id']))
+
+
+def make_signature_index(loops, make_signature):
+    """
+    Map each loop id to the signature of the loop
+    """
+
+    return dict((loop_id, make_signature(loop)) for loop_id, loop in loops.items())
+
+
+def prefilter_pair(loop_type, query, search_space):
+    """
+    Decide from the signatures of a query and a search space alone if the
+    query cannot be found in the search space, before any FR3D search.
+    Returns the disqualification code to record, or None if the pair needs
+    to be searched.  The size and bulge rules are the ones that were checked
+    for each pair during the all against all search.  On top of those, a
+    search space with fewer possible flanking pairs than the query has
+    strands is rejected with the code its failed search would have given.
+    Only the flanking cWW pairs are required of every match; other
+    interactions of the query only disqualify candidates which conflict
+    with them, and a query strand can be matched across the strands of a
+    search space, so neither is used here.
+    """
+
+    if loop_type == 'IL' and query.single_bulge:
+        # single base bulge IL only match each other, with the same bulged base
+        if search_space.single_bulge and query.bulge == search_space.bulge and \
+                search_space.flanking >= query.strands:
+            return None
+        return MISMATCHED_BULGE
+
+    if loop_type == 'IL' and search_space.single_bulge:
+        return MISMATCHED_BULGE
+
+    if loop_type[0] == "J" and search_space.length - query.length > 15:
+        # pick the number above to cull out the slowest, most doomed searches
+        # but not much else
+        return SEARCH_SPACE_CONFLICT
+    if loop_type == "IL" and search_space.length > 35 and query.length < 20:
+        # avoid searching a not huge IL inside a huge IL
+        return SEARCH_SPACE_CONFLICT
+    if query.core < search_space.core:
+        # don't lose core positions to an instance where a core position happens to be bulged
+        return SEARCH_SPACE_CONFLICT
+    if query.core > search_space.length:
+        # fixed positions of query are larger than search space
+        return SEARCH_SPACE_CONFLICT
+    if loop_type == 'HL' and (2 * query.core < search_space.core or 3 * query.core < search_space.length):
+        return SEARCH_SPACE_CONFLICT
+
+    if search_space.flanking < query.strands:
+        # hairpins are searched without a separate flanking pair search
+        if loop_type == 'HL':
+            return NO_CANDIDATES
+        return FLANKING_BP_CONFLICT
+
+    return None
+
+
+def shard_search_spaces(search_spaces, shards, reversed_search = False):
+    """
+    Split the search spaces into shards that can be searched independently.
+    All search spaces from one PDB go to the same shard, since results are
+    saved in one file per PDB, so shards never write the same file.
+    PDBs are assigned largest first to the shard with the least work, where
+    work is estimated by the number of nucleotides in the search spaces.
+    Returns a list of lists of search space ids, each in search order.
+    """
+
+    pdb_to_ids = defaultdict(list)
+    for search_space_id in search_spaces.keys():
+        pdb_to_ids[search_space_id.split("_")[1]].append(search_space_id)
+
+    def work(pdb_id):
+        return sum(len(search_spaces[i]['ifedata']['index_to_id']) for i in pdb_to_ids[pdb_id])
+
+    shard_ids = [[] for i in range(max(1, shards))]
+    shard_work = [0] * len(shard_ids)
+    for pdb_id in sorted(pdb_to_ids.keys(), key = lambda p: (-work(p), p)):
+        smallest = shard_work.index(min(shard_work))
+        shard_ids[smallest].extend(pdb_to_ids[pdb_id])
+        shard_work[smallest] += work(pdb_id)
+
+    return [sorted(ids, reverse = reversed_search) for ids in shard_ids if ids]
+
+
+def format_eta(seconds):
+    """
+    Format a number of seconds as hours:minutes:seconds
+    """
+
+    seconds = int(seconds)
+    return "%d:%02d:%02d" % (seconds // 3600, (seconds % 3600) // 60, seconds % 60)
+
+
+def search_shard(loop_type,queries,search_spaces,flanking_bp_queries,search_space_ids,load_saved_searches = True,save_path = DATAPATHRESULTS,shard_name = "all",checkpoint_seconds = 120):
+    """
+    Search all queries inside the given search spaces
     Take in query strands and search space strands
     Flow:
     Set query_pbd_id to empty to check the first iteration
-    Sort all pbd ids
+    Go through search_space_ids in order, all ids from one PDB together
     Load previous search results if query_pbd_id changes
-    Save the results if search_pbd_id changes and new_results = true
+    Save the pairs searched since the last save when search_pbd_id changes
+    Save the results every checkpoint_seconds, so an interrupted search
+    resumes from the last checkpoint when load_saved_searches is True
     results is a dictionary store temporary search results
     search_results is the accumulated search results, get returned
     """
 
-    new_results = False
     timer_data = myTimer("All against all search")
     search_space_pdb_id = ""
     search_results = {} # search_results store the final, accumulated results
+    results = {}
+    unsaved_pairs = set()   # pairs in results searched since the last save
 
     loop_counter = 0
+    searches = 0        # number of new searches done in this shard
+    pruned = 0          # number of pairs rejected by the signatures alone, without searching
+    shard_start_time = time()
+
+    # signatures of all loops, computed once, to reject impossible pairs quickly
+    query_signatures = make_signature_index(queries, make_query_signature)
+    search_space_signatures = make_signature_index(dict((i, search_spaces[i]) for i in search_space_ids), make_search_space_signature)
 
-    for search_space_id in sorted(search_spaces.keys(), reverse = reversed_search):
+    for search_space_id in search_space_ids:
         loop_counter += 1
 
         search_space_length = len(search_spaces[search_space_id]['ifedata']['index_to_id'])
-        search_space_bulged_length = len(search_spaces[search_space_id]['loop_info']['bulged'])
-        is_single_bulged_search_space = search_space_bulged_length==1 and search_space_length==5
+        search_space_signature = search_space_signatures[search_space_id]
 
         start_time_on_this_pdb = time()
 
@@ -1392,17 +1560,16 @@ def all_against_all_searches(loop_type,queries,search_spaces,flanking_bp_queries
         if search_space_pdb_id != search_space_id.split("_")[1]:
             # save only once per pdb because that is faster
             if search_space_pdb_id != "":
-                if new_results:
-                    save_search_results_one_pdb(loop_type, search_space_pdb_id, results, save_path)
+                if unsaved_pairs:
+                    append_search_results_one_pdb(loop_type, search_space_pdb_id, results, unsaved_pairs, save_path)
             search_space_pdb_id = search_space_id.split("_")[1]
             results = {} # results: {(query_id,search_space_id) : [dq,discrepancy]}
             if load_saved_searches:
                 timer_data = myTimer("Loading files")
                 # print('Loading search results for %s from %s' % (search_space_pdb_id, save_path))
                 results = load_previous_search_results_one_pdb(loop_type, search_space_pdb_id, save_path)
-            new_results = False
 
-        print("Searching for %d query loops inside loop %s with size %2d, %4d/%4d, reporting hits only" % (len(queries),search_space_id,search_space_length,loop_counter,len(search_spaces)))
+        print("Searching for %d query loops inside loop %s with size %2d, %4d/%4d, reporting hits only" % (len(queries),search_space_id,search_space_length,loop_counter,len(search_space_ids)))
         for query_id in sorted(queries.keys()):
 
             if query_id != search_space_id:
@@ -1482,176 +1649,156 @@ def all_against_all_searches(loop_type,queries,search_spaces,flanking_bp_queries
                     if queries[query_id]['Q'].get("3x3",False) and (query_id, search_space_id) in results:
                         previous_discrepancy = results[(query_id, search_space_id)][0]['discrepancy']
 
-                    new_results = True
+                    unsaved_pairs.add((query_id, search_space_id))
 
-                    if loop_type == 'IL' and is_single_bulged_candidate:
+                    code = prefilter_pair(loop_type, query_signatures[query_id], search_space_signature)
+                    if code is None:
+                        searches += 1
+
+                    if code is not None:
+                        # the signatures show the query cannot match, record why without searching
+                        results[(query_id, search_space_id)] = code
+                        pruned += 1
+
+                    elif loop_type == 'IL' and is_single_bulged_candidate:
                         # treat single base bulge IL differently, to keep them together according to bulged base
+                        # the prefilter only lets through single bulge search spaces with the same bulged base
 
                         # default result
                         results[(query_id, search_space_id)] = MISMATCHED_BULGE
-                        if is_single_bulged_search_space:
+                        # 5 nucleotide IL have a special query with discrepancy 98
+                        # it uses all five nucleotides, so they have to be aligned
+                        Q, candidates, elapsed_time = FR3D_search(Q = queries[query_id]['Q'],
+                                    ifedata = search_spaces[search_space_id]['ifedata'], ifename = search_space_id,
+                                    timerData = timer_data)
+                        if candidates:
+                            temp_result = analyze_single_bulged_base_loops(candidates=candidates,query=queries[query_id],search_space=search_spaces[search_space_id])
+                            if temp_result:
+                                temp_result[0]['match_type'] = "geometric"
+                                results[(query_id, search_space_id)] = temp_result
+
+                            # print('SBL discrepancy %0.4f' % temp_result[0]['discrepancy'])
+                        else:
+                            # I don't know why we would ever get here
+                            # print the query and search space loop ids
+                            print('Single bulge but no candidates found for %s inside %s' % (query_id, search_space_id))
 
-                            query_bulge = get_bulge(queries[query_id])
-                            search_space_bulge = get_bulge(search_spaces[search_space_id])
+                    else:
+                        query_non_bulged_length = query_length - query_bulge_length
+                        # Check flanking bp for IL and larger to make sure the match is plausible
+                        if loop_type != 'HL':
 
-                            if query_bulge == search_space_bulge:
-                                # 5 nucleotide IL have a special query with discrepancy 98
-                                # it uses all five nucleotides, so they have to be aligned
-                                Q, candidates, elapsed_time = FR3D_search(Q = queries[query_id]['Q'],
-                                            ifedata = search_spaces[search_space_id]['ifedata'], ifename = search_space_id,
-                                            timerData = timer_data)
-                                if candidates:
-                                    temp_result = analyze_single_bulged_base_loops(candidates=candidates,query=queries[query_id],search_space=search_spaces[search_space_id])
-                                    if temp_result:
-                                        temp_result[0]['match_type'] = "geometric"
-                                        results[(query_id, search_space_id)] = temp_result
+                            # if query_id == 'J3_8VTW_036' and search_space_id == 'J3_5J7L_036':
+                            #     print('About to do a flanking bp search J3_8VTW_036 inside J3_5J7L_036')
+                            #     print(flanking_bp_queries[query_id]['Q'])
 
-                                    # print('SBL discrepancy %0.4f' % temp_result[0]['discrepancy'])
-                                else:
-                                    # I don't know why we would ever get here
-                                    # print the query and search space loop ids
-                                    print('Single bulge but no candidates found for %s inside %s' % (query_id, search_space_id))
+                            # if query_id == 'J3_5J7L_036' and search_space_id == 'J3_8VTW_036':
+                            #     print('About to do a flanking bp search J3_5J7L_036 inside J3_8VTW_036')
+                            #     print(queries[query_id]['Q'])
 
-                    elif search_space_id[0:2] =="IL" and is_single_bulged_search_space:
-                        results[(query_id, search_space_id)] = MISMATCHED_BULGE
+                            # print_dictionary(flanking_bp_queries[query_id]['Q']['interactionMatrix'])
+                            # print("Flanking query above is for %s size %d inside %s size %d" % (query_id, query_non_bulged_length, search_space_id, search_space_length))
 
-                    else:
-                        query_non_bulged_length = query_length - query_bulge_length
-                        search_space_non_bulged_length = search_space_length - search_space_bulged_length
-                        if loop_type[0] == "J" and search_space_length - query_length > 15:
-                            # pick the number above to cull out the slowest, most doomed searches
-                            # but not much else
-                            print('Skipping %s in %s because search space has %d nt and query has %d' % (query_id, search_space_id, search_space_length, query_length))
-                            results[(query_id, search_space_id)] =  SEARCH_SPACE_CONFLICT
-                        elif loop_type == "IL" and search_space_length > 35 and query_length < 20:
-                            # avoid searching a not huge IL inside a huge IL
-                            print('Skipping %s in %s because search space has %d nt and query has %d' % (query_id, search_space_id, search_space_length, query_length))
-                            results[(query_id, search_space_id)] =  SEARCH_SPACE_CONFLICT
-                        elif query_non_bulged_length < search_space_non_bulged_length:
-                            # don't lose core positions to an instance where a core position happens to be bulged
-                            results[(query_id, search_space_id)] = SEARCH_SPACE_CONFLICT
-                        elif query_non_bulged_length > search_space_length:
-                            # fixed positions of query are larger than search space
-                            results[(query_id, search_space_id)] = SEARCH_SPACE_CONFLICT
-                        elif  loop_type == 'HL' and (2 * query_non_bulged_length < search_space_non_bulged_length\
-                            or 3 * query_non_bulged_length < search_space_length):
-                            print('Skipping %s in %s because query has %d non-bulged and search space has %d non-bulged and size %d' % (query_id, search_space_id, query_non_bulged_length, search_space_non_bulged_length, search_space_length))
-                            results[(query_id, search_space_id)] = SEARCH_SPACE_CONFLICT
-                        else:
-                            # Check flanking bp for IL and larger to make sure the match is plausible
-                            if loop_type != 'HL':
+                            Q, candidates, elapsed_time = FR3D_search(Q=flanking_bp_queries[query_id]['Q'],ifedata = search_spaces[search_space_id]['ifedata'], ifename = search_space_id,
+                            timerData = timer_data)
 
-                                # if query_id == 'J3_8VTW_036' and search_space_id == 'J3_5J7L_036':
-                                #     print('About to do a flanking bp search J3_8VTW_036 inside J3_5J7L_036')
-                                #     print(flanking_bp_queries[query_id]['Q'])
+                            # if len(candidates) > 0:
+                            #     print('Flanking found %s inside %s in %3d ways' % (query_id,search_space_id,len(candidates)))
 
-                                # if query_id == 'J3_5J7L_036' and search_space_id == 'J3_8VTW_036':
-                                #     print('About to do a flanking bp search J3_5J7L_036 inside J3_8VTW_036')
-                                #     print(queries[query_id]['Q'])
+                        if loop_type == "HL" or candidates:
 
-                                # print_dictionary(flanking_bp_queries[query_id]['Q']['interactionMatrix'])
-                                # print("Flanking query above is for %s size %d inside %s size %d" % (query_id, query_non_bulged_length, search_space_id, search_space_length))
+                            # print('Searching for %s inside %s' % (query_id, search_space_id))
 
-                                Q, candidates, elapsed_time = FR3D_search(Q=flanking_bp_queries[query_id]['Q'],ifedata = search_spaces[search_space_id]['ifedata'], ifename = search_space_id,
-                                timerData = timer_data)
+                            # do a full search for query inside of search_space
+                            if loop_type[0] == "J":
+                                start_time = time()
 
-                                # if len(candidates) > 0:
-                                #     print('Flanking found %s inside %s in %3d ways' % (query_id,search_space_id,len(candidates)))
+                                print_dictionary(queries[query_id]['Q1']['interactionMatrix'])
+                                print("Q1 query above is for %s size %d inside %s size %d" % (query_id, query_non_bulged_length, search_space_id, search_space_length))
 
-                            if loop_type == "HL" or candidates:
+                                # do a quicker search with lower discrepancy first
+                                Q, candidates, elapsed_time = FR3D_search(Q = queries[query_id]['Q1'],
+                                        ifedata = search_spaces[search_space_id]['ifedata'], ifename = search_space_id,
+                                        timerData = timer_data)
 
-                                # print('Searching for %s inside %s' % (query_id, search_space_id))
+                                # print_dictionary(queries[query_id]['Q1'])
+                                print('Q1 found %d candidates in %9.4f seconds; query size %d, search space size %d' % (len(candidates),time() - start_time, Q['numPositions'], search_space_length))
 
-                                # do a full search for query inside of search_space
-                                if loop_type[0] == "J":
+                                if len(candidates) == 0 and time() - start_time < 30:
                                     start_time = time()
 
-                                    print_dictionary(queries[query_id]['Q1']['interactionMatrix'])
-                                    print("Q1 query above is for %s size %d inside %s size %d" % (query_id, query_non_bulged_length, search_space_id, search_space_length))
+                                    print_dictionary(queries[query_id]['Q2']['interactionMatrix'])
+                                    print("Q2 query above is for %s size %d inside %s size %d" % (query_id, query_non_bulged_length, search_space_id, search_space_length))
 
-                                    # do a quicker search with lower discrepancy first
-                                    Q, candidates, elapsed_time = FR3D_search(Q = queries[query_id]['Q1'],
+                                    Q, candidates, elapsed_time = FR3D_search(Q = queries[query_id]['Q2'],
                                             ifedata = search_spaces[search_space_id]['ifedata'], ifename = search_space_id,
                                             timerData = timer_data)
 
-                                    # print_dictionary(queries[query_id]['Q1'])
-                                    print('Q1 found %d candidates in %9.4f seconds; query size %d, search space size %d' % (len(candidates),time() - start_time, Q['numPositions'], search_space_length))
-
-                                    if len(candidates) == 0 and time() - start_time < 30:
-                                        start_time = time()
+                                    print('Q2 found %d candidates in %9.4f seconds; query size %d, search space size %d' % (len(candidates),time() - start_time, Q['numPositions'], search_space_length))
 
-                                        print_dictionary(queries[query_id]['Q2']['interactionMatrix'])
-                                        print("Q2 query above is for %s size %d inside %s size %d" % (query_id, query_non_bulged_length, search_space_id, search_space_length))
+                                if loop_type in ['J3','J4','J5'] and len(candidates) == 0 and time() - start_time < 400:
+                                    start_time = time()
 
-                                        Q, candidates, elapsed_time = FR3D_search(Q = queries[query_id]['Q2'],
-                                                ifedata = search_spaces[search_space_id]['ifedata'], ifename = search_space_id,
-                                                timerData = timer_data)
+                                    print_dictionary(queries[query_id]['Q']['interactionMatrix'])
+                                    print("Q query above is for %s size %d inside %s size %d" % (query_id, query_non_bulged_length, search_space_id, search_space_length))
 
-                                        print('Q2 found %d candidates in %9.4f seconds; query size %d, search space size %d' % (len(candidates),time() - start_time, Q['numPositions'], search_space_length))
+                                    Q, candidates, elapsed_time = FR3D_search(Q = queries[query_id]['Q'],
+                                            ifedata = search_spaces[search_space_id]['ifedata'], ifename = search_space_id,
+                                            timerData = timer_data)
 
-                                    if loop_type in ['J3','J4','J5'] and len(candidates) == 0 and time() - start_time < 400:
-                                        start_time = time()
+                                    print('Q  found %d candidates in %9.4f seconds; query size %d, search space size %d' % (len(candidates),time() - start_time, Q['numPositions'], search_space_length))
 
-                                        print_dictionary(queries[query_id]['Q']['interactionMatrix'])
-                                        print("Q query above is for %s size %d inside %s size %d" % (query_id, query_non_bulged_length, search_space_id, search_space_length))
+                            else:
+                                Q, candidates, elapsed_time = FR3D_search(Q = queries[query_id]['Q'],
+                                        ifedata = search_spaces[search_space_id]['ifedata'], ifename = search_space_id,
+                                        timerData = timer_data)
 
-                                        Q, candidates, elapsed_time = FR3D_search(Q = queries[query_id]['Q'],
-                                                ifedata = search_spaces[search_space_id]['ifedata'], ifename = search_space_id,
-                                                timerData = timer_data)
+                            if candidates:
+                                temp_result = filter_out_conflicting_basepairs_and_stacks(candidates, queries[query_id], search_spaces[search_space_id])
 
-                                        print('Q  found %d candidates in %9.4f seconds; query size %d, search space size %d' % (len(candidates),time() - start_time, Q['numPositions'], search_space_length))
+                                #print("%d candidates remain after conflicting basepairs" % len(temp_result))
 
-                                else:
-                                    Q, candidates, elapsed_time = FR3D_search(Q = queries[query_id]['Q'],
-                                            ifedata = search_spaces[search_space_id]['ifedata'], ifename = search_space_id,
-                                            timerData = timer_data)
+                                if temp_result:
+                                    temp_result = filter_on_unmatched_nucleotides(temp_result,search_spaces[search_space_id],queries[query_id])
 
-                                if candidates:
-                                    temp_result = filter_out_conflicting_basepairs_and_stacks(candidates, queries[query_id], search_spaces[search_space_id])
-
-                                    #print("%d candidates remain after conflicting basepairs" % len(temp_result))
+                                    # if len(temp_result) > 0:
+                                    #     print("%d candidates remain after unmatched nucleotides" % len(temp_result))
 
                                     if temp_result:
-                                        temp_result = filter_on_unmatched_nucleotides(temp_result,search_spaces[search_space_id],queries[query_id])
-
-                                        # if len(temp_result) > 0:
-                                        #     print("%d candidates remain after unmatched nucleotides" % len(temp_result))
-
-                                        if temp_result:
-                                            temp_result = keep_lowest_discrepancy_candidate(temp_result)
-                                            dq = temp_result[0]['dq']
-                                            if len(dq) == 0:
-                                                temp_result[0]['match_type'] = "geometric"
-                                                results[(query_id,search_space_id)] = temp_result
-
-                                                if queries[query_id]['Q'].get("3x3",False):
-                                                    new_discrepancy = temp_result[0]['discrepancy']
-                                                    print("3x3 IL discrepancy for %s in %s goes from %0.2f to %0.2f" % (query_id,search_space_id,previous_discrepancy,new_discrepancy))
-
-                                                # if check_again:
-                                                #     new_discrepancy = temp_result[0]['discrepancy']
-                                                #     if previous_discrepancy - new_discrepancy > 0.1:
-                                                #         print("%s in %s discrepancy drops from %0.2f to %0.2f" % (query_id,search_space_id,previous_discrepancy,new_discrepancy))
-                                            else:
-                                                results[(query_id,search_space_id)] = dq[0]  # save one disqualification code
-                                            # else:
-                                            #     results[(query_id, search_space_id)] = UNMATCHED_BASEPAIR
+                                        temp_result = keep_lowest_discrepancy_candidate(temp_result)
+                                        dq = temp_result[0]['dq']
+                                        if len(dq) == 0:
+                                            temp_result[0]['match_type'] = "geometric"
+                                            results[(query_id,search_space_id)] = temp_result
+
+                                            if queries[query_id]['Q'].get("3x3",False):
+                                                new_discrepancy = temp_result[0]['discrepancy']
+                                                print("3x3 IL discrepancy for %s in %s goes from %0.2f to %0.2f" % (query_id,search_space_id,previous_discrepancy,new_discrepancy))
+
+                                            # if check_again:
+                                            #     new_discrepancy = temp_result[0]['discrepancy']
+                                            #     if previous_discrepancy - new_discrepancy > 0.1:
+                                            #         print("%s in %s discrepancy drops from %0.2f to %0.2f" % (query_id,search_space_id,previous_discrepancy,new_discrepancy))
                                         else:
-                                            results[(query_id, search_space_id)] = UNMATCHED_BASEPAIR
+                                            results[(query_id,search_space_id)] = dq[0]  # save one disqualification code
+                                        # else:
+                                        #     results[(query_id, search_space_id)] = UNMATCHED_BASEPAIR
                                     else:
-                                        results[(query_id, search_space_id)] = CONFLICTING_BASEPAIRS_AND_STACKS
+                                        results[(query_id, search_space_id)] = UNMATCHED_BASEPAIR
+                                else:
+                                    results[(query_id, search_space_id)] = CONFLICTING_BASEPAIRS_AND_STACKS
 
-                                    if len(temp_result) > 0:
-                                        print('Found %s inside %s in %3d ways, and %2d remain after filtering, %5d total results for %s' % (query_id,search_space_id,len(candidates),len(temp_result), len(results), search_space_pdb_id))
+                                if len(temp_result) > 0:
+                                    print('Found %s inside %s in %3d ways, and %2d remain after filtering, %5d total results for %s' % (query_id,search_space_id,len(candidates),len(temp_result), len(results), search_space_pdb_id))
 
-                                else: # no candidates from FR3D search
-                                    #results[(query_id, search_space)] = [{'dq': 0, 'discrepancy': 99}] # hoping disqualification code of 0 makes sense for NO MATCH
-                                    #Put 0 instead of list
-                                    results[(query_id, search_space_id)] = NO_CANDIDATES
-                                # after candidate sorting, we will no longer use Find_lowest()
-                                # run test_motif_atlas_code::check_interaction() after EACH FR3D search
-                            else:
-                                results[(query_id, search_space_id)] =  FLANKING_BP_CONFLICT
+                            else: # no candidates from FR3D search
+                                #results[(query_id, search_space)] = [{'dq': 0, 'discrepancy': 99}] # hoping disqualification code of 0 makes sense for NO MATCH
+                                #Put 0 instead of list
+                                results[(query_id, search_space_id)] = NO_CANDIDATES
+                            # after candidate sorting, we will no longer use Find_lowest()
+                            # run test_motif_atlas_code::check_interaction() after EACH FR3D search
+                        else:
+                            results[(query_id, search_space_id)] =  FLANKING_BP_CONFLICT
 
                 if isinstance(results[(query_id, search_space_id)],int):
                     search_results[(query_id,search_space_id)] = [{'dq': [NO_CANDIDATES], 'discrepancy': 99}]
@@ -1659,20 +1806,120 @@ def all_against_all_searches(loop_type,queries,search_spaces,flanking_bp_queries
                     search_results[(query_id,search_space_id)] = results[(query_id,search_space_id)]
 
 
-            if time() - start_time_on_this_pdb > 120:
-                save_search_results_one_pdb(loop_type, search_space_pdb_id, results, save_path)
-                print('Saved %d results for %s and %s in %s' % (len(results), loop_type, search_space_pdb_id, save_path))
+            if unsaved_pairs and time() - start_time_on_this_pdb > checkpoint_seconds:
+                count = append_search_results_one_pdb(loop_type, search_space_pdb_id, results, unsaved_pairs, save_path)
+                print('Saved %d new results, %d in total, for %s and %s in %s' % (count, len(results), loop_type, search_space_pdb_id, save_path))
                 start_time_on_this_pdb = time()
 
+        # report throughput and estimated time remaining for this shard
+        elapsed = time() - shard_start_time
+        remaining = elapsed * (len(search_space_ids) - loop_counter) / loop_counter
+        print('Shard %s: %4d/%4d search spaces, %d searches, %d pruned, %0.2f searches/sec, ETA %s' % (shard_name, loop_counter, len(search_space_ids), searches, pruned, searches / max(elapsed, 1e-6), format_eta(remaining)))
 
     # save the results for the last PDB, which may be the only PDB
-    if len(results) > 0:
-        print('Saving %d results for %s and %s in %s' % (len(results), loop_type, search_space_pdb_id, save_path))
-        save_search_results_one_pdb(loop_type, search_space_pdb_id, results, save_path)
+    if unsaved_pairs:
+        print('Saving %d results for %s and %s in %s' % (len(unsaved_pairs), loop_type, search_space_pdb_id, save_path))
+        append_search_results_one_pdb(loop_type, search_space_pdb_id, results, unsaved_pairs, save_path)
 
     return search_results
 
 
+def collect_search_results(loop_type, queries, search_space_ids, save_path = DATAPATHRESULTS):
+    """
+    Read the saved search results of the given search spaces back in,
+    in the same form that search_shard returns them
+    """
+
+    search_results = {}
+    pdb_to_ids = defaultdict(list)
+    for search_space_id in search_space_ids:
+        pdb_to_ids[search_space_id.split("_")[1]].append(search_space_id)
+
+    for pdb_id, ids in pdb_to_ids.items():
+        results = load_previous_search_results_one_pdb(loop_type, pdb_id, save_path)
+        for search_space_id in ids:
+            for query_id in queries.keys():
+                if query_id != search_space_id and (query_id, search_space_id) in results:
+                    value = results[(query_id, search_space_id)]
+                    if isinstance(value,int):
+                        search_results[(query_id,search_space_id)] = [{'dq': [NO_CANDIDATES], 'discrepancy': 99}]
+                    else:
+                        search_results[(query_id,search_space_id)] = value
+
+    return search_results
+
+
+# the arguments of the current sharded search, inherited by forked workers
+_shard_search_arguments = None
+
+
+def _search_one_shard(shard_index):
+    """
+    Search one shard inside a worker process; results go to the per PDB
+    files, only the number of search spaces is sent back
+    """
+
+    loop_type, queries, search_spaces, flanking_bp_queries, shards, load_saved_searches, save_path = _shard_search_arguments
+    shard_name = "%d/%d" % (shard_index + 1, len(shards))
+    search_shard(loop_type, queries, search_spaces, flanking_bp_queries, shards[shard_index], load_saved_searches, save_path, shard_name)
+    return len(shards[shard_index])
+
+
+def all_against_all_searches(loop_type,queries,search_spaces,flanking_bp_queries,load_saved_searches = True,reversed_search=False, save_path = DATAPATHRESULTS, shards = 1, workers = 1, shard = None):
+    """
+    Search all loops against all loops
+    The search spaces are split into shards by PDB id, see
+    shard_search_spaces.  Shards are searched one after the other or by a
+    pool of worker processes.  Setting shard to a number from 0 to shards-1
+    searches only that shard, so separate programs can each run one.
+    Each shard saves its results in the per PDB files, so a search that is
+    interrupted can be resumed by running it again.
+    Returns a dictionary of search results for the searched shards.
+    """
+
+    shard_ids = shard_search_spaces(search_spaces, shards, reversed_search)
+
+    if shard is not None:
+        if shard >= len(shard_ids):
+            return {}
+        shard_name = "%d/%d" % (shard + 1, len(shard_ids))
+        return search_shard(loop_type,queries,search_spaces,flanking_bp_queries,shard_ids[shard],load_saved_searches,save_path,shard_name)
+
+    if workers <= 1 or len(shard_ids) <= 1:
+        search_results = {}
+        for index, search_space_ids in enumerate(shard_ids):
+            shard_name = "%d/%d" % (index + 1, len(shard_ids))
+            search_results.update(search_shard(loop_type,queries,search_spaces,flanking_bp_queries,search_space_ids,load_saved_searches,save_path,shard_name))
+        return search_results
+
+    global _shard_search_arguments
+    _shard_search_arguments = (loop_type, queries, search_spaces, flanking_bp_queries, shard_ids, load_saved_searches, save_path)
+
+    if not os.path.exists(save_path):
+        os.mkdir(save_path)
+
+    # fork so the workers share the queries and search spaces without copying
+    start_time = time()
+    searched = 0
+    total = sum(len(ids) for ids in shard_ids)
+    context = multiprocessing.get_context('fork')
+    pool = context.Pool(processes = min(workers, len(shard_ids)))
+    try:
+        for count in pool.imap_unordered(_search_one_shard, range(len(shard_ids))):
+            searched += count
+            elapsed = time() - start_time
+            print('Finished a shard: %5d/%5d search spaces done, ETA %s' % (searched, total, format_eta(elapsed * (total - searched) / searched)))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        _shard_search_arguments = None
+
+    return collect_search_results(loop_type, queries, search_spaces.keys(), save_path)
+
+
 def clique_criterion(clique,disc_m,cluster_method):
     """
     Apply a criterion to evaluate a clique
@@ -1795,40 +2042,12 @@ def cluster_loops_maximum_clique(MM,disc_m,dq_matrix,ratio=1,cluster_method='cli
 def calculate_distance_matrices(search_results, all_loop_ids):
     """
     Calculate matching matrix, discrepancy matrix, disqualification matrix
+    The search results are turned into columns in one pass, then the
+    matrices are filled in by vectorized scatter
     """
 
-    # construct a "matching matrix" which has values 0 and 1, 1 for matches
-    N = len(all_loop_ids)
-
-    MM = np.zeros(shape=(N,N))       # matching matrix
-    disc_m = np.zeros(shape=(N,N))   # discrepancy matrix
-    dq_matrix = [[-1] * N for i in range(N)]
-
-    for i in range(0,N):
-        loop_i_id = all_loop_ids[i]
-        for j in range(i+1,N):
-            loop_j_id = all_loop_ids[j]
-
-            i_j_disqualification = search_results[(loop_i_id,loop_j_id)][0]['dq']
-            j_i_disqualification = search_results[(loop_j_id,loop_i_id)][0]['dq']
-
-            if len(i_j_disqualification) == 0 or len(j_i_disqualification) == 0:
-                # the loops can be in the same motif group
-                MM[i][j] = 1
-                i_j_discrepancy = search_results[(loop_i_id,loop_j_id)][0]['discrepancy']
-                j_i_discrepancy = search_results[(loop_j_id,loop_i_id)][0]['discrepancy']
-                disc_m[i][j] = min(i_j_discrepancy,j_i_discrepancy)
-            else:
-                # the loops cannot be in the same motif group
-                MM[i][j] = 0
-                dq_matrix[i][j] = i_j_disqualification[0]
-                dq_matrix[j][i] = j_i_disqualification[0]
-                disc_m[i][j] = 99999999999.0                # force them apart
-
-            MM[j][i] = MM[i][j]
-            disc_m[j][i] = disc_m[i][j]
-
-    return disc_m, MM, dq_matrix
+    columns = results_to_columns(search_results)
+    return distance_matrices([(columns['loop_ids'], columns['query'], columns['search'], columns['code'], columns['discrepancy'])], all_loop_ids)
 
 
 def cluster_loops_hierarchical(disc_m,cluster_method,all_loop_ids):
@@ -2182,9 +2401,16 @@ def keep_groups_with_x_ray_instance(motif_groups, all_loop_ids, pdb_list):
     return keep_motif_groups
 
 
-def cluster_loops(loop_position_to_border_unit_id, output_dir = './', molecule_type = 'RNA', x_ray_pdb_list = []):
+def cluster_loops(loop_position_to_border_unit_id, output_dir = './', molecule_type = 'RNA', x_ray_pdb_list = [], search_workers = 1, search_shards = None, search_shard = None, varna_workers = 4):
     """
     output_dir is like /usr/local/pipeline/hub-core/MotifAtlas/Releases/HL_3.87_2024-08-02_20:30
+    search_workers is the number of processes running all against all searches at once
+    search_shards is the number of shards to split the searches into, by
+    default 4 per worker so the load is balanced, or 1 with one worker
+    search_shard, if given, is the only shard to search, from 0 to
+    search_shards-1; the search results are saved and nothing is clustered,
+    so separate programs can each search one shard before clustering
+    varna_workers is the number of VARNA commands drawing group diagrams at once
     """
 
     queries = {}
@@ -2202,6 +2428,9 @@ def cluster_loops(loop_position_to_border_unit_id, output_dir = './', molecule_t
 
     load_saved_searches = True   # load saved search results for each PDB file; faster!
 
+    if not search_shards:
+        search_shards = 4 * search_workers if search_workers > 1 else 1   # more shards than workers balances the load
+
     ratio = 0.9          # the ratio that determines what range of clique sizes to compare
 
     use_loop_annotations = True  # a diagnostic technique
@@ -2235,7 +2464,11 @@ def cluster_loops(loop_position_to_border_unit_id, output_dir = './', molecule_t
     print("Start all against all searches")
     timer_data = myTimer("All against all searches",timer_data)
     motif_result_path = DATAPATHATLAS
-    search_results = all_against_all_searches(loop_type,queries,search_spaces,flanking_bp_queries,load_saved_searches,reversed_search, motif_result_path)
+    search_results = all_against_all_searches(loop_type,queries,search_spaces,flanking_bp_queries,load_saved_searches,reversed_search, motif_result_path, shards = search_shards, workers = search_workers, shard = search_shard)
+
+    if search_shard is not None:
+        print("Searched shard %d of %d, not clustering" % (search_shard + 1, search_shards))
+        return
 
     timer_data = myTimer("Calculate distance matrices",timer_data)
     print("Calculating distance matrices")
@@ -2427,6 +2660,9 @@ def cluster_loops(loop_position_to_border_unit_id, output_dir = './', molecule_t
     if not os.path.exists(folder_name):
         os.makedirs(folder_name)
 
+    # diagrams are collected for all groups and drawn after the loop
+    renderer = DiagramRenderer(output_dir, previous_dir=previous_diagram_dir(output_dir), workers=varna_workers)
+
     # re-order the instances in each group, find core positions, write HTML file for inspection
     for num, motif_group in enumerate(motif_groups):
 
@@ -2501,33 +2737,7 @@ def cluster_loops(loop_position_to_border_unit_id, output_dir = './', molecule_t
 
         print('Consensus interactions %s' % consensus_interactions)
 
-        varna_command = 'java -cp bin/VARNAv3-7.jar fr.orsay.lri.varna.applications.VARNAcmd -sequenceDBN "%s" -structureDBN "%s" -baseNum "#334455" -periodNum 1 -auxBPs "%s" -o %s/2ds/Group_%03d.svg' % (varna_command_info['sequenceDBN'], varna_command_info['structureDBN'], varna_command_info['auxBPs'], output_dir, group_num)
-        os.system(varna_command)
-        varna_command = 'java -cp bin/VARNAv3-7.jar fr.orsay.lri.varna.applications.VARNAcmd -sequenceDBN "%s" -structureDBN "%s" -baseNum "#334455" -periodNum 1 -auxBPs "%s" -o %s/2ds/Group_%03d.png' % (varna_command_info['sequenceDBN'], varna_command_info['structureDBN'], varna_command_info['auxBPs'], output_dir, group_num)
-        os.system(varna_command)
-        with open(output_dir + '/' + 'varna_commands.txt', 'a+') as file:
-            file.write(varna_command + '\n')
-
-        # if VARNA is not successful, store the command and put a generic image
-        varna_image_path = '%s/2ds/Group_%03d.png' % (output_dir, group_num)
-        if not os.path.exists(varna_image_path):
-            # write the bad command to a file so we can inspect it and fix it
-            # in one case structureDBN did not have matching parentheses
-            with open(output_dir + '/' + 'problemtic_varna_commands.txt', 'a+') as file:
-                file.write(varna_command + '\n')
-            # put a placeholder image for that group
-            first_varna_image_path = '/usr/local/pipeline/hub-core/pymotifs/motif_atlas/no_varna_image_available.png'
-            shutil.copy(first_varna_image_path, varna_image_path)
-
-        varna_image_path = '%s/2ds/Group_%03d.svg' % (output_dir, group_num)
-        if not os.path.exists(varna_image_path):
-            # write the bad command to a file so we can inspect it and fix it
-            # in one case structureDBN did not have matching parentheses
-            with open(output_dir + '/' + 'problemtic_varna_commands.txt', 'a+') as file:
-                file.write(varna_command + '\n')
-            # put a placeholder image for that group
-            first_varna_image_path = '/usr/local/pipeline/hub-core/pymotifs/motif_atlas/no_varna_image_available.svg'
-            shutil.copy(first_varna_image_path, varna_image_path)
+        renderer.add(group_num, varna_command_info)
 
         # the following function finds and writes the bp_signature for each group using loop_id_to_core_units and consensus_interactions
         writeCSVOutput(group_num, reordered_loop_ids, loop_ids_to_discrepancy, loop_id_to_core_units, centroid_id, loop_id_type_pair_to_interaction, queries, output_dir, consensus_interactions)
@@ -2535,6 +2745,10 @@ def cluster_loops(loop_position_to_border_unit_id, output_dir = './', molecule_t
         # bpSignature = find_bp_signature(queries, loop_id_to_core_units, centroid_id, loop_id_type_pair_to_interaction)
         # writeHTMLOutput(group_num,loops_of_interest, cluster_method,search_results,motif_groups,loop_id_to_core_units,reordered_loop_ids,queries,loop_ids_to_discrepancy,loop_id_to_matching_groups,loop_id_to_annotation,loop_id_to_group_number,group_max_distance,release, loop_id_type_pair_to_interaction,varna_command_info,bpSignature)
 
+    # draw the diagrams of all groups, several at once, reusing unchanged ones
+    timer_data = myTimer("Draw group diagrams",timer_data)
+    renderer.render()
+
     # print(crashnow)
 
     print(myTimer("summary"))
@@ -0,0 +1,286 @@
+"""
+Columnar storage of all against all motif search results.
+
+The results for the search spaces of one PDB file are kept in a directory
+named like IL_4V9F_search_results, holding numbered chunks.  Each chunk is
+an npz file with the loop ids used in it and one row per search:
+
+loop_ids     the loop ids used in this chunk
+query        index of the query loop id
+search       index of the search space loop id
+code         first disqualification code, or MATCH if the query matched
+discrepancy  discrepancy of the match, 99 when no candidate was found
+details      the full result of the search, for matches and lists of
+             disqualified candidates, or None when only a code was saved
+
+New results are appended as a new chunk, so only the changed PDB files are
+written and only the new rows.  Later chunks take precedence over earlier
+ones.  The numeric columns can be read without the details, which is what
+makes assembling the distance matrices fast.
+
+Older results saved as a gzipped pickle of a dict per PDB are read as the
+first chunk, and folded into the chunks when the store is compacted.
+"""
+
+import gzip
+import os
+import pickle
+
+import numpy as np
+
+
+"""Code for a search where the query matched the search space."""
+MATCH = -99
+
+"""Discrepancy recorded for searches that only saved a code."""
+NO_MATCH_DISCREPANCY = 99
+
+"""Number of chunks for one PDB file before they are merged."""
+MAX_CHUNKS = 8
+
+
+def summarize(value):
+    """
+    Give the code, discrepancy and details of one search result, which is
+    either an integer disqualification code or a list with one dictionary
+    having 'dq' and 'discrepancy' keys
+    """
+
+    if isinstance(value, (int, np.integer)):
+        return int(value), NO_MATCH_DISCREPANCY, None
+
+    if len(value) == 0:
+        return MATCH, NO_MATCH_DISCREPANCY, value
+
+    dq = value[0]['dq']
+    if len(dq) == 0:
+        code = MATCH
+    else:
+        code = dq[0]
+    return code, value[0]['discrepancy'], value
+
+
+def results_to_columns(results):
+    """
+    Turn a dictionary from (query id, search space id) to search result
+    into a dictionary of columns, as stored in one chunk
+    """
+
+    loop_index = {}
+    query = []
+    search = []
+    code = []
+    discrepancy = []
+    details = []
+
+    for (query_id, search_space_id), value in results.items():
+        query.append(loop_index.setdefault(query_id, len(loop_index)))
+        search.append(loop_index.setdefault(search_space_id, len(loop_index)))
+        c, d, v = summarize(value)
+        code.append(c)
+        discrepancy.append(d)
+        details.append(v)
+
+    loop_ids = sorted(loop_index, key=loop_index.get)
+    detail_column = np.empty(len(details), dtype=object)
+    detail_column[:] = details
+
+    return {
+        'loop_ids': np.array(loop_ids, dtype=str),
+        'query': np.array(query, dtype=np.int32),
+        'search': np.array(search, dtype=np.int32),
+        'code': np.array(code, dtype=np.int32),
+        'discrepancy': np.array(discrepancy, dtype=np.float64),
+        'details': detail_column,
+    }
+
+
+def columns_to_results(columns):
+    """
+    Turn stored columns back into a dictionary from (query id, search
+    space id) to search result
+    """
+
+    loop_ids = list(columns['loop_ids'])
+    results = {}
+    for q, s, c, v in zip(columns['query'], columns['search'],
+                          columns['code'], columns['details']):
+        if v is None:
+            v = int(c)
+        results[(loop_ids[q], loop_ids[s])] = v
+    return results
+
+
+class SearchResultStore(object):
+    """
+    The search results of one loop type, stored in a directory.
+    """
+
+    def __init__(self, path, loop_type):
+        self.path = path
+        self.loop_type = loop_type
+
+    def directory(self, pdb_id):
+        return os.path.join(self.path, '%s_%s_search_results' %
+                            (self.loop_type, pdb_id))
+
+    def legacy_file(self, pdb_id):
+        return os.path.join(self.path, '%s_%s_search_results.pickle.gz' %
+                            (self.loop_type, pdb_id))
+
+    def chunks(self, pdb_id):
+        """
+        List the chunk files of one PDB, oldest first
+        """
+
+        directory = self.directory(pdb_id)
+        if not os.path.isdir(directory):
+            return []
+        names = [n for n in os.listdir(directory)
+                 if n.startswith('chunk-') and n.endswith('.npz')]
+        return [os.path.join(directory, n) for n in sorted(names)]
+
+    def load_legacy(self, pdb_id):
+        file_path = self.legacy_file(pdb_id)
+        if not os.path.exists(file_path):
+            return {}
+        with gzip.open(file_path, 'rb') as f:
+            return pickle.load(f)
+
+    def load(self, pdb_id):
+        """
+        Load all search results of one PDB as a dictionary from (query id,
+        search space id) to the search result
+        """
+
+        results = self.load_legacy(pdb_id)
+        for chunk in self.chunks(pdb_id):
+            with np.load(chunk, allow_pickle=True) as data:
+                results.update(columns_to_results(data))
+        return results
+
+    def columns(self, pdb_id):
+        """
+        Load the numeric columns of one PDB, without the details.  Returns
+        a list of (loop_ids, query, search, code, discrepancy) tuples, one
+        for each chunk, oldest first.
+        """
+
+        found = []
+        legacy = self.load_legacy(pdb_id)
+        if legacy:
+            columns = results_to_columns(legacy)
+            found.append(tuple(columns[k] for k in
+                               ('loop_ids', 'query', 'search', 'code',
+                                'discrepancy')))
+        for chunk in self.chunks(pdb_id):
+            with np.load(chunk, allow_pickle=False) as data:
+                found.append((data['loop_ids'], data['query'],
+                              data['search'], data['code'],
+                              data['discrepancy']))
+        return found
+
+    def write_chunk(self, pdb_id, number, results):
+        directory = self.directory(pdb_id)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        # write to a temporary file first, an interrupted write must never
+        # leave a truncated chunk behind
+        file_path = os.path.join(directory, 'chunk-%06d.npz' % number)
+        temp_path = file_path + '.%d.tmp' % os.getpid()
+        with open(temp_path, 'wb') as raw:
+            np.savez(raw, **results_to_columns(results))
+        os.rename(temp_path, file_path)
+
+    def append(self, pdb_id, results):
+        """
+        Add new search results for one PDB, as a new chunk.  Results for a
+        pair which is already stored replace the stored result.
+        """
+
+        if not results:
+            return
+
+        chunks = self.chunks(pdb_id)
+        number = 0
+        if chunks:
+            number = int(os.path.basename(chunks[-1])[6:12]) + 1
+        self.write_chunk(pdb_id, number, results)
+
+        if len(chunks) + 1 > MAX_CHUNKS:
+            self.compact(pdb_id)
+
+    def replace(self, pdb_id, results):
+        """
+        Replace all stored search results for one PDB
+        """
+
+        old = self.chunks(pdb_id)
+        number = 0
+        if old:
+            number = int(os.path.basename(old[-1])[6:12]) + 1
+        self.write_chunk(pdb_id, number, results)
+        for chunk in old:
+            os.remove(chunk)
+        if os.path.exists(self.legacy_file(pdb_id)):
+            os.remove(self.legacy_file(pdb_id))
+
+    def compact(self, pdb_id):
+        """
+        Merge all chunks of one PDB, and the old pickle file if there is
+        one, into a single chunk
+        """
+        self.replace(pdb_id, self.load(pdb_id))
+
+
+def distance_matrices(columns, all_loop_ids):
+    """
+    Assemble the matching matrix, discrepancy matrix and disqualification
+    matrix for the given loops from search result columns, as given by
+    SearchResultStore.columns.  Every ordered pair of distinct loops must
+    have a result.
+
+    Two loops match when either one matched inside the other, then their
+    discrepancy is the smaller of the two discrepancies.  Otherwise the
+    discrepancy is 99999999999.0 and the disqualification matrix has the
+    code of each search.
+    """
+
+    N = len(all_loop_ids)
+    position = dict((loop_id, i) for i, loop_id in enumerate(all_loop_ids))
+
+    code = np.zeros((N, N), dtype=np.int32)
+    discrepancy = np.zeros((N, N))
+    found = np.zeros((N, N), dtype=bool)
+
+    for loop_ids, query, search, codes, discrepancies in columns:
+        # map this chunk's loop ids to rows, -1 for loops not of interest
+        rows = np.array([position.get(loop_id, -1) for loop_id in loop_ids],
+                        dtype=np.int64)
+        if len(rows) == 0:
+            continue
+        i = rows[query]
+        j = rows[search]
+        keep = (i >= 0) & (j >= 0)
+        code[i[keep], j[keep]] = codes[keep]
+        discrepancy[i[keep], j[keep]] = discrepancies[keep]
+        found[i[keep], j[keep]] = True
+
+    np.fill_diagonal(found, True)
+    if not found.all():
+        i, j = np.argwhere(~found)[0]
+        raise KeyError((all_loop_ids[i], all_loop_ids[j]))
+
+    matched = code == MATCH
+    MM = (matched | matched.T).astype(float)
+    np.fill_diagonal(MM, 0)
+
+    disc_m = np.where(MM == 1, np.minimum(discrepancy, discrepancy.T),
+                      99999999999.0)
+    np.fill_diagonal(disc_m, 0)
+
+    dq_matrix = np.where(MM == 1, -1, code)
+    np.fill_diagonal(dq_matrix, -1)
+
+    return disc_m, MM, dq_matrix.tolist()
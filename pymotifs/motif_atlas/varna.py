@@ -0,0 +1,294 @@
+"""
+Draw the secondary structure diagrams of motif groups with VARNA.
+
+Each diagram used to be drawn right after its group was made, with two
+`java` commands, one for the SVG and one for the PNG file. Starting the JVM
+takes most of the time of each command, so drawing thousands of groups took
+hours. Here the diagrams of all groups are collected first and then drawn at
+the end, several VARNA commands at once. The commands are run from a pool of
+threads, each of which only waits on its own `java` subprocess.
+
+A diagram only depends on the sequenceDBN, structureDBN and auxBPs of its
+group, so their md5 is recorded for each drawn group in a manifest in the 2ds
+directory of the release. When the previous release of the same loop type
+has a diagram with the same md5, its files are copied instead of drawing
+them again. Group numbers change between releases, so diagrams are found by
+their md5 and not by their group number.
+
+When VARNA cannot draw a diagram, the command is written to
+problemtic_varna_commands.txt and a placeholder image is used.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+"""The VARNA jar and the class that draws diagrams from the command line."""
+VARNA_JAR = 'bin/VARNAv3-7.jar'
+VARNA_CLASS = 'fr.orsay.lri.varna.applications.VARNAcmd'
+
+"""The formats each diagram is drawn in."""
+FORMATS = ('svg', 'png')
+
+"""Name of the manifest of drawn diagrams in the 2ds directory."""
+MANIFEST_NAME = 'varna_manifest.json'
+
+"""Images used for groups VARNA could not draw, with the format added."""
+PLACEHOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'no_varna_image_available')
+
+"""Seconds to wait for one VARNA command."""
+TIMEOUT = 300
+
+
+def diagram_hash(varna_command_info):
+    """
+    Compute the md5 of what a diagram is drawn from.
+
+    Parameters
+    ----------
+    varna_command_info : dict
+        The 'sequenceDBN', 'structureDBN' and 'auxBPs' of a group, as from
+        `motif_to_varna`.
+
+    Returns
+    -------
+    md5 : str
+        The md5 as a hex digest.
+    """
+
+    content = '\n'.join([varna_command_info['sequenceDBN'],
+                         varna_command_info['structureDBN'],
+                         varna_command_info['auxBPs']])
+    return hashlib.md5(content.encode('utf-8')).hexdigest()
+
+
+def previous_diagram_dir(output_dir):
+    """
+    Find the 2ds directory of the latest earlier release of the same loop
+    type which has a manifest. Release directories are named like
+    HL_3.87_2024-08-02_20:30, next to each other.
+
+    Parameters
+    ----------
+    output_dir : str
+        The directory of the current release.
+
+    Returns
+    -------
+    directory : str
+        The 2ds directory of the previous release, or None if there is none.
+    """
+
+    output_dir = os.path.abspath(output_dir)
+    parent, name = os.path.split(output_dir.rstrip(os.sep))
+    loop_type = name.split('_')[0]
+    if not os.path.isdir(parent):
+        return None
+
+    releases = []
+    for other in os.listdir(parent):
+        if other == name or not other.startswith(loop_type + '_'):
+            continue
+        manifest = os.path.join(parent, other, '2ds', MANIFEST_NAME)
+        if os.path.exists(manifest):
+            releases.append((other.split('_')[-2:], other))
+
+    if not releases:
+        return None
+    return os.path.join(parent, max(releases)[1], '2ds')
+
+
+class DiagramRenderer(object):
+    """
+    Collect the diagrams of motif groups and draw them all at once.
+
+    Attributes
+    ----------
+    output_dir : str
+        The release directory, diagrams are written to its 2ds directory.
+    previous_dir : str
+        The 2ds directory of the previous release to copy unchanged diagrams
+        from, or None.
+    workers : int
+        The number of threads running VARNA commands at once.
+    command : list
+        The command to run VARNA, without its arguments.
+    diagrams : list
+        The (group number, varna_command_info) of each collected group.
+    """
+
+    def __init__(self, output_dir, previous_dir=None, workers=4,
+                 command=None, timeout=TIMEOUT):
+        self.output_dir = output_dir
+        self.directory = os.path.join(output_dir, '2ds')
+        self.previous_dir = previous_dir
+        self.workers = workers
+        self.timeout = timeout
+        self.command = command or ['java', '-cp', VARNA_JAR, VARNA_CLASS]
+        self.diagrams = []
+
+    def add(self, group_num, varna_command_info):
+        """
+        Collect the diagram of a group, to be drawn by `render`.
+        """
+        self.diagrams.append((group_num, varna_command_info))
+
+    def filename(self, group_num, fmt, directory=None):
+        return os.path.join(directory or self.directory,
+                            'Group_%03d.%s' % (group_num, fmt))
+
+    def arguments(self, varna_command_info, filename):
+        """
+        Build the command which draws one diagram into the given file.
+        """
+
+        return self.command + [
+            '-sequenceDBN', varna_command_info['sequenceDBN'],
+            '-structureDBN', varna_command_info['structureDBN'],
+            '-baseNum', '#334455',
+            '-periodNum', '1',
+            '-auxBPs', varna_command_info['auxBPs'],
+            '-o', filename,
+        ]
+
+    def command_text(self, varna_command_info, filename):
+        """
+        Write the command which draws one diagram as it would be typed in a
+        shell, for the logs.
+        """
+
+        return ' '.join(self.command) + \
+            ' -sequenceDBN "%s" -structureDBN "%s" -baseNum "#334455"' \
+            ' -periodNum 1 -auxBPs "%s" -o %s' % \
+            (varna_command_info['sequenceDBN'],
+             varna_command_info['structureDBN'],
+             varna_command_info['auxBPs'], filename)
+
+    def previous(self):
+        """
+        Load the diagrams of the previous release, as a dict from md5 to
+        the group number they were drawn for.
+        """
+
+        if not self.previous_dir:
+            return {}
+
+        filename = os.path.join(self.previous_dir, MANIFEST_NAME)
+        if not os.path.exists(filename):
+            return {}
+
+        with open(filename, 'r') as raw:
+            manifest = json.load(raw)
+        return dict((md5, int(num)) for num, md5 in manifest.items())
+
+    def reuse(self, group_num, previous_num):
+        """
+        Copy the diagram files of a group of the previous release, if all of
+        them exist.
+        """
+
+        sources = [self.filename(previous_num, fmt, self.previous_dir)
+                   for fmt in FORMATS]
+        if not all(os.path.exists(source) for source in sources):
+            return False
+
+        for source, fmt in zip(sources, FORMATS):
+            shutil.copy(source, self.filename(group_num, fmt))
+        return True
+
+    def run(self, arguments):
+        """
+        Run one VARNA command, returning True if it succeeded.
+        """
+
+        filename = arguments[-1]
+        if os.path.exists(filename):
+            os.remove(filename)
+
+        try:
+            with open(os.devnull, 'w') as null:
+                subprocess.call(arguments, stdout=null, stderr=null,
+                                timeout=self.timeout)
+        except (OSError, subprocess.TimeoutExpired) as err:
+            print('VARNA failed to draw %s: %s' % (filename, err))
+            return False
+        return os.path.exists(filename)
+
+    def render(self):
+        """
+        Draw the diagrams of all collected groups, reusing unchanged ones from
+        the previous release, and write the manifest and the command logs.
+        The VARNA commands are run by `workers` threads.
+
+        Returns
+        -------
+        drawn : dict
+            A dict from group number to 'reused', 'drawn' or 'failed'.
+        """
+
+        start = time.time()
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+        previous = self.previous()
+        manifest = {}
+        status = {}
+        commands = []
+        for group_num, info in self.diagrams:
+            md5 = diagram_hash(info)
+            manifest['%03d' % group_num] = md5
+            if md5 in previous and self.reuse(group_num, previous[md5]):
+                status[group_num] = 'reused'
+                continue
+
+            for fmt in FORMATS:
+                commands.append((group_num, fmt, info,
+                                 self.filename(group_num, fmt)))
+
+        arguments = [self.arguments(c[2], c[3]) for c in commands]
+        if self.workers > 1 and len(arguments) > 1:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                results = list(executor.map(self.run, arguments))
+        else:
+            results = [self.run(args) for args in arguments]
+
+        failed = []
+        with open(os.path.join(self.output_dir, 'varna_commands.txt'),
+                  'a+') as log:
+            for (group_num, fmt, info, filename), success in \
+                    zip(commands, results):
+                log.write(self.command_text(info, filename) + '\n')
+                status.setdefault(group_num, 'drawn')
+                if not success:
+                    failed.append((group_num, fmt, info, filename))
+                    status[group_num] = 'failed'
+
+        for group_num, fmt, info, filename in failed:
+            # write the bad command to a file so we can inspect it and fix it
+            # in one case structureDBN did not have matching parentheses
+            with open(os.path.join(self.output_dir,
+                                   'problemtic_varna_commands.txt'),
+                      'a+') as log:
+                log.write(self.command_text(info, filename) + '\n')
+            # put a placeholder image for that group
+            placeholder = PLACEHOLDER + '.' + fmt
+            if os.path.exists(placeholder):
+                shutil.copy(placeholder, filename)
+            manifest.pop('%03d' % group_num, None)
+
+        with open(os.path.join(self.directory, MANIFEST_NAME), 'w') as raw:
+            json.dump(manifest, raw, indent=1, sort_keys=True)
+
+        counts = {}
+        for value in status.values():
+            counts[value] = counts.get(value, 0) + 1
+        print('Diagrams of %d groups in %.1f seconds: %s' %
+              (len(self.diagrams), time.time() - start,
+               ', '.join('%d %s' % (v, k) for k, v in sorted(counts.items()))))
+        return status
@@ -1,23 +1,35 @@
 import numpy as np
-from scipy.cluster.hierarchy import dendrogram, linkage
+from scipy.cluster.hierarchy import cophenet, dendrogram, linkage
 from scipy.spatial.distance import squareform
+import multiprocessing
 import random
 import math
+import time
 
 def treePenalty(distance,link="average"):
 
     """
-    print(distance.shape)
-
-    for i in range(0,10):
-        for j in range(0,10):
-            print("%5.3f" % distance[i][j]),
-        print
+    Penalty for each pair of points, the height in the tree at which they
+    are merged, which is the cophenetic distance.  This is filled in with
+    array operations, the same values as setting each pair in a loop.
     """
 
+    Z = linkage(squareform(distance),link)
+
+    penalty = squareform(cophenet(Z))
+
+    # scale the penalty as appropriate.  Avoid dividing by 0.
+    penalty = penalty * np.mean(distance) / max(0.00000001,np.mean(penalty))
+
+    return penalty
+
+def treePenaltyLoop(distance,link="average"):
+
+    """
+    The original way of computing treePenalty, kept for benchmarking.
+    """
 
     Z = linkage(squareform(distance),link)
-#    print("regular",Z)
 
     penalty = np.zeros(distance.shape)
 
@@ -34,19 +46,15 @@ def treePenalty(distance,link="average"):
                 penalty[i][j] = merger[2]
                 penalty[j][i] = merger[2]
 
-    if 0 > 1:
-        for i in range(0,len(distance)):
-            for j in range(0,len(distance)):
-                print("%6.3f" % penalty[i][j]),
-            print("")
-
-
     # scale the penalty as appropriate.  Avoid dividing by 0.
     penalty = penalty * np.mean(distance) / max(0.00000001,np.mean(penalty))
 
     return penalty
 
-def greedyInsertionPathLength(distance, order=[], verbose=False):
+def greedyInsertionPathLengthLoop(distance, order=[], verbose=False):
+    """
+    The original pure Python greedy insertion, kept for benchmarking.
+    """
     # if no starting ordering
     if len(order) == 0:
         order = list(range(0,len(distance)))
@@ -78,11 +86,96 @@ def greedyInsertionPathLength(distance, order=[], verbose=False):
 
     return path, score
 
-def multipleGreedyInsertionPathLength(distance, repetitions=100):
+def greedyInsertionPathLength(distance, order=[], verbose=False):
+    """
+    Build a path by inserting the points in the given order, or a random
+    order, one at a time where they add the least length.  The costs of all
+    insertion positions are computed with one array operation per point.
+    Candidates are considered in the same order as the original loop, the
+    beginning, the end, then each interior position, and the first smallest
+    one is used, so the paths are identical.
+    """
 
-    bestScore = float("inf")
+    # if no starting ordering
+    if len(order) == 0:
+        order = list(range(0,len(distance)))
+        random.shuffle(order)          # random starting ordering
+
+    distance = np.asarray(distance)
+    n = len(order)
+    path = np.empty(n, dtype=np.intp)
+    path[:2] = order[:2]
+    # edges[k] is the length from path[k] to path[k+1]
+    edges = np.empty(max(n-1, 1))
+    edges[0] = distance[path[0], path[1]]
+    score = distance[path[0], path[1]]
+
+    costs = np.empty(n+1)
+    for p in range(2, n):
+        point = order[p]
+        length = p
+        current = path[:length]
+
+        costs[0] = distance[point, current[0]]
+        costs[1] = distance[current[-1], point]
+        costs[2:length+1] = distance[current[:-1], point] + \
+            distance[point, current[1:]] - edges[:length-1]
+
+        best = int(np.argmin(costs[:length+1]))
+        if best == 0:
+            bestPosition = 0
+        elif best == 1:
+            bestPosition = length
+        else:
+            bestPosition = best - 1
+
+        # shift the rest of the path and its edges to make room
+        path[bestPosition+1:length+1] = path[bestPosition:length].copy()
+        path[bestPosition] = point
+        if bestPosition == 0:
+            edges[1:length] = edges[0:length-1].copy()
+            edges[0] = distance[point, path[1]]
+        elif bestPosition == length:
+            edges[length-1] = distance[path[length-1], point]
+        else:
+            edges[bestPosition+1:length] = edges[bestPosition:length-1].copy()
+            edges[bestPosition-1] = distance[path[bestPosition-1], point]
+            edges[bestPosition] = distance[point, path[bestPosition+1]]
+
+        score += costs[best]
+
+    return [int(i) for i in path], score
+
+def _greedyInsertion(arguments):
+    distance, order = arguments
+    return greedyInsertionPathLength(distance, order)
+
+def multipleGreedyInsertionPathLength(distance, repetitions=100, workers=1):
+    """
+    Run greedy insertion from many random starting orders and keep the
+    shortest path.  All starting orders are drawn before any are run, in the
+    same sequence as running them one at a time, so using several worker
+    processes gives the same path as using one.
+    """
+
+    orders = []
     for rep in range(0,repetitions):
-        path, score = greedyInsertionPathLength(distance)
+        order = list(range(0,len(distance)))
+        random.shuffle(order)          # random starting ordering
+        orders.append(order)
+
+    if workers > 1 and repetitions > 1:
+        pool = multiprocessing.Pool(min(workers, repetitions))
+        try:
+            results = pool.map(_greedyInsertion, [(distance, o) for o in orders])
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = (greedyInsertionPathLength(distance, o) for o in orders)
+
+    bestScore = float("inf")
+    for path, score in results:
         if score < bestScore:
             bestScore = score
             bestPath = path
@@ -118,14 +211,14 @@ def orientPath(distance,path):
         else:
             return path
 
-def treePenalizedPathLength(distance,repetitions=100,seed=None):
+def treePenalizedPathLength(distance,repetitions=100,seed=None,workers=1):
     if seed:
         random.seed(seed)
 
     n = distance.shape[0]
     if n > 2:
         penalizedMatrix = distance + treePenalty(distance)
-        order = multipleGreedyInsertionPathLength(penalizedMatrix,repetitions)
+        order = multipleGreedyInsertionPathLength(penalizedMatrix,repetitions,workers)
         order = orientPath(distance,order)
     else:
         order = list(range(0,n))
@@ -214,5 +307,42 @@ def testOrdering():
     print("Ordering:")
     print(order)
 
+def benchmarkOrdering(size=1000,repetitions=5,seed=2276393):
+    """
+    Compare the time of the array based tree penalty and greedy insertion
+    with the original loops, on random points, and check that they give the
+    same path.
+    """
+    points, distance = generateUniformDataset(size,3,seed)
+
+    start = time.time()
+    penaltyLoop = treePenaltyLoop(distance)
+    penaltyLoopTime = time.time() - start
+
+    start = time.time()
+    penalty = treePenalty(distance)
+    penaltyTime = time.time() - start
+
+    print("treePenalty: loop %.3f s, arrays %.3f s, same %s" % (penaltyLoopTime, penaltyTime, np.array_equal(penalty, penaltyLoop)))
+
+    penalized = distance + penalty
+    orders = []
+    for rep in range(0,repetitions):
+        order = list(range(0,size))
+        random.Random(seed+rep).shuffle(order)
+        orders.append(order)
+
+    start = time.time()
+    loopResults = [greedyInsertionPathLengthLoop(penalized, o) for o in orders]
+    loopTime = time.time() - start
+
+    start = time.time()
+    results = [greedyInsertionPathLength(penalized, o) for o in orders]
+    arrayTime = time.time() - start
+
+    same = all(a[0] == b[0] for a, b in zip(loopResults, results))
+    print("greedy insertion of %d points, %d repetitions: loop %.3f s, arrays %.3f s, speedup %.1fx, same paths %s" % (size, repetitions, loopTime, arrayTime, loopTime / max(arrayTime, 0.000001), same))
+
+#benchmarkOrdering()
 #testOrdering()
 #testPenaltyMatrix()
@@ -3,9 +3,10 @@ reports. This will fetch the data for all the given PDBs if any one does not
 have data. The old data will be overwritten as needed.
 """
 
-import requests
 from pymotifs import core
 from pymotifs.utils.pdb import CustomReportHelper
+from pymotifs.utils.graphql import EntryFetcher
+from pymotifs.utils.graphql import FetchFailed
 
 from pymotifs import models as mod
 
@@ -90,6 +91,11 @@ class Loader(core.SimpleLoader):
                 limit(1)
             return bool(query.count())
 
+    def entries_with_data(self, pdbs, **kwargs):
+        """Find which of the given PDBs have data, in a few queries.
+        """
+        return self.entries_with_rows(mod.PdbInfo.pdb_id, pdbs)
+
     def query(self, session, pdb):
         """Generate a query to find all entries in PDBInfo for the given
         PDB id.  Added in November 2020 so this can be a SimpleLoader.
@@ -137,11 +143,39 @@ class Loader(core.SimpleLoader):
 
         return [mod.PdbInfo(**self.rename(report)) for report in data]
 
-    def data(self, pdbs, **kwargs):
-        """New in November 2020.
-        Get data from PDB's graphQL query.
-        We loop over PDB IDs, make a query for each one, and
-        run the query, then split out the data that is returned.
+    fields = """
+        entry {
+          id
+        }
+        struct {
+          title
+        }
+        exptl {
+          method
+        }
+        rcsb_entry_info {
+          resolution_combined
+        }
+        rcsb_accession_info {
+          deposit_date
+          initial_release_date
+          revision_date
+        }
+        audit_author {
+          name
+        }
+    """
+    """The GraphQL fields to get for each entry."""
+
+    entries = {}
+    """Entries fetched ahead of time by `to_process`, by PDB id."""
+
+    def to_process(self, pdbs, **kwargs):
+        """Get the PDBs to process, and fetch the data of all that are missing
+        from PDB's graphQL service at once, in batched and concurrent
+        requests. Fetching one at a time takes hours for the whole PDB. The
+        PDBs of any batch that could not be fetched are left to `entry`,
+        which fetches each of them on its own.
 
         Parameters
         ----------
@@ -150,86 +184,119 @@ class Loader(core.SimpleLoader):
 
         Returns
         -------
-        reports : list
-            A list of PdbInfo objects to write to the database.
+        pdbs : list
+            The PDB ids to process.
         """
 
-        # The GraphQL query is defined as a multi-line string.
-        query = """
-        {
-          entry(entry_id:"XXXX") {
-            entry {
-              id
-            }
-            struct {
-              title
-            }
-            exptl {
-              method
-            }
-            rcsb_entry_info {
-              resolution_combined
-            }
-            rcsb_accession_info {
-              deposit_date
-              initial_release_date
-              revision_date
-            }
-            audit_author {
-              name
-            }
-          }
-        }
+        pdbs = super(Loader, self).to_process(pdbs, **kwargs)
+
+        missing = set(pdbs)
+        if not self.must_recompute(None, **kwargs):
+            with self.session() as session:
+                query = session.query(mod.PdbInfo.pdb_id).\
+                    filter(mod.PdbInfo.pdb_id.in_(pdbs))
+                missing.difference_update(r.pdb_id for r in query)
+
+        if len(missing) > 1:
+            self.logger.info("Fetching PDB info for %d files", len(missing))
+            self.entries = self.fetcher()(missing, strict=False)
+        return pdbs
+
+    def fetcher(self):
+        """Create the `EntryFetcher` to use, configured with the
+        'pdb_graphql' section of the configuration.
         """
+        return EntryFetcher.from_config(self.config, self.fields)
 
-        if isinstance(pdbs, str):
-            pdbs = [pdbs]
+    def entry(self, pdb):
+        """Get the graphQL entry of a PDB, using the entries fetched ahead of
+        time if possible.
 
-        data = []
+        Parameters
+        ----------
+        pdb : str
+            The PDB id.
 
-        for pdb in pdbs:
+        Returns
+        -------
+        entry : dict
+            The entry, as returned by graphQL.
+        """
 
-            self.logger.info("Using PDB graphQL to get data for %s file" % pdb)
+        if pdb in self.entries:
+            return self.entries[pdb]
 
-            currentquery = query.replace("XXXX",pdb)
+        self.logger.info("Using PDB graphQL to get data for %s file" % pdb)
+        try:
+            entry = self.fetcher()([pdb]).get(pdb.upper())
+        except FetchFailed as err:
+            self.logger.error(str(err))
+            entry = None
 
-            # the following line worked on rnatest but not on production
-            # trying it again after the url method stopped working on some structures
-            response = requests.post('https://data.rcsb.org/graphql', json={"query": currentquery})
+        if not entry:
+            self.logger.error("Could not get PDB info for %s" % pdb)
+            raise core.StageFailed("Could not get PDB info for %s" % pdb)
+        return entry
 
-            # here is a different way to do it
-            # currenturl = 'https://data.rcsb.org/graphql?query=' + currentquery
-            # response = requests.get(currenturl)
+    def as_info(self, pdb, entry):
+        """Turn a graphQL entry into the data for the pdb_info table.
 
-            if response.status_code == 200:
-                result = response.json()
-            else:
-                self.logger.error("Could not get PDB info for %s" % pdb)
-                # self.logger.error(currenturl)
-                raise core.StageFailed("Could not get PDB info for %s" % pdb)
+        Parameters
+        ----------
+        pdb : str
+            The PDB id.
+        entry : dict
+            The entry, as returned by graphQL.
+
+        Returns
+        -------
+        renamed : dict
+            The data to store.
+        """
 
-            renamed = {}
-            renamed["pdb_id"] = pdb
-            renamed["title"] = result["data"]["entry"]["struct"]["title"]
-            renamed["deposition_date"] = result["data"]["entry"]["rcsb_accession_info"]["deposit_date"][0:10]
-            renamed["release_date"] = result["data"]["entry"]["rcsb_accession_info"]["initial_release_date"][0:10]
-            renamed["revision_date"] = result["data"]["entry"]["rcsb_accession_info"]["revision_date"][0:10]
-            renamed["ndb_id"] = pdb
-            renamed["resolution"] = result["data"]["entry"]["rcsb_entry_info"]["resolution_combined"]
-            renamed["authors"] = ", ".join([x["name"] for x in result["data"]["entry"]["audit_author"]])
+        renamed = {}
+        renamed["pdb_id"] = pdb
+        renamed["title"] = entry["struct"]["title"]
+        renamed["deposition_date"] = entry["rcsb_accession_info"]["deposit_date"][0:10]
+        renamed["release_date"] = entry["rcsb_accession_info"]["initial_release_date"][0:10]
+        renamed["revision_date"] = entry["rcsb_accession_info"]["revision_date"][0:10]
+        renamed["ndb_id"] = pdb
+        renamed["resolution"] = entry["rcsb_entry_info"]["resolution_combined"]
+        renamed["authors"] = ", ".join([x["name"] for x in entry["audit_author"]])
+        try:
+            renamed["experimental_technique"] = entry["exptl"][0]["method"]
+        except:
+            # some structures have no such data because they are some hybrid method, like 8ZZS
+            renamed["experimental_technique"] = "HYBRID"
+
+        if renamed['resolution']:
             try:
-                renamed["experimental_technique"] = result["data"]["entry"]["exptl"][0]["method"]
+                renamed['resolution'] = float(renamed['resolution'][0])
             except:
-                # some structures have no such data because they are some hybrid method, like 8ZZS
-                renamed["experimental_technique"] = "HYBRID"
+                renamed['resolution'] = None
+                self.logger.error("Resoultion entry for %s is not a number" % pdb)
+
+        return renamed
+
+    def data(self, pdbs, **kwargs):
+        """New in November 2020.
+        Get data from PDB's graphQL query. Entries are normally fetched for
+        all PDBs at once by `to_process`, any others are fetched here one at
+        a time.
+
+        Parameters
+        ----------
+        pdbs : list
+            A list of PDB ids
 
-            if renamed['resolution']:
-                try:
-                    renamed['resolution'] = float(renamed['resolution'][0])
-                except:
-                    renamed['resolution'] = None
-                    self.logger.error("Resoultion entry for %s is not a number" % pdb)
+        Returns
+        -------
+        reports : list
+            A list of PdbInfo objects to write to the database.
+        """
 
-            data.append(renamed)
+        if isinstance(pdbs, str):
+            pdbs = [pdbs]
 
+        data = [self.as_info(pdb, self.entry(pdb)) for pdb in pdbs]
         return [mod.PdbInfo(**report) for report in data]
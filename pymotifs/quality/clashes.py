@@ -146,15 +146,14 @@ class Loader(core.SimpleLoader):
         -------
         An iterable of all unit level quality data.
         """
-        with open(filename, 'rb') as raw:
-            parser = qual.Parser(raw.read())
-            try:
-                for data in parser.clashes(mapping):
-                    for clash in self.as_clash(data):
-                        yield clash
-            except Exception as err:
-                self.logger.exception(err)
-                raise core.Skip("Could not load clashes")
+        parser = qual.Parser(filename)
+        try:
+            for data in parser.clashes(mapping):
+                for clash in self.as_clash(data):
+                    yield clash
+        except Exception as err:
+            self.logger.exception(err)
+            raise core.Skip("Could not load clashes")
 
     def data(self, pdb, **kwargs):
 
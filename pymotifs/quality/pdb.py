@@ -76,8 +76,7 @@ class Loader(core.SimpleLoader):
         """
         if not os.path.exists(filename):
             raise core.Skip("Missing file %s" % filename)
-        with open(filename, 'rb') as raw:
-            parser = Parser(raw.read())
+        parser = Parser(filename)
         entity = parser.entity()
         return mod.PdbQuality(**entity)
 
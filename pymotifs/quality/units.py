@@ -148,9 +148,8 @@ class Loader(core.SimpleLoader):
         -------
         An iterable of all unit level quality data.
         """
-        with open(filename, 'rb') as raw:
-            parser = qual.Parser(raw.read())
-            return map(self.as_quality, parser.nts(mapping))
+        parser = qual.Parser(filename)
+        return map(self.as_quality, parser.nts(mapping))
 
     def data(self, pdb, **kwargs):
         """
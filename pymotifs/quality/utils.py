@@ -9,6 +9,7 @@ import hashlib
 import operator as op
 import collections as coll
 import xml.etree.ElementTree as ET
+from contextlib import contextmanager
 
 import sys
 
@@ -169,6 +170,29 @@ class Utils(core.Base):
         return mapping
 
 
+class DigestReader(object):
+    """
+    Wrap a file to compute the md5 of everything read from it.
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.md5 = hashlib.md5()
+
+    def read(self, size=-1):
+        data = self.raw.read(size)
+        self.md5.update(data)
+        return data
+
+    def hexdigest(self):
+        """
+        Read whatever is left of the file and give the md5 of all of it.
+        """
+        while self.read(64 * 1024):
+            pass
+        return self.md5.hexdigest()
+
+
 class Parser(object):
     """
     A class to parse the results of getting the quality file.
@@ -179,8 +203,8 @@ class Parser(object):
         A function to generate unit ids from dictionaries.
     digest : str
         The md5 hash of the content
-    root : ElementTree
-        The parsed XML tree for processing.
+    source : bytes, str or file
+        What the report is read from.
     """
 
     unit_renamer = rn.Renamer(
@@ -246,23 +270,99 @@ class Parser(object):
         rn.transform('dist', float),
     )
 
-    def __init__(self, gz_content):
+    def __init__(self, source):
         """
-        Create a new `Parser` to parse the given gz_content. This parser will
-        extract the residue level entries from the content.
+        Create a new `Parser` to parse the given report. Nothing is read until
+        data is asked for, and then the report is read and parsed as a stream,
+        one residue at a time, so the whole report is never held in memory.
 
         Parameters
         ----------
-        gz_content : str
-            A gzip'ed string of the file to parse.
+        source : bytes, str or file
+            The gzip'ed content of the report, the name of the gzip'ed report
+            or an open, seekable, file of it.
         """
-        filehandle = sio.BytesIO(gz_content)
-        content = gzip.GzipFile(fileobj=filehandle).read()
-        md5 = hashlib.md5()
-        md5.update(content)
         self.generator = encode
-        self.digest = md5.hexdigest()
-        self.root = ET.fromstring(content)
+        self.source = source
+        self._digest = None
+        self._entry = None
+        self._root = None
+
+    @contextmanager
+    def open(self):
+        """
+        Open the decompressed report for reading from the start.
+        """
+
+        if isinstance(self.source, bytes):
+            with gzip.GzipFile(fileobj=sio.BytesIO(self.source)) as raw:
+                yield raw
+        elif isinstance(self.source, str):
+            with gzip.open(self.source, 'rb') as raw:
+                yield raw
+        else:
+            self.source.seek(0)
+            with gzip.GzipFile(fileobj=self.source) as raw:
+                yield raw
+
+    def residues(self):
+        """
+        Parse the report incrementally. Each residue is given as soon as it
+        has been read, and is then dropped from the tree, so memory use does
+        not grow with the size of the report. The md5 of the report is
+        computed as it is read, and is known once all residues have been
+        read.
+
+        Yields
+        ------
+        residue : tuple
+            A tuple of the attributes of a ModelledSubgroup entry and a list
+            of the attributes of each of its clash entries.
+        """
+
+        with self.open() as raw:
+            reader = DigestReader(raw)
+            context = ET.iterparse(reader, events=('start', 'end'))
+            _, root = next(context)
+            for event, element in context:
+                if event != 'end':
+                    continue
+                if element.tag == 'Entry':
+                    self._entry = dict(element.attrib)
+                    root.clear()
+                elif element.tag == 'ModelledSubgroup':
+                    clashes = [dict(c.attrib) for c in element.findall('clash')]
+                    yield dict(element.attrib), clashes
+                    root.clear()
+            self._digest = reader.hexdigest()
+
+    def scan(self):
+        """
+        Read the whole report, without keeping anything, to find the entry
+        level attributes and the md5.
+        """
+        for _ in self.residues():
+            pass
+
+    @property
+    def digest(self):
+        """
+        The md5 hash of the decompressed report.
+        """
+        if self._digest is None:
+            self.scan()
+        return self._digest
+
+    @property
+    def root(self):
+        """
+        The complete parsed tree of the report. This holds the whole report in
+        memory, the other methods do not use it.
+        """
+        if self._root is None:
+            with self.open() as raw:
+                self._root = ET.parse(raw).getroot()
+        return self._root
 
     def entity(self):
         """
@@ -274,7 +374,9 @@ class Parser(object):
             A dictonary of mappings for all attributes on the entity entry.
             The keys and values will all be strings.
         """
-        data = self.structure_renamer(self.root.find("Entry").attrib)
+        if self._entry is None or self._digest is None:
+            self.scan()
+        data = self.structure_renamer(self._entry)
         data['md5'] = self.digest
         return data
 
@@ -313,13 +415,13 @@ class Parser(object):
             A dictionary of nt level data.
         """
 
-        for residue in self.root.findall("ModelledSubgroup"):
-            data = self.unit_renamer(residue.attrib, skip_missing=True)
+        for attributes, _ in self.residues():
+            data = self.unit_renamer(attributes, skip_missing=True)
 
             if not data:
                 continue
 
-            uid = as_key(self.unit_id_renamer(residue.attrib))
+            uid = as_key(self.unit_id_renamer(attributes))
 
             if uid not in mapping:
                 # The validation file envisions a unit that does not map cleanly
@@ -355,8 +457,8 @@ class Parser(object):
             }
 
         clashes = coll.defaultdict(empty_clash)
-        for residue in self.root.findall("ModelledSubgroup"):
-            uid = as_key(self.unit_id_renamer(residue.attrib))
+        for attributes, residue_clashes in self.residues():
+            uid = as_key(self.unit_id_renamer(attributes))
             if uid not in mapping:
                 # The validation file envisions a unit that does not map cleanly
                 # to a unit id.  That can happen because they don't list a base sequence.
@@ -379,8 +481,8 @@ class Parser(object):
 
             if mapping[uid]:
                 unit_ids = sorted(mapping[uid])
-                for clash in residue.findall('clash'):
-                    data = self.clash_renamer(clash.attrib)
+                for clash in residue_clashes:
+                    data = self.clash_renamer(clash)
                     entry = clashes[data['cid']]
                     entry['magnitude'] = data['clashmag']
                     entry['distance'] = data['dist']
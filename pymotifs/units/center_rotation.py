@@ -15,6 +15,10 @@ class Loader(core.SimpleLoader):
     dependencies = set([InfoLoader])
     allow_no_data = True
 
+    # millions of rows are written each week, skip the ORM when saving
+    saver = core.BulkDatabaseSaver
+    insert_max = 10000
+
     mark = False
     use_marks = False
 
@@ -67,6 +71,14 @@ class Loader(core.SimpleLoader):
         else:
             return session.query(mod.UnitCenters).filter_by(pdb_id=pdb)
 
+    def entries_with_data(self, pdbs, **kwargs):
+        """Find which of the given PDBs have unit centers, in a few queries.
+        When filling in missing units every PDB is treated as having none.
+        """
+        if self.fill_in_missing:
+            return set()
+        return self.entries_with_rows(mod.UnitCenters.pdb_id, pdbs)
+
 
     def data(self, pdb, **kwargs):
         """
@@ -104,48 +116,61 @@ class Loader(core.SimpleLoader):
 
         structure = self.structure(pdb)
 
-        c = 0
         for residue in structure.residues():
-            # if the unit has any center at all, skip it
-            # if we ever have to add some new center, this logic will need to change
-
-            for name in residue.centers.definitions():
-
-                if name in center_to_unit_id and residue.unit_id() in center_to_unit_id[name]:
-                    # already have this center, so don't add it again
-                    continue
-
-                center = residue.centers[name]
-
-                if len(center) == 3:
-                    if self.fill_in_missing:
-                        self.logger.info("Adding center %s for %s value %s" % (residue.unit_id(), name, center))
-                        print("Adding center %s for %s value %s" % (residue.unit_id(), name, center))
-
-                    yield mod.UnitCenters(unit_id=residue.unit_id(),
-                                          name=name,
-                                          pdb_id=pdb,
-                                          x=float(center[0]),
-                                          y=float(center[1]),
-                                          z=float(center[2]))
-
-                if name == 'glycosidic':
-                    # only add the rotation matrix after adding a glycosidic atom
-                    # then it only gets added once, right?
-                    if hasattr(residue, 'rotation_matrix'):
-                        matrix = residue.rotation_matrix
-                        # if there are not enough atoms for the rotation matrix, it will be None
-                        if matrix is not None:
-                            c += 1
-                            yield mod.UnitRotations(unit_id=residue.unit_id(),
-                                                    pdb_id=pdb,
-                                                    cell_0_0=float(matrix[0, 0]),
-                                                    cell_0_1=float(matrix[0, 1]),
-                                                    cell_0_2=float(matrix[0, 2]),
-                                                    cell_1_0=float(matrix[1, 0]),
-                                                    cell_1_1=float(matrix[1, 1]),
-                                                    cell_1_2=float(matrix[1, 2]),
-                                                    cell_2_0=float(matrix[2, 0]),
-                                                    cell_2_1=float(matrix[2, 1]),
-                                                    cell_2_2=float(matrix[2, 2]))
+            for row in self.residue_data(pdb, residue, center_to_unit_id):
+                yield row
+
+    def residue_data(self, pdb, residue, known=None):
+        """
+        Compute the centers and rotation matrix of a single residue.
+
+        :pdb: The pdb the residue is from
+        :residue: The residue to use
+        :known: A dict from center name to the unit ids that already have
+        that center, these centers are not computed again
+        :returns: A list of UnitCenters and UnitRotations
+        """
 
+        known = known or {}
+        unit_id = residue.unit_id()
+
+        rows = []
+        for name in residue.centers.definitions():
+
+            if name in known and unit_id in known[name]:
+                # already have this center, so don't add it again
+                continue
+
+            center = residue.centers[name]
+
+            if len(center) == 3:
+                if self.fill_in_missing:
+                    self.logger.info("Adding center %s for %s value %s" % (unit_id, name, center))
+                    print("Adding center %s for %s value %s" % (unit_id, name, center))
+
+                rows.append(mod.UnitCenters(unit_id=unit_id,
+                                            name=name,
+                                            pdb_id=pdb,
+                                            x=float(center[0]),
+                                            y=float(center[1]),
+                                            z=float(center[2])))
+
+            if name == 'glycosidic':
+                # only add the rotation matrix after adding a glycosidic atom
+                # then it only gets added once, right?
+                if hasattr(residue, 'rotation_matrix'):
+                    matrix = residue.rotation_matrix
+                    # if there are not enough atoms for the rotation matrix, it will be None
+                    if matrix is not None:
+                        rows.append(mod.UnitRotations(unit_id=unit_id,
+                                                      pdb_id=pdb,
+                                                      cell_0_0=float(matrix[0, 0]),
+                                                      cell_0_1=float(matrix[0, 1]),
+                                                      cell_0_2=float(matrix[0, 2]),
+                                                      cell_1_0=float(matrix[1, 0]),
+                                                      cell_1_1=float(matrix[1, 1]),
+                                                      cell_1_2=float(matrix[1, 2]),
+                                                      cell_2_0=float(matrix[2, 0]),
+                                                      cell_2_1=float(matrix[2, 1]),
+                                                      cell_2_2=float(matrix[2, 2])))
+        return rows
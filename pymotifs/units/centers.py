@@ -19,6 +19,9 @@ class Loader(core.SimpleLoader):
         return session.query(mod.UnitCenters).\
             filter(mod.UnitCenters.pdb_id == pdb)
 
+    def entries_with_data(self, pdbs, **kwargs):
+        return self.entries_with_rows(mod.UnitCenters.pdb_id, pdbs)
+
     def data(self, pdb, **kwargs):
         structure = self.structure(pdb)
         for residue in structure.residues():
@@ -153,18 +153,66 @@ class Loader(core.SimpleLoader):
             if unit.unit_id() in has_coordinates:
                 continue
 
-            # pass the pdb id and the entire unit to self.coordinates
-            coord = self.coordinates(pdb, unit)
-            self.logger.debug("data: PDB: %s" % pdb)
-            self.logger.debug("data: unit: %s" % unit)
-            self.logger.debug("data: coordinates: %s" % coord)
-            if not coord:
-                raise core.InvalidState("No coordinates computed for %s" % unit)
-
-            if self.fill_in_missing:
-                print("Adding coordinates for %s value %s" % (unit.unit_id(), coord))
-
-            yield mod.UnitCoordinates(
-                unit_id=unit.unit_id(),
-                coordinates=coord,
-            )
+            yield self.as_coordinates(pdb, unit)
+
+
+    def as_coordinates(self, pdb, unit):
+        """
+        Compute the `UnitCoordinates` for a single unit.
+
+        Parameters
+        ----------
+        pdb : str
+            The PDB id to use.
+
+        unit : fr3d.data.Component
+            The unit to convert.
+
+        Raises
+        ------
+        InvalidState
+            If no coordinates could be computed for the unit.
+
+        Returns
+        -------
+        coord : UnitCoordinates
+            The coordinates of the unit.
+        """
+
+        # pass the pdb id and the entire unit to self.coordinates
+        coord = self.coordinates(pdb, unit)
+        self.logger.debug("data: PDB: %s" % pdb)
+        self.logger.debug("data: unit: %s" % unit)
+        self.logger.debug("data: coordinates: %s" % coord)
+        if not coord:
+            raise core.InvalidState("No coordinates computed for %s" % unit)
+
+        if self.fill_in_missing:
+            print("Adding coordinates for %s value %s" % (unit.unit_id(), coord))
+
+        return mod.UnitCoordinates(
+            unit_id=unit.unit_id(),
+            coordinates=coord,
+        )
+
+
+    def residue_data(self, pdb, residue):
+        """
+        Compute the rows for a single residue. This is what
+        `pymotifs.units.fused` uses to compute this table together with the
+        other unit tables.
+
+        Parameters
+        ----------
+        pdb : str
+            The PDB id the residue is from.
+
+        residue : fr3d.data.Component
+            The residue to use.
+
+        Returns
+        -------
+        data : list
+            A list with the `UnitCoordinates` for the residue.
+        """
+        return [self.as_coordinates(pdb, residue)]
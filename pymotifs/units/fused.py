@@ -0,0 +1,275 @@
+"""
+Compute several unit level tables in a single pass over each structure.
+
+Normally units.info, units.center_rotation and units.coordinates each load the
+structure, go over all residues and save their rows in many small
+transactions. This stage instead loads the structure once, goes over its
+residues once to compute the rows of every table that needs them, and removes
+the old rows and saves the new ones in one transaction. Rows are written in
+chunks as they are produced, so all rows of a large structure are never held
+in memory. In each chunk the unit_info rows are written first so the other
+rows can refer to them.
+
+Each table is still checked with the `should_process` of its own stage, so
+only tables that are missing, or that are to be recomputed, are computed here
+and each stage is marked as if it had run. The stages can still be run, or
+recomputed, alone. Tables which are filling in missing units are always left
+to their own stage. Running this stage before units.loader leaves nothing for
+the individual stages to do.
+"""
+
+import collections as coll
+
+import pymotifs.core as core
+
+from pymotifs.download import Downloader
+from pymotifs.pdbs.info import Loader as PdbLoader
+from pymotifs.units.info import Loader as InfoLoader
+from pymotifs.units.center_rotation import Loader as CenterRotationLoader
+from pymotifs.units.coordinates import Loader as CoordinateLoader
+
+
+class Loader(core.Loader):
+    """
+    A loader that computes the rows of several unit stages together.
+    """
+
+    dependencies = set([Downloader, PdbLoader])
+
+    """
+    The stages to compute together. The first one must be units.info as all
+    others refer to it.
+    """
+    members = [InfoLoader, CenterRotationLoader, CoordinateLoader]
+
+    allow_no_data = True
+
+    """
+    The member stages are marked as processed instead of this one.
+    """
+    mark = False
+
+    """
+    A dict from PDB id to the member stages `should_process` found must
+    compute data for it, used by `process`.
+    """
+    pending_stages = None
+
+    def __init__(self, *args, **kwargs):
+        super(Loader, self).__init__(*args, **kwargs)
+        self.stages = [self._create(klass) for klass in self.members]
+        self.pending_stages = {}
+
+    def pending(self, pdb, **kwargs):
+        """
+        Determine which of the member stages must compute data for the given
+        PDB. If unit_info must be computed then all other tables must be
+        computed as well, since they refer to it.
+
+        Parameters
+        ----------
+        pdb : str
+            The PDB id to use.
+
+        Returns
+        -------
+        stages : list
+            The member stages to compute, in the order of `members`.
+        """
+
+        forced = self.must_recompute(pdb, **kwargs)
+        stages = []
+        for stage in self.stages:
+            if getattr(stage, 'fill_in_missing', False):
+                self.logger.info("Leaving %s to fill in missing units",
+                                 stage.name)
+                continue
+            if forced or stage.should_process(pdb, **kwargs):
+                stages.append(stage)
+
+        if stages and stages[0] is self.stages[0]:
+            stages = [s for s in self.stages
+                      if not getattr(s, 'fill_in_missing', False)]
+        return stages
+
+    def should_process(self, pdb, **kwargs):
+        """
+        Determine if any member stage must compute data for the given PDB.
+        The stages found are kept for `process`, so they are only determined
+        once.
+        """
+
+        stages = self.pending(pdb, **kwargs)
+        if stages:
+            self.pending_stages[pdb] = stages
+        return bool(stages)
+
+    def has_data(self, pdb, **kwargs):
+        """
+        Check if all member stages have data for the given PDB.
+        """
+        return all(stage.has_data(pdb, **kwargs) for stage in self.stages)
+
+    def remove_rows(self, session, pdb, stages):
+        """
+        Delete the rows of the given member stages for the given PDB in the
+        given session. Tables which refer to unit_info are removed first.
+
+        Parameters
+        ----------
+        session : Session
+            The session to delete the rows in.
+        pdb : str
+            The PDB id to use.
+        stages : list
+            The member stages to remove data for.
+        """
+
+        for stage in reversed(stages):
+            self.logger.info("Removing %s data for %s", stage.name, pdb)
+            for row in stage.query(session, pdb):
+                session.delete(row)
+            session.flush()
+
+    def remove(self, pdb, stages=None, **kwargs):
+        """
+        Remove the data of the given member stages for the given PDB, in one
+        transaction.
+
+        Parameters
+        ----------
+        pdb : str
+            The PDB id to use.
+        stages : list, optional
+            The member stages to remove data for, defaults to the ones which
+            must compute data for this PDB.
+        """
+
+        if kwargs.get('dry_run'):
+            self.logger.debug("Skipping removal in dry run")
+            return
+
+        if stages is None:
+            stages = self.pending(pdb, **kwargs)
+        with self.session() as session:
+            self.remove_rows(session, pdb, stages)
+
+    def data(self, pdb, stages=None, **kwargs):
+        """
+        Load the structure once and compute the rows of each of the given
+        member stages from it, going over the residues once.
+
+        Parameters
+        ----------
+        pdb : str
+            The PDB id to use.
+        stages : list, optional
+            The member stages to compute rows for, defaults to all.
+
+        Yields
+        ------
+        stage, row : tuple
+            Each row and the member stage it belongs to, residue by residue
+            and in the order of stages for each residue, computed as they are
+            read.
+        """
+
+        if stages is None:
+            stages = self.stages
+
+        structure = self.structure(pdb)
+        for residue in structure.residues():
+            for stage in stages:
+                for row in stage.residue_data(pdb, residue):
+                    yield stage, row
+
+    def flush_rows(self, session, rows):
+        """
+        Add the buffered rows to the session and flush them, one stage after
+        the other in the order of `members`, so rows which refer to unit_info
+        are inserted after it.
+
+        Parameters
+        ----------
+        session : Session
+            The session to add the rows to.
+        rows : OrderedDict
+            A dict from member stage to its buffered rows, which is emptied.
+        """
+
+        for stage, buffered in rows.items():
+            if buffered:
+                session.add_all(buffered)
+                session.flush()
+                del buffered[:]
+
+    def store(self, pdb, data, stages=None, dry_run=False, **kwargs):
+        """
+        Remove the old rows of the given stages and save the new rows of all
+        stages in one transaction. Rows are buffered for each stage and
+        flushed every `insert_max` rows.
+
+        Parameters
+        ----------
+        pdb : str
+            The PDB id the rows are for.
+        data : iterable
+            The (stage, row) pairs, as produced by `data`.
+        stages : list, optional
+            The member stages to remove the old rows of, defaults to none.
+        dry_run : bool, optional
+            If True nothing is removed or written.
+        """
+
+        counts = coll.OrderedDict()
+        if dry_run:
+            for stage, _ in data:
+                counts[stage.name] = counts.get(stage.name, 0) + 1
+            self.logger.debug("Skipping storing %d tables in dry run",
+                              len(counts))
+            return
+
+        with self.session() as session:
+            self.remove_rows(session, pdb, stages or [])
+
+            rows = coll.OrderedDict((stage, []) for stage in self.stages)
+            buffered = 0
+            for stage, row in data:
+                rows[stage].append(row)
+                buffered += 1
+                counts[stage.name] = counts.get(stage.name, 0) + 1
+                if buffered >= self.insert_max:
+                    self.flush_rows(session, rows)
+                    buffered = 0
+            self.flush_rows(session, rows)
+
+        for name, count in counts.items():
+            self.logger.info("Stored %d rows for %s of %s", count, name, pdb)
+
+    def process(self, pdb, **kwargs):
+        """
+        Compute and store the data of all member stages which need it, then
+        mark those stages as processed. This uses the stages found by
+        `should_process` if it was called for this PDB.
+
+        Parameters
+        ----------
+        pdb : str
+            The PDB id to process.
+        """
+
+        stages = self.pending_stages.pop(pdb, None)
+        if stages is None:
+            stages = self.pending(pdb, **kwargs)
+        if not stages:
+            raise core.Skip("No unit tables to compute for %s" % pdb)
+
+        self.logger.info("Computing %s for %s together",
+                         ', '.join(s.name for s in stages), pdb)
+
+        data = self.data(pdb, stages=stages)
+        self.store(pdb, data, stages=stages, **kwargs)
+
+        for stage in stages:
+            if stage.mark:
+                stage.mark_processed(pdb, **kwargs)
@@ -49,6 +49,14 @@ class Loader(core.SimpleLoader):
         else:
             return session.query(mod.UnitInfo).filter_by(pdb_id=pdb)
 
+    def entries_with_data(self, pdbs, **kwargs):
+        """Find which of the given PDBs have units, in a few queries. When
+        filling in missing units every PDB is treated as having none.
+        """
+        if self.fill_in_missing:
+            return set()
+        return self.entries_with_rows(mod.UnitInfo.pdb_id, pdbs)
+
 
     def type(self, unit):
         """
@@ -103,6 +111,27 @@ class Loader(core.SimpleLoader):
                             unit_type_id=self.type(nt))
 
 
+    def residue_data(self, pdb, residue):
+        """
+        Compute the rows for a single residue. This is what
+        `pymotifs.units.fused` uses to compute this table together with the
+        other unit tables.
+
+        Parameters
+        ----------
+        pdb : str
+            The PDB id the residue is from.
+        residue : Component
+            The residue to use.
+
+        Returns
+        -------
+        data : list
+            A list with the `UnitInfo` for the residue.
+        """
+        return [self.as_unit(residue)]
+
+
     def convert_symmetry(self,u,old_prefix,new_prefix):
         # convert ASM_ to P_ for saving in the database
         if old_prefix:
@@ -125,10 +154,11 @@ class Loader(core.SimpleLoader):
         pdb : str
             The PDB id to compute the units for.
 
-        Returns
-        -------
-        data : iterator
-            An iterable over all units in the structure.
+        Yields
+        ------
+        unit : UnitInfo
+            Each new unit in the structure, produced as they are saved so
+            large structures are never held in memory as rows.
         """
 
         old_prefix = ""
@@ -153,7 +183,7 @@ class Loader(core.SimpleLoader):
 
         structure = self.structure(pdb)
 
-        entries = []
+        count = 0
         for unit in structure.residues():
             u = unit.unit_id()
             s = unit.symmetry
@@ -163,8 +193,7 @@ class Loader(core.SimpleLoader):
             if not u in existing:
                 if self.fill_in_missing:
                     self.logger.info("Filling in missing unit %s with symmetry %s" % (u,s))
-                entries.append(self.as_unit(unit,u,s))
-
-        self.logger.info("Found %4d new units for %s" % (len(entries), pdb))
+                count += 1
+                yield self.as_unit(unit,u,s)
 
-        return entries
+        self.logger.info("Found %4d new units for %s" % (count, pdb))
@@ -20,6 +20,12 @@ else:
     py_ver3 = True
     from io import BytesIO as StringIO
 
+# resource is only available on unix
+try:
+    import resource
+except ImportError:
+    resource = None
+
 
 """Generic logger for all utilities."""
 logger = logging.getLogger(__name__)
@@ -93,6 +99,27 @@ def grouper(n, iterable):
         yield chunk
 
 
+def peak_memory():
+    """
+    Get the peak resident memory of this process so far. This is not
+    available on all platforms.
+
+    Returns
+    -------
+    peak : float
+        The peak memory in megabytes, or None if it cannot be measured.
+    """
+
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, mac os reports bytes
+    if sys.platform == 'darwin':
+        return peak / (1024.0 * 1024.0)
+    return peak / 1024.0
+
+
 def list_or_tuple(obj):
     """Detect if something is a list or a tuple. This is useful when flattening
     lists with flatten.
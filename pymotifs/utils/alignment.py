@@ -1,6 +1,23 @@
+"""
+Align experimental sequences and map the aligned positions to their ids.
+
+Pairs of sequences are aligned in process with a global dynamic programming
+aligner, Biopython's `PairwiseAligner`. Gaps at the ends of either sequence
+are free, so a fragment is placed inside the full sequence it comes from, as
+clustalw would. Identical sequences are not aligned at all. The alignment of
+two sequences only depends on the sequences, so alignments can be kept in an
+`AlignmentCache`, keyed by the md5 of both sequences, and reused by later runs.
+
+Aligning more than two sequences still uses clustalw. Its wrapper is only
+imported when needed, as recent versions of Biopython no longer include it.
+"""
+
 import os
+import hashlib
 import logging
+import re
 import shutil
+import sqlite3
 import tempfile
 
 from pymotifs import core
@@ -8,14 +25,321 @@ from pymotifs import core
 from Bio import SeqIO
 from Bio.Seq import Seq
 from Bio import AlignIO
+from Bio.Align import PairwiseAligner
 from Bio.SeqRecord import SeqRecord
-from Bio.Align.Applications import ClustalwCommandline as Clustal
 
 
+"""The scores used when aligning two sequences. Opening a gap costs much
+more than a mismatch, as with clustalw, so homologous sequences of the same
+length are aligned without gaps."""
+MATCH_SCORE = 5.0
+MISMATCH_SCORE = -4.0
+OPEN_GAP_SCORE = -30.0
+EXTEND_GAP_SCORE = -2.0
+END_GAP_SCORE = 0.0
+
+"""The settings of the aligner, stored with each cached alignment. Alignments
+cached with other settings, such as other scores, are not used."""
+ALIGNER_SETTINGS = 'global %s %s %s %s %s' % (MATCH_SCORE, MISMATCH_SCORE,
+                                              OPEN_GAP_SCORE, EXTEND_GAP_SCORE,
+                                              END_GAP_SCORE)
+
+"""The clustalw executable used to align more than two sequences."""
+CLUSTALW = '/usr/local/bin/clustalw2'
+
+"""The kinds of columns in an alignment of two sequences, as stored in the
+cache. A column has a position of both sequences, only the first or only the
+second."""
+BOTH = 'M'
+FIRST = 'I'
+SECOND = 'D'
+
 logger = logging.getLogger(__name__)
 
 
-def align(data):
+def sequence_md5(sequence):
+    """
+    Compute the md5 of a sequence, in the same way as exp_seq.info does.
+    """
+    return hashlib.md5(sequence.encode('utf-8')).hexdigest()
+
+
+def pairwise_aligner():
+    """
+    Create the aligner used for aligning two sequences.
+
+    Returns
+    -------
+    aligner : Bio.Align.PairwiseAligner
+        A global aligner, with free end gaps.
+    """
+
+    aligner = PairwiseAligner()
+    aligner.mode = 'global'
+    aligner.match_score = MATCH_SCORE
+    aligner.mismatch_score = MISMATCH_SCORE
+    aligner.open_gap_score = OPEN_GAP_SCORE
+    aligner.extend_gap_score = EXTEND_GAP_SCORE
+    aligner.end_gap_score = END_GAP_SCORE
+    return aligner
+
+
+def encode_columns(columns):
+    """
+    Write the kinds of columns of an alignment as a compact string, like
+    '3M2I10M', with the number of columns in a row of the same kind followed
+    by the kind.
+    """
+
+    parts = []
+    for kind in columns:
+        if parts and parts[-1][1] == kind:
+            parts[-1][0] += 1
+        else:
+            parts.append([1, kind])
+    return ''.join('%d%s' % (count, kind) for count, kind in parts)
+
+
+def decode_columns(encoded):
+    """
+    Read the kinds of columns of an alignment from a string written by
+    `encode_columns`.
+    """
+
+    columns = []
+    for count, kind in re.findall(r'(\d+)([%s%s%s])' % (BOTH, FIRST, SECOND),
+                                  encoded):
+        columns.extend([kind] * int(count))
+    return columns
+
+
+def pairwise_columns(first, second, aligner=None):
+    """
+    Align two sequences and find the kind of each column of the alignment.
+
+    Parameters
+    ----------
+    first : str
+        The first sequence.
+    second : str
+        The second sequence.
+    aligner : Bio.Align.PairwiseAligner, optional
+        The aligner to use, defaults to the one from `pairwise_aligner`.
+
+    Returns
+    -------
+    columns : list
+        A list with one of BOTH, FIRST or SECOND for each column.
+    """
+
+    if first == second:
+        return [BOTH] * len(first)
+
+    if not first or not second:
+        return [FIRST] * len(first) + [SECOND] * len(second)
+
+    if aligner is None:
+        aligner = pairwise_aligner()
+
+    alignment = aligner.align(first, second)[0]
+    columns = []
+    index1 = 0
+    index2 = 0
+    blocks1, blocks2 = alignment.aligned
+    for (start1, end1), (start2, end2) in zip(blocks1, blocks2):
+        columns.extend([FIRST] * (start1 - index1))
+        columns.extend([SECOND] * (start2 - index2))
+        columns.extend([BOTH] * (end1 - start1))
+        index1 = end1
+        index2 = end2
+    columns.extend([FIRST] * (len(first) - index1))
+    columns.extend([SECOND] * (len(second) - index2))
+    return columns
+
+
+class AlignmentCache(object):
+    """
+    A persistent store of pairwise alignments, kept in an sqlite file. Each
+    alignment is stored under the settings of the aligner it was made with
+    and the md5 of the first and second sequence, in that order. Only
+    alignments made with the settings of the cache are looked up. The file
+    is opened on first use, once in each process, so a cache can be created
+    before worker processes are forked.
+
+    Attributes
+    ----------
+    filename : str
+        The sqlite file to use.
+    settings : str
+        The settings of the aligner the cached alignments are made with.
+    hits : int
+        Number of alignments found in the cache.
+    misses : int
+        Number of alignments that were not in the cache.
+    """
+
+    def __init__(self, filename, settings=ALIGNER_SETTINGS):
+        self.filename = filename
+        self.settings = settings
+        self.hits = 0
+        self.misses = 0
+        self._pid = None
+        self._connection = None
+
+    def connection(self):
+        """
+        Get the connection to the cache file, opening it and creating the
+        table if needed.
+        """
+
+        if self._connection is not None and self._pid == os.getpid():
+            return self._connection
+
+        directory = os.path.dirname(self.filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self._connection = sqlite3.connect(self.filename, timeout=60)
+        self._pid = os.getpid()
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS pairwise_alignments ('
+                'settings TEXT NOT NULL, '
+                'md5_1 TEXT NOT NULL, '
+                'md5_2 TEXT NOT NULL, '
+                'columns TEXT NOT NULL, '
+                'PRIMARY KEY (settings, md5_1, md5_2))')
+        return self._connection
+
+    def get(self, md5_1, md5_2):
+        """
+        Look up the columns of the alignment of two sequences.
+
+        Parameters
+        ----------
+        md5_1 : str
+            The md5 of the first sequence.
+        md5_2 : str
+            The md5 of the second sequence.
+
+        Returns
+        -------
+        columns : list
+            The kind of each column, as from `pairwise_columns`, or None if
+            the alignment is not cached.
+        """
+
+        row = self.connection().execute(
+            'SELECT columns FROM pairwise_alignments '
+            'WHERE settings = ? AND md5_1 = ? AND md5_2 = ?',
+            (self.settings, md5_1, md5_2)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return decode_columns(row[0])
+
+    def set(self, md5_1, md5_2, columns):
+        """
+        Store the columns of the alignment of two sequences.
+        """
+
+        connection = self.connection()
+        with connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO pairwise_alignments '
+                'VALUES (?, ?, ?, ?)',
+                (self.settings, md5_1, md5_2, encode_columns(columns)))
+
+    def close(self):
+        if self._connection is not None and self._pid == os.getpid():
+            self._connection.close()
+        self._connection = None
+
+
+def align_pair(first, second, cache=None, aligner=None):
+    """
+    Align two sequences and map each column of the alignment to the ids of
+    the aligned positions.
+
+    Parameters
+    ----------
+    first : dict
+        The first sequence, with a 'sequence' string and the 'ids' of each
+        position in it.
+    second : dict
+        The second sequence, in the same form.
+    cache : AlignmentCache, optional
+        Where to look up and store the alignment.
+    aligner : Bio.Align.PairwiseAligner, optional
+        The aligner to use.
+
+    Returns
+    -------
+    mapping : list
+        A list with a [id1, id2] pair for each column, where the id is None
+        if the sequence has a gap in that column.
+    """
+
+    seq1 = first['sequence']
+    seq2 = second['sequence']
+    if seq1 == seq2:
+        return [[id1, id2] for id1, id2 in zip(first['ids'], second['ids'])]
+
+    columns = None
+    if cache is not None:
+        md5_1 = sequence_md5(seq1)
+        md5_2 = sequence_md5(seq2)
+        columns = cache.get(md5_1, md5_2)
+
+    if columns is None:
+        columns = pairwise_columns(seq1, seq2, aligner=aligner)
+        if cache is not None:
+            cache.set(md5_1, md5_2, columns)
+
+    ids1 = iter(first['ids'])
+    ids2 = iter(second['ids'])
+    mapping = []
+    for kind in columns:
+        id1 = None
+        id2 = None
+        if kind != SECOND:
+            id1 = next(ids1)
+        if kind != FIRST:
+            id2 = next(ids2)
+        mapping.append([id1, id2])
+    return mapping
+
+
+def align(data, cache=None):
+    """
+    Align the given sequences and map each column of the alignment to the
+    ids of the aligned positions. Two sequences are aligned with
+    `align_pair`, more than two with clustalw.
+
+    Parameters
+    ----------
+    data : list
+        A list of dicts, each with a 'sequence' string and the 'ids' of each
+        position in it.
+    cache : AlignmentCache, optional
+        Where to look up and store alignments of two sequences.
+
+    Returns
+    -------
+    mapping : list
+        A list with the id of each sequence for each column, where the id is
+        None if that sequence has a gap in the column.
+    """
+
+    if len(data) == 2:
+        return align_pair(data[0], data[1], cache=cache)
+    return clustal_align(data)
+
+
+def clustal_align(data):
+    from Bio.Align.Applications import ClustalwCommandline as Clustal
+
     tmpdir = tempfile.mkdtemp()
     infile = os.path.join(tmpdir, "input.fasta")
     outfile = os.path.join(tmpdir, "output.aln")
@@ -27,7 +351,7 @@ def align(data):
 
     SeqIO.write(sequences, infile, "fasta")
 
-    clustal_executable = os.path.join('/usr/local/bin/clustalw2')
+    clustal_executable = CLUSTALW
 
     aligner = Clustal(clustal_executable, INFILE=infile, OUTFILE=outfile)
     aligner()
@@ -53,6 +377,8 @@ def align(data):
     return mapping
 
 def align_dna(data):
+    from Bio.Align.Applications import ClustalwCommandline as Clustal
+
     tmpdir_dna = tempfile.mkdtemp()
     infile_dna = os.path.join(tmpdir_dna, "input_dna.fasta")
     outfile_dna = os.path.join(tmpdir_dna, "output_dna.aln")
@@ -64,7 +390,7 @@ def align_dna(data):
 
     SeqIO.write(dna_sequences, infile_dna, "fasta")
 
-    clustal_executable = os.path.join('/usr/local/bin/clustalw2')
+    clustal_executable = CLUSTALW
 
     aligner = Clustal(clustal_executable, INFILE=infile_dna, OUTFILE=outfile_dna)
     aligner()
@@ -102,6 +428,3 @@ def one_to_one_alignment(data): # one_to_one_alignemnt # name changed to same dn
     else:
         raise core.Skip('aviod making alignments for more than 20 length of DNA sequences')
     return mapping
-
-
-
@@ -2,11 +2,78 @@
 # connectedsets.py finds the connected sets
 # it returns a dictionary indexed by the first structure found in each set.  There is nothing special about the keys of this dictionary.
 # Note that connections[i] does not need to contain i; that is assumed
-# Note that connections[i] may contain j without connections[j] containing i; the program adds i to connections[j]; it assumes symmetry.
+# Note that connections[i] may contain j without connections[j] containing i; links are treated as symmetric.
+# Note that connections is not modified
+# find_connected uses a disjoint set forest, with union by size and path compression,
+# so the time is nearly linear in the number of connections
+
+
+import random
+import time
+
+
+class DisjointSet(object):
+    """A disjoint set forest over hashable vertices."""
+
+    def __init__(self):
+        self.parent = {}
+        self.size = {}
+
+    def add(self, x):
+        if x not in self.parent:
+            self.parent[x] = x
+            self.size[x] = 1
+
+    def find(self, x):
+        root = x
+        while self.parent[root] != root:
+            root = self.parent[root]
+        # compress the path so later lookups are fast
+        while self.parent[x] != root:
+            self.parent[x], x = root, self.parent[x]
+        return root
+
+    def union(self, a, b):
+        a = self.find(a)
+        b = self.find(b)
+        if a == b:
+            return a
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+        return a
 
 
 def find_connected(connections):                ## pass in valid pairs
 
+    sets = DisjointSet()
+    for i in connections.keys():
+        sets.add(i)
+        for j in connections[i]:
+            sets.add(j)
+            sets.union(i, j)
+
+    # key each set by the first key of connections in it, in the order of the keys
+    first = {}
+    linked = {}
+    for i in connections.keys():
+        root = sets.find(i)
+        if root not in first:
+            first[root] = i
+            linked[i] = set()
+
+    for j in sets.parent:
+        linked[first[sets.find(j)]].add(j)
+
+    return linked
+
+def find_connected_by_merging(connections):     ## pass in valid pairs
+    # the original implementation, kept for benchmarking; it merges sets until
+    # nothing changes, which is quadratic on large dense graphs.  Every vertex
+    # must be a key of connections.
+
+
     considered = {}
     for i in connections.keys():
         considered[i] = False
@@ -38,6 +105,29 @@ def find_connected(connections):                ## pass in valid pairs
 
     return linked
 
+def benchmark(size=50000, edges=100000, seed=1):
+    """Compare find_connected with find_connected_by_merging on a random graph."""
+
+    rng = random.Random(seed)
+    connections = dict((i, set()) for i in range(size))
+    for _ in range(edges):
+        i = rng.randrange(size)
+        j = rng.randrange(size)
+        connections[i].add(j)
+        connections[j].add(i)
+
+    start = time.time()
+    merged = find_connected_by_merging(dict((k, set(v)) for k, v in connections.items()))
+    merge_time = time.time() - start
+
+    start = time.time()
+    linked = find_connected(connections)
+    union_time = time.time() - start
+
+    same = sorted(map(sorted, merged.values())) == sorted(map(sorted, linked.values()))
+    print("%d vertices, %d edges, %d sets: merging %.2f s, union find %.2f s, same %s" %
+          (size, edges, len(linked), merge_time, union_time, same))
+
 if __name__ == "__main__":
     connections = {}
     connections['A'] = ['B', 'C']
@@ -54,4 +144,4 @@ if __name__ == "__main__":
     for key in connections.keys():
         connections[key] = set(connections[key])
 
-    find_connected(connections)
+    print(find_connected(connections))
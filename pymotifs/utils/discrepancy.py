@@ -1,6 +1,8 @@
 """This contains some utility functions for dealing with discrepancies.
 """
 
+import numpy as np
+
 from pymotifs.constants import MAX_RESOLUTION_DISCREPANCY
 from pymotifs.constants import MIN_NT_DISCREPANCY
 
@@ -61,3 +63,101 @@ def valid_chain(chain):
         return chain['resolution'] is not None and \
             chain['resolution'] <= MAX_RESOLUTION_DISCREPANCY
     return True
+
+
+def segment_sum(values, offsets):
+    """Sum the rows of values within each segment. Segments are consecutive
+    blocks of rows which start at the given offsets. All segments must be non
+    empty.
+
+    Parameters
+    ----------
+    values : numpy.array
+        The values to sum, summed along the first axis.
+    offsets : numpy.array
+        The index of the first row of each segment.
+
+    Returns
+    -------
+    sums : numpy.array
+        An array with one entry per segment.
+    """
+    return np.add.reduceat(values, offsets, axis=0)
+
+
+def batch_matrix_discrepancy(centers1, rotations1, centers2, rotations2,
+                             lengths):
+    """Compute the discrepancy of many pairs of matched nucleotides at once.
+    This is a vectorized version of `fr3d.geometry.discrepancy.matrix_discrepancy`
+    for pairs with at least 3 matched nucleotides. The centers and rotations
+    of all pairs are stacked into single arrays, with the rows of each pair
+    next to each other and `lengths` giving the number of rows for each pair.
+    The best superposition of each pair is computed with one batched SVD and
+    the orientation error with one pass over all rotation matrices.
+
+    Parameters
+    ----------
+    centers1 : numpy.array
+        A N x 3 array of the centers of the first member of each pair.
+    rotations1 : numpy.array
+        A N x 3 x 3 array of the rotation matrices of the first member.
+    centers2 : numpy.array
+        A N x 3 array of the centers of the second member of each pair.
+    rotations2 : numpy.array
+        A N x 3 x 3 array of the rotation matrices of the second member.
+    lengths : list
+        The number of matched nucleotides in each pair, all must be at least 3
+        and they must sum to N.
+
+    Returns
+    -------
+    discrepancies : numpy.array
+        An array of the discrepancy of each pair, in the order given.
+    """
+
+    c1 = np.asarray(centers1, dtype=float)
+    c2 = np.asarray(centers2, dtype=float)
+    r1 = np.asarray(rotations1, dtype=float)
+    r2 = np.asarray(rotations2, dtype=float)
+    lengths = np.asarray(lengths, dtype=int)
+
+    if not len(lengths):
+        return np.zeros(0)
+
+    if lengths.min() < 3:
+        raise ValueError("All pairs must have at least 3 nucleotides")
+
+    if lengths.sum() != len(c1) or len(c1) != len(c2) or \
+            len(r1) != len(c1) or len(r2) != len(c1):
+        raise ValueError("Lengths do not match the given arrays")
+
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    counts = lengths.astype(float)[:, np.newaxis]
+
+    # Remove the mean of each pair and compute the covariance matrix
+    dev1 = c1 - np.repeat(segment_sum(c1, offsets) / counts, lengths, axis=0)
+    dev2 = c2 - np.repeat(segment_sum(c2, offsets) / counts, lengths, axis=0)
+    covariance = segment_sum(np.einsum('ni,nj->nij', dev2, dev1), offsets)
+
+    # Best rotation of each pair, correcting for reflections
+    V, _, Wt = np.linalg.svd(covariance)
+    W = np.transpose(Wt, (0, 2, 1))
+    Vt = np.transpose(V, (0, 2, 1))
+    correction = np.tile(np.identity(3), (len(lengths), 1, 1))
+    det = np.linalg.det(np.matmul(W, Vt))
+    reflected = np.isclose(det, -1.0)
+    correction[reflected, 2, 2] = det[reflected]
+    best = np.matmul(np.matmul(W, correction), Vt)
+    per_row = np.repeat(best, lengths, axis=0)
+
+    # Sum of squared distances after superposition
+    new1 = np.einsum('ni,nij->nj', dev1, per_row)
+    sse = segment_sum(np.sum(np.square(new1 - dev2), axis=1), offsets)
+
+    # Angle between each pair of superimposed rotation matrices
+    relative = np.matmul(np.matmul(per_row, r2), np.transpose(r1, (0, 2, 1)))
+    cosine = (np.trace(relative, axis1=1, axis2=2) - 1) / 2
+    angles = np.arccos(np.clip(cosine, -1.0, 1.0))
+    orientation = segment_sum(np.square(angles), offsets)
+
+    return np.sqrt(sse + orientation) / lengths
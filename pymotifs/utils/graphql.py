@@ -0,0 +1,265 @@
+"""
+Fetch entries from the RCSB PDB GraphQL service in batches.
+
+Asking for one entry per request makes a run over the whole PDB take hours,
+most of it waiting on round trips. This asks for many entries in each request,
+with the `entries(entry_ids: [...])` query, and sends several requests at once
+over a pool of connections. The number of requests per second is limited and
+failed requests are retried with a growing delay.
+
+The url of the service is configurable, with the 'pdb_graphql' section of the
+configuration, so a local server can stand in for RCSB in tests.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+"""The default GraphQL service."""
+DEFAULT_URL = 'https://data.rcsb.org/graphql'
+
+"""Status codes that mean a request may work if tried again."""
+RETRY_STATUS = set([429, 500, 502, 503, 504])
+
+logger = logging.getLogger(__name__)
+
+
+class FetchFailed(Exception):
+    """
+    Raised when a batch of entries could not be fetched, even after retrying.
+    """
+    pass
+
+
+class RateLimiter(object):
+    """
+    Space out events so there are at most a given number per second, across
+    all threads.
+
+    Attributes
+    ----------
+    interval : float
+        The minimum number of seconds between two events.
+    """
+
+    def __init__(self, per_second, clock=time.time, sleep=time.sleep):
+        self.interval = 0.0
+        if per_second:
+            self.interval = 1.0 / per_second
+        self._clock = clock
+        self._sleep = sleep
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """
+        Wait until the next event is allowed.
+        """
+
+        if not self.interval:
+            return
+
+        with self._lock:
+            now = self._clock()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            self._sleep(start - now)
+
+
+class EntryFetcher(object):
+    """
+    Fetch the given fields of many PDB entries.
+
+    Attributes
+    ----------
+    fields : str
+        The GraphQL selection to get for each entry, like 'struct { title }'.
+    url : str
+        The url of the GraphQL service.
+    batch_size : int
+        The maximum number of entries to ask for in one request.
+    workers : int
+        The maximum number of requests to run at once.
+    retries : int
+        The number of times to retry a failed request.
+    timeout : float
+        Seconds to wait for a response.
+    backoff : float
+        Seconds to wait before the first retry, doubled for each further one.
+    """
+
+    def __init__(self, fields, url=DEFAULT_URL, batch_size=100, workers=4,
+                 requests_per_second=5.0, retries=3, timeout=120,
+                 backoff=2.0):
+        self.fields = fields
+        self.url = url
+        self.batch_size = batch_size
+        self.workers = workers
+        self.retries = retries
+        self.timeout = timeout
+        self.backoff = backoff
+        self.limiter = RateLimiter(requests_per_second)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @classmethod
+    def from_config(cls, config, fields):
+        """
+        Create a fetcher using the 'pdb_graphql' section of the configuration.
+
+        Parameters
+        ----------
+        config : dict
+            The pipeline configuration.
+        fields : str
+            The GraphQL selection to get for each entry.
+
+        Returns
+        -------
+        fetcher : EntryFetcher
+            The fetcher.
+        """
+
+        settings = config.get('pdb_graphql', {})
+        return cls(fields,
+                   url=settings.get('url', DEFAULT_URL),
+                   batch_size=settings.get('batch_size', 100),
+                   workers=settings.get('workers', 4),
+                   requests_per_second=settings.get('requests_per_second', 5.0),
+                   retries=settings.get('retries', 3))
+
+    def query(self, pdbs):
+        """
+        Build the query for the given PDB ids.
+        """
+
+        ids = ', '.join('"%s"' % pdb for pdb in pdbs)
+        return '{ entries(entry_ids: [%s]) { rcsb_id %s } }' % \
+            (ids, self.fields)
+
+    def post(self, pdbs):
+        """
+        Send one request for the given PDB ids, retrying as needed.
+
+        Parameters
+        ----------
+        pdbs : list
+            The PDB ids to ask for.
+
+        Raises
+        ------
+        FetchFailed
+            If no usable response was received.
+
+        Returns
+        -------
+        entries : list
+            The entries in the response.
+        """
+
+        query = self.query(pdbs)
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(delay)
+                delay *= 2
+
+            self.limiter.wait()
+            try:
+                response = self.session.post(self.url, json={'query': query},
+                                             timeout=self.timeout)
+            except requests.RequestException as err:
+                logger.warning("Request for %d entries failed: %s",
+                               len(pdbs), err)
+                continue
+
+            if response.status_code in RETRY_STATUS:
+                logger.warning("Request for %d entries gave status %s",
+                               len(pdbs), response.status_code)
+                continue
+
+            if response.status_code != 200:
+                raise FetchFailed("Request for %s gave status %s" %
+                                  (', '.join(pdbs), response.status_code))
+
+            result = response.json()
+            data = result.get('data') or {}
+            if data.get('entries') is None:
+                raise FetchFailed("No entries for %s: %s" %
+                                  (', '.join(pdbs), result.get('errors')))
+            return data['entries']
+
+        raise FetchFailed("Could not fetch %s after %d attempts" %
+                          (', '.join(pdbs), self.retries + 1))
+
+    def post_batch(self, pdbs, strict=True):
+        """
+        Send one request for the given PDB ids, like `post`. If not strict,
+        a batch that cannot be fetched is logged and gives no entries.
+        """
+
+        try:
+            return self.post(pdbs)
+        except FetchFailed as err:
+            if strict:
+                raise
+            logger.error("Leaving out %d entries: %s", len(pdbs), err)
+            return []
+
+    def __call__(self, pdbs, strict=True):
+        """
+        Fetch the entries for all given PDB ids.
+
+        Parameters
+        ----------
+        pdbs : list
+            The PDB ids to fetch.
+        strict : bool, optional
+            If False, the entries of batches that could not be fetched are
+            left out instead of raising, so the other batches are kept.
+
+        Raises
+        ------
+        FetchFailed
+            If strict and any batch could not be fetched.
+
+        Returns
+        -------
+        entries : dict
+            A dict from upper case PDB id to entry. PDB ids that are not known
+            to the service, or not fetched, are left out.
+        """
+
+        pdbs = sorted(set(pdb.upper() for pdb in pdbs))
+        batches = [pdbs[i:i + self.batch_size]
+                   for i in range(0, len(pdbs), self.batch_size)]
+
+        def post(batch):
+            return self.post_batch(batch, strict=strict)
+
+        start = time.time()
+        if len(batches) > 1 and self.workers > 1:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                results = list(executor.map(post, batches))
+        else:
+            results = [post(batch) for batch in batches]
+
+        entries = {}
+        for batch in results:
+            for entry in batch:
+                if entry:
+                    entries[entry['rcsb_id'].upper()] = entry
+
+        logger.info("Fetched %d of %d entries in %d requests, %.1f seconds",
+                    len(entries), len(pdbs), len(batches),
+                    time.time() - start)
+        return entries
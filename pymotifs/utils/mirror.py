@@ -0,0 +1,408 @@
+"""
+Keep local copies of files from a web server up to date.
+
+Files are fetched over a pool of connections, several at once. Each file is
+written to a temporary file next to its final location and only renamed into
+place once it is complete, so an interrupted download never leaves a truncated
+file behind. When a download is cut short the partial file is kept and the
+next attempt asks only for the rest of it, if the server still has the same
+version.
+
+What was fetched is recorded in a manifest, a JSON file in the directory of the
+files. It keeps the ETag and Last-Modified headers of each file and when it was
+last checked. Files that may be out of date are fetched with a conditional
+request, so the server only sends them again if they have changed.
+"""
+
+import datetime as dt
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from pymotifs.utils.graphql import RETRY_STATUS
+
+
+"""Name of the manifest file in the directory of the files."""
+MANIFEST_NAME = 'manifest.json'
+
+"""Suffix of files that are still being downloaded."""
+PARTIAL_SUFFIX = '.part'
+
+"""Number of bytes to write at a time. A download that is cut short loses
+the chunk it was reading, so this is kept small."""
+CHUNK_SIZE = 64 * 1024
+
+"""The outcomes of fetching one file."""
+DOWNLOADED = 'downloaded'
+NOT_MODIFIED = 'not modified'
+MISSING = 'missing'
+
+logger = logging.getLogger(__name__)
+
+
+class FetchFailed(Exception):
+    """
+    Raised when a file could not be fetched, even after retrying.
+    """
+    pass
+
+
+def now():
+    """
+    The current time, as stored in the manifest.
+    """
+    return dt.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S')
+
+
+class Manifest(object):
+    """
+    A record of the files that were fetched, kept in a JSON file. Each entry
+    is a dict which may have the keys 'etag', 'last_modified', 'size',
+    'checked' and 'partial', the ETag or Last-Modified value of a partial
+    download. It is safe to use from several threads.
+
+    Attributes
+    ----------
+    filename : str
+        The file the manifest is kept in.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._entries = {}
+        if os.path.exists(filename):
+            try:
+                with open(filename, 'r') as raw:
+                    self._entries = json.load(raw)
+            except ValueError as err:
+                logger.warning("Ignoring unreadable manifest %s: %s",
+                               filename, err)
+
+    def __contains__(self, name):
+        with self._lock:
+            return name in self._entries
+
+    def get(self, name):
+        """
+        Get a copy of the entry for a file, or an empty dict if there is none.
+        """
+        with self._lock:
+            return dict(self._entries.get(name, {}))
+
+    def update(self, name, **values):
+        """
+        Set the given values of the entry for a file. Values which are None
+        are removed from the entry.
+        """
+
+        with self._lock:
+            entry = self._entries.setdefault(name, {})
+            for key, value in values.items():
+                if value is None:
+                    entry.pop(key, None)
+                else:
+                    entry[key] = value
+
+    def discard(self, name):
+        """
+        Forget about a file.
+        """
+        with self._lock:
+            self._entries.pop(name, None)
+
+    def save(self):
+        """
+        Write the manifest, replacing the file in one step.
+        """
+
+        with self._lock:
+            text = json.dumps(self._entries, indent=1, sort_keys=True)
+
+        directory = os.path.dirname(self.filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        temp = '%s.%d.%d.tmp' % (self.filename, os.getpid(),
+                                 threading.current_thread().ident)
+        with open(temp, 'w') as raw:
+            raw.write(text)
+        os.rename(temp, self.filename)
+
+
+class FileMirror(object):
+    """
+    Fetch files from a server into a directory.
+
+    Attributes
+    ----------
+    url : str
+        A template for the url of a file, with '{name}' where the name goes.
+    directory : str
+        The directory to place files in.
+    suffix : str
+        Added to the name of each file to give its filename.
+    manifest : Manifest
+        The record of fetched files.
+    workers : int
+        The maximum number of files to fetch at once.
+    retries : int
+        The number of times to retry a failed download.
+    timeout : float
+        Seconds to wait for the server to respond or send more data.
+    backoff : float
+        Seconds to wait before the first retry, doubled for each further one.
+    chunk_size : int
+        Number of bytes to read and write at a time.
+    """
+
+    def __init__(self, url, directory, suffix='', workers=4, retries=3,
+                 timeout=60, backoff=2.0, chunk_size=CHUNK_SIZE):
+        self.url = url
+        self.directory = directory
+        self.suffix = suffix
+        self.workers = workers
+        self.retries = retries
+        self.timeout = timeout
+        self.backoff = backoff
+        self.chunk_size = chunk_size
+        self.manifest = Manifest(os.path.join(directory, MANIFEST_NAME))
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def filename(self, name):
+        """
+        Get the filename to store a file under.
+        """
+        return os.path.join(self.directory, name + self.suffix)
+
+    def checked(self, name):
+        """
+        Get the date, as 'YYYY-MM-DD', the given file was last fetched or
+        found to be unchanged. Files that are not in the manifest use the
+        date they were modified. If there is no file, this gives None.
+        """
+
+        filename = self.filename(name)
+        if not os.path.exists(filename):
+            return None
+
+        entry = self.manifest.get(name)
+        if 'checked' in entry:
+            return entry['checked'][0:10]
+
+        modified = dt.datetime.utcfromtimestamp(os.path.getmtime(filename))
+        return modified.strftime('%Y-%m-%d')
+
+    def is_current(self, name, revised=None):
+        """
+        Check if the local copy of a file is current. It is current if it
+        exists and was checked after the date it was last revised on. A file
+        revised on the day it was checked may have been revised after it was
+        checked, so it is not current.
+
+        Parameters
+        ----------
+        name : str
+            The name of the file.
+        revised : str or datetime.date, optional
+            The date the file was last revised, if known.
+
+        Returns
+        -------
+        current : bool
+            True if the local copy need not be fetched again.
+        """
+
+        checked = self.checked(name)
+        if checked is None:
+            return False
+        if not revised:
+            return True
+        return str(revised)[0:10] < checked
+
+    def remove(self, name):
+        """
+        Remove the local copy of a file, any partial download of it and its
+        manifest entry.
+        """
+
+        filename = self.filename(name)
+        for path in [filename, filename + PARTIAL_SUFFIX]:
+            if os.path.exists(path):
+                os.remove(path)
+        self.manifest.discard(name)
+
+    def headers(self, name, resume_from):
+        entry = self.manifest.get(name)
+        headers = {}
+        if os.path.exists(self.filename(name)):
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        if resume_from and entry.get('partial'):
+            headers['Range'] = 'bytes=%d-' % resume_from
+            headers['If-Range'] = entry['partial']
+        return headers
+
+    def attempt(self, name):
+        """
+        Make one attempt at fetching a file.
+
+        Returns
+        -------
+        status : str
+            One of DOWNLOADED, NOT_MODIFIED or MISSING, or None if the
+            attempt should be retried.
+        """
+
+        filename = self.filename(name)
+        partial = filename + PARTIAL_SUFFIX
+        resume_from = 0
+        if os.path.exists(partial):
+            resume_from = os.path.getsize(partial)
+
+        url = self.url.format(name=name)
+        headers = self.headers(name, resume_from)
+        response = self.session.get(url, headers=headers, stream=True,
+                                    timeout=self.timeout)
+        with response:
+            if response.status_code == 304:
+                if os.path.exists(partial):
+                    os.remove(partial)
+                self.manifest.update(name, checked=now(), partial=None)
+                return NOT_MODIFIED
+
+            if response.status_code == 404:
+                return MISSING
+
+            if response.status_code == 416:
+                logger.warning("Cannot resume %s, starting over", name)
+                os.remove(partial)
+                self.manifest.update(name, partial=None)
+                return None
+
+            if response.status_code in RETRY_STATUS:
+                logger.warning("Fetching %s gave status %s", name,
+                               response.status_code)
+                return None
+
+            if response.status_code not in (200, 206):
+                raise FetchFailed("Fetching %s gave status %s" %
+                                  (url, response.status_code))
+
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+            mode = 'wb'
+            if response.status_code == 206:
+                mode = 'ab'
+                logger.debug("Resuming %s from byte %d", name, resume_from)
+            self.manifest.update(name, partial=etag or last_modified)
+
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            with open(partial, mode) as raw:
+                for chunk in response.iter_content(self.chunk_size):
+                    raw.write(chunk)
+
+        os.rename(partial, filename)
+        self.manifest.update(name, etag=etag, last_modified=last_modified,
+                             size=os.path.getsize(filename), checked=now(),
+                             partial=None)
+        return DOWNLOADED
+
+    def fetch(self, name):
+        """
+        Fetch a file, unless the server says the local copy is unchanged.
+        Failed downloads are retried, continuing from where they stopped.
+
+        Parameters
+        ----------
+        name : str
+            The name of the file.
+
+        Raises
+        ------
+        FetchFailed
+            If the file could not be fetched.
+
+        Returns
+        -------
+        status : str
+            DOWNLOADED, NOT_MODIFIED or MISSING if the server does not have
+            the file.
+        """
+
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(delay)
+                delay *= 2
+
+            try:
+                status = self.attempt(name)
+            except requests.RequestException as err:
+                logger.warning("Fetching %s failed: %s", name, err)
+                continue
+
+            if status is not None:
+                return status
+
+        raise FetchFailed("Could not fetch %s after %d attempts" %
+                          (name, self.retries + 1))
+
+    def _fetch(self, name):
+        try:
+            return self.fetch(name)
+        except FetchFailed as err:
+            logger.error(str(err))
+            return None
+
+    def __call__(self, names):
+        """
+        Fetch many files, several at once, and save the manifest.
+
+        Parameters
+        ----------
+        names : list
+            The names of the files to fetch.
+
+        Returns
+        -------
+        statuses : dict
+            A dict from name to the outcome of fetching it, which is None for
+            files that could not be fetched.
+        """
+
+        names = list(names)
+        start = time.time()
+        try:
+            if len(names) > 1 and self.workers > 1:
+                with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                    statuses = list(executor.map(self._fetch, names))
+            else:
+                statuses = [self._fetch(name) for name in names]
+        finally:
+            self.manifest.save()
+
+        result = dict(zip(names, statuses))
+        counts = {}
+        for status in statuses:
+            counts[status] = counts.get(status, 0) + 1
+        logger.info("Fetched %d files in %.1f seconds: %s", len(names),
+                    time.time() - start,
+                    ', '.join('%d %s' % (v, k or 'failed')
+                              for k, v in sorted(counts.items(),
+                                                 key=lambda kv: str(kv[0]))))
+        return result
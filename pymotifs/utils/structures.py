@@ -4,6 +4,7 @@ Some queries that are useful in accessing stuff in the database.
 
 import itertools as it
 
+from sqlalchemy import func
 from sqlalchemy.orm import aliased
 
 from pymotifs import core
@@ -361,6 +362,34 @@ class BasePairQueries(Base):
                 return query.count()
             return [result for result in query]
 
+    def chain_counts(self, pdb, near=False, family=None, model=1,
+                     sym_op='1_555', symmetry=True):
+        """Count the interactions between every pair of chains, including
+        each chain with itself, in one grouped query. With symmetry the
+        counts of a chain with itself are those of `representative`, without
+        it the counts between two chains are those of `cross_chain`.
+
+        :pdb: The pdb id.
+        :near: A boolean to control counting nears.
+        :family: The family(ies) to limit the counts to.
+        :symmetry: If we should try to deduplicate symmetric basepairs.
+        :returns: A dict from (chain, other chain) to the count of
+        interactions from the first to the second. Pairs of chains without
+        interactions are left out.
+        """
+
+        with self.session() as session:
+            u1, u2, query = self.__base__(session, pdb, None, near=near,
+                                          family=family, symmetry=symmetry,
+                                          model=model, sym_op=sym_op)
+            query = query.\
+                with_entities(u1.chain.label('chain1'),
+                              u2.chain.label('chain2'),
+                              func.count().label('count')).\
+                group_by(u1.chain, u2.chain)
+
+            return dict(((r.chain1, r.chain2), r.count) for r in query)
+
     def __base__(self, session, pdb, chain, symmetry=True, near=False,
                  family=None, model=1, sym_op='1_555'):
         """A method to build the base queries for this class.
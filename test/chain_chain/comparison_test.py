@@ -0,0 +1,143 @@
+from sqlalchemy.orm import aliased
+
+from test import StageTest
+
+from pymotifs import models as mod
+from pymotifs.utils import row2dict
+from pymotifs.chain_chain.comparison import Loader
+from pymotifs.chain_chain.comparison import pick
+
+
+class BaseTest(StageTest):
+    loader_class = Loader
+
+    def chain_id(self, pdb, chain):
+        with self.loader.session() as session:
+            return session.query(mod.ChainInfo).\
+                filter_by(pdb_id=pdb, chain_name=chain).\
+                one().\
+                chain_id
+
+    def chain_ids(self):
+        return [
+            self.chain_id('1ET4', 'A'),
+            self.chain_id('1ET4', 'B'),
+            self.chain_id('1CGM', 'I'),
+            self.chain_id('4A3J', 'P'),
+            self.chain_id('3J9M', 'u'),
+            3,
+            -1,
+        ]
+
+    def queried_chain_info(self, chain_id):
+        """The info of a single chain, loaded with one query for the IFE and
+        one for the units of the chain. Gives None if it can not be loaded.
+        """
+
+        with self.loader.session() as session:
+            query = session.query(mod.ChainInfo.chain_name,
+                                  mod.ChainInfo.chain_id,
+                                  mod.ChainInfo.chain_length,
+                                  mod.IfeInfo.pdb_id.label('pdb'),
+                                  mod.IfeInfo.model,
+                                  mod.IfeInfo.ife_id,
+                                  ).\
+                join(mod.IfeChains,
+                     mod.IfeChains.chain_id == mod.ChainInfo.chain_id).\
+                join(mod.IfeInfo,
+                     mod.IfeInfo.ife_id == mod.IfeChains.ife_id).\
+                filter(mod.IfeInfo.new_style == True).\
+                filter(mod.ChainInfo.chain_id == chain_id)
+            result = query.first()
+            if result is None:
+                return None
+            ife = row2dict(result)
+
+        with self.loader.session() as session:
+            query = session.query(mod.UnitInfo.sym_op,
+                                  mod.UnitInfo.alt_id).\
+                join(mod.ChainInfo,
+                     (mod.ChainInfo.pdb_id == mod.UnitInfo.pdb_id) &
+                     (mod.ChainInfo.chain_name == mod.UnitInfo.chain)).\
+                join(mod.UnitCenters,
+                     mod.UnitCenters.unit_id == mod.UnitInfo.unit_id).\
+                join(mod.UnitRotations,
+                     mod.UnitRotations.unit_id == mod.UnitInfo.unit_id).\
+                filter(mod.ChainInfo.chain_id == chain_id).\
+                distinct()
+            units = list(query)
+            if not units:
+                return None
+
+        ife['sym_op'] = pick(['1_555', 'P_1'], 'sym_op', units)
+        ife['alt_id'] = pick([None, 'A', 'B'], 'alt_id', units)
+        ife['name'] = ife['ife_id'] + '+' + ife['sym_op']
+        return ife
+
+    def queried_corr_id(self, chain1, chain2):
+        """The correspondence id between two chains, loaded with a query for
+        each direction.
+        """
+
+        for first, second in [(chain1, chain2), (chain2, chain1)]:
+            with self.loader.session() as session:
+                info = mod.CorrespondenceInfo
+                mapping1 = aliased(mod.ExpSeqChainMapping)
+                mapping2 = aliased(mod.ExpSeqChainMapping)
+                query = session.query(info.correspondence_id).\
+                    join(mapping1, mapping1.exp_seq_id == info.exp_seq_id_1).\
+                    join(mapping2, mapping2.exp_seq_id == info.exp_seq_id_2).\
+                    filter(mapping1.chain_id == first).\
+                    filter(mapping2.chain_id == second).\
+                    filter(info.good_alignment >= 1)
+                result = query.first()
+                if result:
+                    return result.correspondence_id
+        return None
+
+
+class ChainsInfoTest(BaseTest):
+    def expected(self, chain_ids):
+        expected = {}
+        for chain_id in chain_ids:
+            info = self.queried_chain_info(chain_id)
+            if info is not None:
+                expected[chain_id] = info
+        return expected
+
+    def test_it_loads_the_same_info_as_querying_each_chain(self):
+        chain_ids = self.chain_ids()
+        assert self.loader.chains_info(chain_ids) == self.expected(chain_ids)
+
+    def test_it_loads_the_same_info_across_chunks(self):
+        chain_ids = self.chain_ids()
+        self.loader.chunk_size = 2
+        assert self.loader.chains_info(chain_ids) == self.expected(chain_ids)
+
+    def test_it_skips_chains_that_can_not_be_loaded(self):
+        assert self.loader.chains_info([3, -1]) == {}
+
+
+class CorrespondenceIdsTest(BaseTest):
+    def assert_same_as_queries(self, chain_ids):
+        corr_ids = self.loader.correspondence_ids(chain_ids)
+        for chain1 in chain_ids:
+            for chain2 in chain_ids:
+                if chain1 == chain2:
+                    continue
+                val = self.loader.lookup_corr_id(corr_ids, chain1, chain2)
+                assert val == self.queried_corr_id(chain1, chain2)
+
+    def test_it_finds_the_same_ids_as_querying_each_pair(self):
+        self.assert_same_as_queries(self.chain_ids())
+
+    def test_it_finds_the_same_ids_across_chunks(self):
+        self.loader.chunk_size = 2
+        self.assert_same_as_queries(self.chain_ids())
+
+    def test_it_finds_a_known_correspondence_in_both_directions(self):
+        c1 = self.chain_id('4A3J', 'P')
+        c2 = self.chain_id('3J9M', 'u')
+        corr_ids = self.loader.correspondence_ids([c1, c2])
+        assert self.loader.lookup_corr_id(corr_ids, c1, c2) == 1
+        assert self.loader.lookup_corr_id(corr_ids, c2, c1) == 1
@@ -0,0 +1,52 @@
+from unittest import TestCase
+
+import numpy as np
+
+from pymotifs.chain_chain.geometry_cache import ChainGeometry
+from pymotifs.chain_chain.geometry_cache import ChainGeometryCache
+
+
+def geometry(chain, size):
+    index = dict(('%s|G|%d' % (chain, i), i) for i in range(size))
+    centers = np.arange(size * 3, dtype=float).reshape(size, 3)
+    rotations = np.tile(np.eye(3), (size, 1, 1))
+    return ChainGeometry(index, centers, rotations)
+
+
+class ChainGeometryCacheTest(TestCase):
+    def setUp(self):
+        self.loaded = []
+        self.sizes = {'1S72|1|0': 3, '1S72|1|9': 2, '1FJG|1|A': 2}
+
+        def loader(chain):
+            self.loaded.append(chain)
+            if chain not in self.sizes:
+                return None
+            return geometry(chain, self.sizes[chain])
+
+        self.cache = ChainGeometryCache(loader, max_units=5)
+
+    def test_it_loads_each_chain_once(self):
+        self.cache.get('1S72|1|0')
+        self.cache.get('1S72|1|0')
+        assert self.loaded == ['1S72|1|0']
+        assert self.cache.hits == 1
+        assert self.cache.misses == 1
+
+    def test_it_can_find_a_unit(self):
+        center, rotation = self.cache.unit('1S72|1|0|G|1')
+        np.testing.assert_array_equal(center, [3.0, 4.0, 5.0])
+        np.testing.assert_array_equal(rotation, np.eye(3))
+
+    def test_it_gives_none_for_unknown_units(self):
+        assert self.cache.unit('1S72|1|0|G|7') is None
+        assert self.cache.unit('2AW4|1|B|G|1') is None
+
+    def test_it_evicts_least_recently_used_chain(self):
+        self.cache.get('1S72|1|0')
+        self.cache.get('1S72|1|9')
+        self.cache.get('1S72|1|0')
+        self.cache.get('1FJG|1|A')
+        assert self.cache.evictions == 1
+        self.cache.get('1S72|1|0')
+        assert self.loaded == ['1S72|1|0', '1S72|1|9', '1FJG|1|A']
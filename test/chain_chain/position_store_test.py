@@ -0,0 +1,105 @@
+import shutil
+import tempfile
+from unittest import TestCase
+
+from pymotifs.chain_chain.position_store import PositionStore
+
+
+class PositionStoreTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = PositionStore(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+class UnitPositionsTest(PositionStoreTest):
+    def setUp(self):
+        super(UnitPositionsTest, self).setUp()
+        self.store.add_units({
+            '1S72|1|0': {'1S72|1|0|G|1': 10, '1S72|1|0|C|2': 11},
+            '1S72|1|9': {'1S72|1|9|A|1': 12},
+        })
+
+    def test_it_can_load_a_chain(self):
+        val = self.store.unit_to_position()['1S72|1|0']
+        assert val == {'1S72|1|0|G|1': 10, '1S72|1|0|C|2': 11}
+
+    def test_it_gives_default_for_unknown_chain(self):
+        assert self.store.unit_to_position().get('1FJG|1|A', []) == []
+
+    def test_it_knows_stored_pdbs(self):
+        self.store.add_units({'1FJG|1|A': {'1FJG|1|A|U|5': 3}})
+        assert self.store.known_pdbs() == set(['1S72', '1FJG'])
+
+    def test_it_is_persistent(self):
+        store = PositionStore(self.directory)
+        assert store.unit_to_position()['1S72|1|9'] == {'1S72|1|9|A|1': 12}
+
+    def test_adding_a_chain_again_replaces_it(self):
+        self.store.add_units({'1S72|1|9': {'1S72|1|9|A|2': 13}})
+        val = PositionStore(self.directory).unit_to_position()
+        assert val['1S72|1|9'] == {'1S72|1|9|A|2': 13}
+        assert len(val) == 2
+
+    def test_it_decodes_each_chain_once(self):
+        val = self.store.unit_to_position()
+        assert val['1S72|1|0'] is val['1S72|1|0']
+
+
+class RevisionTest(PositionStoreTest):
+    def setUp(self):
+        super(RevisionTest, self).setUp()
+        self.store.add_units({
+            '1S72|1|0': {'1S72|1|0|G|1': 10},
+            '1S72|1|9': {'1S72|1|9|A|1': 12},
+            '1FJG|1|A': {'1FJG|1|A|U|5': 3},
+        }, {'1S72': '2014-01-01', '1FJG': '2015-02-03'})
+
+    def test_it_finds_revised_pdbs(self):
+        revisions = {'1S72': '2020-05-06', '1FJG': '2015-02-03',
+                     '4V9F': '2021-01-01'}
+        assert PositionStore(self.directory).stale_pdbs(revisions) == \
+            set(['1S72'])
+
+    def test_it_ignores_unknown_revisions(self):
+        assert self.store.stale_pdbs({'1S72': None}) == set()
+
+    def test_pdbs_without_a_revision_are_stale(self):
+        self.store.add_units({'4V9F|1|AA': {'4V9F|1|AA|C|1': 7}})
+        assert self.store.stale_pdbs({'4V9F': '2021-01-01'}) == \
+            set(['4V9F'])
+
+    def test_adding_a_revised_pdb_replaces_all_its_chains(self):
+        self.store.add_units({'1S72|1|0': {'1S72|1|0|G|1': 20}},
+                             {'1S72': '2020-05-06'})
+        val = PositionStore(self.directory).unit_to_position()
+        assert sorted(val.keys()) == ['1FJG|1|A', '1S72|1|0']
+        assert val['1S72|1|0'] == {'1S72|1|0|G|1': 20}
+        assert self.store.stale_pdbs({'1S72': '2020-05-06'}) == set()
+
+
+class PositionPositionsTest(PositionStoreTest):
+    def setUp(self):
+        super(PositionPositionsTest, self).setUp()
+        self.store.add_positions([1, 2], [(10, 20), (11, 21), (10, 22)])
+        self.store.add_positions([3], [(10, 30)])
+
+    def test_it_finds_positions_across_segments(self):
+        val = self.store.position_to_position()
+        assert sorted(val[10]) == [20, 22, 30]
+        assert val[11] == [21]
+
+    def test_it_gives_empty_list_for_unknown_position(self):
+        assert self.store.position_to_position()[99] == []
+
+    def test_it_knows_stored_correspondences(self):
+        assert self.store.known_correspondences() == set([1, 2, 3])
+
+    def test_compacting_keeps_all_positions(self):
+        self.store.compact()
+        assert len(self.store.manifest['positions']) == 1
+        val = PositionStore(self.directory).position_to_position()
+        assert sorted(val[10]) == [20, 22, 30]
+        assert self.store.known_correspondences() == set([1, 2, 3])
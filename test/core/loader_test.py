@@ -42,3 +42,29 @@ class RecomputingTest(StageTest):
 
     def test_it_does_not_use_time_gap_if_not_set(self):
         self.assertFalse(self.loader.been_long_enough('missing'))
+
+
+class StreamingTest(StageTest):
+    loader_class = ExampleLoader
+
+    def test_it_leaves_lists_alone(self):
+        data = [1, 2]
+        self.assertTrue(self.loader.stream(data) is data)
+
+    def test_it_gives_none_for_an_empty_generator(self):
+        self.assertEqual(None, self.loader.stream(x for x in []))
+
+    def test_it_keeps_all_generated_entries(self):
+        data = self.loader.stream(x for x in [1, 2, 3])
+        self.assertEqual([1, 2, 3], list(data))
+
+    def test_it_does_not_read_past_the_first_entry(self):
+        seen = []
+
+        def data():
+            for x in [1, 2, 3]:
+                seen.append(x)
+                yield x
+
+        self.loader.stream(data())
+        self.assertEqual([1], seen)
@@ -0,0 +1,63 @@
+from unittest import TestCase
+
+from test import CONFIG
+from test import StageTest
+from test import Session as SessionMaker
+
+from pymotifs.core.db import Session
+from pymotifs.core.savers import BulkDatabaseSaver
+from pymotifs.core.savers import infile_value
+from pymotifs.models import PdbInfo
+
+Session = Session(SessionMaker)
+
+
+class InfileValueTest(TestCase):
+    def test_it_writes_null_as_backslash_n(self):
+        self.assertEqual('\\N', infile_value(None))
+
+    def test_it_escapes_tabs_newlines_and_backslashes(self):
+        self.assertEqual('a\\tb\\\\c\\nd', infile_value('a\tb\\c\nd'))
+
+    def test_it_writes_bools_as_integers(self):
+        self.assertEqual('1', infile_value(True))
+        self.assertEqual('0', infile_value(False))
+
+
+class BulkDatabaseSavingTest(StageTest):
+    def setUp(self):
+        self.saver = BulkDatabaseSaver(CONFIG, Session)
+
+    def tearDown(self):
+        with Session() as session:
+            session.query(PdbInfo).\
+                filter(PdbInfo.pdb_id.like('0%')).\
+                delete(synchronize_session=False)
+
+    def count(self):
+        with Session() as session:
+            return session.query(PdbInfo).\
+                filter(PdbInfo.pdb_id.like('0%')).\
+                count()
+
+    def test_it_adds_all_entries(self):
+        data = [PdbInfo(pdb_id='0000'), PdbInfo(pdb_id='000A'),
+                PdbInfo(pdb_id='000B')]
+        self.saver('0000', data)
+        self.assertEqual(3, self.count())
+        self.assertEqual(3, self.saver.rows)
+
+    def test_it_can_save_several_dicts(self):
+        self.saver.table = PdbInfo
+        data = [{'pdb_id': '0000', 'resolution': 10},
+                {'pdb_id': '000A'}]
+        self.saver('0000', data)
+        self.assertEqual(2, self.count())
+
+    def test_it_can_merge_if_requested(self):
+        self.saver.merge = True
+        self.saver('0000', PdbInfo(pdb_id='0000', resolution=10))
+        self.saver('0000', PdbInfo(pdb_id='0000', resolution=9))
+        with Session() as session:
+            result = session.query(PdbInfo).filter_by(pdb_id='0000').one()
+            self.assertEqual(9, result.resolution)
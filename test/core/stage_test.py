@@ -1,9 +1,12 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 import pytest
 
 from pymotifs.core.stages import Stage
+from pymotifs.core.stages import Loader
 from pymotifs.core import Skip
+from pymotifs.core import InvalidState
 
 from test import StageTest as Base
 from test import CONFIG
@@ -155,6 +158,102 @@ class ProcessingTests(Base):
         self.assertEqual(val, ['A', 'B'])
 
 
+class SerialStage(SomeStage):
+    allow_parallel = False
+
+
+class PrefetchingStage(SomeStage):
+    def to_process(self, pdbs, **kwargs):
+        self.prefetched = set(pdbs)
+        return super(PrefetchingStage, self).to_process(pdbs, **kwargs)
+
+    def process(self, entry, **kwargs):
+        if entry not in self.prefetched:
+            raise InvalidState("Nothing prefetched for %s" % entry)
+
+
+class ParallelProcessingTests(Base):
+    def test_it_uses_one_worker_by_default(self):
+        stage = SomeStage(CONFIG, None)
+        self.assertEqual(1, stage.worker_count(['A', 'B']))
+
+    def test_it_uses_no_more_workers_than_entries(self):
+        stage = SomeStage(CONFIG, None)
+        self.assertEqual(2, stage.worker_count(['A', 'B'], workers=4))
+
+    def test_it_will_not_use_workers_if_not_allowed(self):
+        stage = SerialStage(CONFIG, None)
+        self.assertEqual(1, stage.worker_count(['A', 'B'], workers=4))
+
+    def test_it_returns_processed_input_in_order(self):
+        stage = SomeStage(CONFIG, None)
+        val = stage(['A', '', 'B', 'C'], workers=2)
+        self.assertEqual(val, ['A', 'B', 'C'])
+
+    def test_workers_keep_what_to_process_prefetched(self):
+        stage = PrefetchingStage(CONFIG, None)
+        val = stage(['A', 'B', 'C'], workers=2)
+        self.assertEqual(val, ['A', 'B', 'C'])
+
+    def test_it_will_not_fork_outside_of_the_main_thread(self):
+        stage = SomeStage(CONFIG, None)
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            future = pool.submit(stage, ['A', 'B'], workers=2)
+        self.assertRaises(InvalidState, future.result)
+
+
+class PlannedLoader(Loader):
+    def data(self, pdb, **kwargs):
+        return []
+
+    def has_data(self, pdb, **kwargs):
+        raise AssertionError("has_data should not be used for %s" % pdb)
+
+    def remove(self, pdb, **kwargs):
+        pass
+
+    def entries_with_data(self, entries, **kwargs):
+        return set(['A'])
+
+
+class PlanningTest(Base):
+    def test_it_uses_planned_data_presence(self):
+        stage = PlannedLoader(CONFIG, None)
+        stage.plan(['A', 'B'])
+        self.assertFalse(stage.is_missing('A'))
+        self.assertTrue(stage.is_missing('B'))
+
+    def test_it_only_plans_strings(self):
+        stage = PlannedLoader(CONFIG, None)
+        stage.plan([('A', 'B')])
+        self.assertEqual(None, stage.planned)
+
+    def test_it_does_not_plan_when_recomputing(self):
+        stage = PlannedLoader(CONFIG, None)
+        stage.plan(['A'], recalculate=True)
+        self.assertFalse(stage.is_planned('A'))
+
+    def test_it_only_loads_marks_if_needed(self):
+        stage = PlannedLoader(CONFIG, None)
+        stage.plan(['A'])
+        self.assertEqual(None, stage.mark_times)
+
+
+class BatchedMarkingTest(Base):
+    def test_it_collects_marks_while_processing(self):
+        stage = PlannedLoader(CONFIG, None)
+        stage.pending_marks = []
+        stage.mark_processed('A')
+        stage.mark_processed('B')
+        self.assertEqual(['A', 'B'], [p for p, _ in stage.pending_marks])
+
+    def test_it_does_not_collect_marks_in_a_dry_run(self):
+        stage = PlannedLoader(CONFIG, None)
+        stage.pending_marks = []
+        stage.mark_processed('A', dry_run=True)
+        self.assertEqual([], stage.pending_marks)
+
+
 class CachingTest(Base):
     loader_class = SomeStage
 
@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from pymotifs.core.structure_cache import BYTES_PER_ATOM
+from pymotifs.core.structure_cache import FILE_BYTES_PER_ATOM
+from pymotifs.core.structure_cache import StructureCache
+from pymotifs.core.structure_cache import estimate_size
+
+
+class Parsed(dict):
+    def atoms(self):
+        return iter(range(self['atoms']))
+
+
+class StructureCacheTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.parsed = []
+        self.files = {}
+        self.atoms = {'1S72': 30, '4V9F': 25, '1FJG': 20}
+        for name in self.atoms:
+            filename = os.path.join(self.directory, name + '.cif')
+            with open(filename, 'w') as raw:
+                raw.write('x')
+            self.files[name] = filename
+        self.cache = StructureCache(max_bytes=60 * BYTES_PER_ATOM)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def load(self, name):
+        def fn():
+            self.parsed.append(name)
+            return Parsed(name=name, atoms=self.atoms[name])
+        return fn
+
+    def get(self, name, kind='structure', cache=None):
+        cache = cache or self.cache
+        return cache.get(kind, self.files[name], self.load(name))
+
+    def test_it_parses_each_file_once(self):
+        first = self.get('1S72')
+        second = self.get('1S72')
+        assert first is second
+        assert self.parsed == ['1S72']
+        assert (self.cache.hits, self.cache.misses) == (1, 1)
+
+    def test_it_keeps_kinds_separate(self):
+        self.get('1S72')
+        self.get('1S72', kind='cif')
+        assert self.parsed == ['1S72', '1S72']
+
+    def test_it_evicts_the_least_recently_used_file(self):
+        self.get('1S72')
+        self.get('1FJG')
+        self.get('1S72')
+        self.get('4V9F')
+        assert len(self.cache) == 2
+        self.get('1S72')
+        self.get('1FJG')
+        assert self.parsed == ['1S72', '1FJG', '4V9F', '1FJG']
+
+    def test_it_reparses_changed_files(self):
+        self.get('1FJG')
+        with open(self.files['1FJG'], 'a') as raw:
+            raw.write('more')
+        self.get('1FJG')
+        assert self.parsed == ['1FJG', '1FJG']
+
+    def test_it_can_load_saved_structures(self):
+        saved = os.path.join(self.directory, 'saved')
+        max_bytes = 60 * BYTES_PER_ATOM
+        self.get('1FJG', cache=StructureCache(max_bytes, saved))
+        value = self.get('1FJG', cache=StructureCache(max_bytes, saved))
+        assert value == {'name': '1FJG', 'atoms': 20}
+        assert self.parsed == ['1FJG']
+
+    def test_it_estimates_size_from_atoms(self):
+        value = Parsed(name='1S72', atoms=30)
+        assert estimate_size(self.files['1S72'], value) == 30 * BYTES_PER_ATOM
+
+    def test_it_estimates_size_from_the_file_without_atoms(self):
+        with open(self.files['1S72'], 'w') as raw:
+            raw.write('x' * FILE_BYTES_PER_ATOM * 4)
+        assert estimate_size(self.files['1S72'], {}) == 4 * BYTES_PER_ATOM
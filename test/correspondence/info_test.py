@@ -201,3 +201,69 @@ class ComputingDataTest(StageTest):
         print(self.pairs)
         print(ans)
         assert self.pairs == ans
+
+
+class BlockedPairsTest(StageTest):
+    loader_class = Loader
+
+    def seq(self, id, length, taxonomy_id, entity_type='rna', pdb_id='1ABC'):
+        return {'id': id, 'length': length, 'taxonomy_id': set([taxonomy_id]),
+                'entity_type': entity_type, 'pdb_id': pdb_id}
+
+    def ids(self, pairs):
+        return [(p[0]['id'], p[1]['id']) for p in pairs]
+
+    def matching(self, pairs):
+        return self.ids(p for p in pairs if self.loader.is_match(p))
+
+    def setUp(self):
+        super(BlockedPairsTest, self).setUp()
+        self.loader._known = set()
+        self.seqs = [
+            self.seq(1, 10, 562),
+            self.seq(2, 10, None),
+            self.seq(3, 15, 562),
+            self.seq(4, 100, 562),
+            self.seq(5, 190, 9606),
+            self.seq(6, 210, SYNTHETIC_SPECIES_ID),
+            self.seq(7, 1500, 562),
+            self.seq(8, 2900, 562),
+            self.seq(9, 3082, 9606, pdb_id='9GUT'),
+            self.seq(10, 20, None, entity_type='dna'),
+            self.seq(11, 20, 562, entity_type='dna'),
+            self.seq(12, 21, 562, entity_type='dna'),
+        ]
+
+    def test_finds_the_same_matches_as_all_pairs(self):
+        ans = self.matching(self.loader.all_pairs(self.seqs))
+        val = self.matching(self.loader.candidate_pairs(self.seqs))
+        assert val == ans
+
+    def test_does_not_generate_pairs_of_other_species(self):
+        val = self.ids(self.loader.candidate_pairs(self.seqs))
+        assert (4, 5) not in val
+        assert (5, 6) in val
+
+    def test_does_not_generate_pairs_of_other_lengths(self):
+        val = self.ids(self.loader.candidate_pairs(self.seqs))
+        assert (1, 2) in val
+        assert (1, 3) not in val
+        assert (10, 11) in val
+        assert (11, 12) not in val
+
+    def test_generates_the_special_case_pairs(self):
+        val = self.ids(self.loader.candidate_pairs(self.seqs))
+        assert (7, 9) not in val
+        self.seqs[6]['taxonomy_id'] = set([9606])
+        val = self.ids(self.loader.candidate_pairs(self.seqs))
+        assert (7, 9) in val
+
+    def test_knows_the_range_of_partner_lengths(self):
+        assert self.loader.max_partner_length(10) == 10
+        assert self.loader.max_partner_length(100) == 200
+        assert self.loader.max_partner_length(1500) == 2000
+        assert self.loader.max_partner_length(2500) == 5000
+        assert self.loader.min_partner_length(10) == 10
+        assert self.loader.min_partner_length(30) == 19
+        assert self.loader.min_partner_length(201) == 101
+        assert self.loader.min_partner_length(3000) == 2000
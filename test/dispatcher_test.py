@@ -233,3 +233,53 @@ class StagesTest(ut.TestCase):
             'interactions.summary',
             'ife.info',
         ]
+
+
+class FakeStage(object):
+    def __init__(self, name, calls, fail=False):
+        self.name = name
+        self.calls = calls
+        self.fail = fail
+
+    def __call__(self, entries, **kwargs):
+        self.calls.append(self.name)
+        if self.fail:
+            raise core.StageFailed(self.name)
+
+
+class ConcurrentTest(ut.TestCase):
+    def setUp(self):
+        self.dispatcher = Dispatcher('units.info', CONFIG, Session,
+                                     concurrent_stages=3)
+
+    def test_requirements_only_contain_given_stages(self):
+        stages = self.dispatcher.stages('units.info')
+        val = self.dispatcher.requirements(stages)
+        assert val == {
+            'download': set(),
+            'pdbs.info': set(),
+            'units.info': set(['download', 'pdbs.info']),
+        }
+
+    def test_requirements_follow_excluded_stages(self):
+        self.dispatcher.exclude = set(['units.info'])
+        stages = self.dispatcher.stages('ife.info')
+        val = self.dispatcher.requirements(stages)
+        assert 'download' in val['ife.info']
+
+    def test_runs_stages_after_their_requirements(self):
+        calls = []
+        stages = [FakeStage('a', calls), FakeStage('b', calls),
+                  FakeStage('c', calls)]
+        reqs = {'a': set(), 'b': set(), 'c': set(['a', 'b'])}
+        self.dispatcher.run_concurrently(stages, reqs, [], manual={})
+        assert sorted(calls[:2]) == ['a', 'b']
+        assert calls[2] == 'c'
+
+    def test_does_not_run_stages_after_a_failure(self):
+        calls = []
+        stages = [FakeStage('a', calls, fail=True), FakeStage('b', calls)]
+        reqs = {'a': set(), 'b': set(['a'])}
+        with pytest.raises(core.StageFailed):
+            self.dispatcher.run_concurrently(stages, reqs, [], manual={})
+        assert calls == ['a']
@@ -0,0 +1,47 @@
+from unittest import TestCase
+
+from test import StageTest
+
+from pymotifs import models as mod
+from pymotifs.ife.cqs import IfeQualityLoader
+from pymotifs.ife.cqs import count_atoms_in
+
+
+class CountAtomsTest(TestCase):
+    def test_counts_heavy_backbone_and_base_atoms(self):
+        coordinates = '\n'.join([
+            "ATOM 1 P P . G A 1 1 ? 1.0 2.0 3.0 1.00 20.0 ? 1 G A P 1",
+            "ATOM 2 O OP1 . G A 1 1 ? 1.0 2.0 3.0 1.00 20.0 ? 1 G A OP1 1",
+            "ATOM 3 H H5' . G A 1 1 ? 1.0 2.0 3.0 1.00 20.0 ? 1 G A H5' 1",
+            "ATOM 4 N N9 . G A 1 1 ? 1.0 2.0 3.0 1.00 20.0 ? 1 G A N9 1",
+        ])
+        self.assertEqual(count_atoms_in(coordinates), 3)
+
+    def test_ignores_short_lines(self):
+        self.assertEqual(count_atoms_in('ATOM 1\n\n'), 0)
+
+
+class MassInputsTest(StageTest):
+    loader_class = IfeQualityLoader
+
+    def ife_ids(self, *pdbs):
+        with self.loader.session() as session:
+            query = session.query(mod.IfeInfo.ife_id).\
+                filter(mod.IfeInfo.model.isnot(None)).\
+                filter(mod.IfeInfo.new_style == True).\
+                filter(mod.IfeInfo.pdb_id.in_(pdbs))
+            return sorted(r.ife_id for r in query)
+
+    def test_it_computes_the_same_inputs_as_each_ife(self):
+        ife_ids = self.ife_ids('4V42', '4V4Q')
+        assert ife_ids
+        inputs = self.loader.mass_inputs(ife_ids)
+        assert sorted(inputs) == ife_ids
+        for ife_id in ife_ids:
+            expected = self.loader.inputs(ife_id)
+            assert sorted(inputs[ife_id]) == sorted(expected)
+            for key, value in expected.items():
+                if isinstance(value, float):
+                    self.assertAlmostEqual(inputs[ife_id][key], value)
+                else:
+                    self.assertEqual(inputs[ife_id][key], value)
@@ -281,3 +281,25 @@ class BestModelsTest(StageTest):
     def test_it_picks_model_with_most_bps(self):
         val = self.loader.best_model('1E4P', '1_555')
         self.assertEquals(val, 8)
+
+
+class InteractionCountsTest(StageTest):
+    loader_class = IfeLoader
+
+    def test_counts_internal_cww_of_each_chain(self):
+        val = self.loader.interaction_counts('4V4Q')
+        self.assertEquals(472, val['internal']['AA'])
+
+    def test_loads_the_same_chain_with_counts(self):
+        counts = self.loader.interaction_counts('4PMI')
+        val = self.loader.load('4PMI', 'A', counts=counts)
+        self.assertEquals(val.internal, 15)
+        self.assertEquals(val.bps, 17)
+
+    def test_gives_the_same_cross_chain_interactions(self):
+        ifes = [IfeChain(pdb='2MKN', chain='C'),
+                IfeChain(pdb='2MKN', chain='B')]
+        counts = self.loader.interaction_counts('2MKN')
+        val = self.loader.cross_chain_interactions(ifes, counts=counts)
+        ans = {'C': {'C': 0, 'B': 19}, 'B': {'B': 0, 'C': 19}}
+        self.assertEquals(ans, val)
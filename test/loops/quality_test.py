@@ -1,3 +1,5 @@
+from unittest import TestCase
+
 import pytest
 
 from pymotifs import core
@@ -5,6 +7,7 @@ from pymotifs import core
 from test import StageTest
 
 from pymotifs.loops.quality import Loader
+from pymotifs.loops.quality import UnitIndex
 
 
 class Base(StageTest):
@@ -844,3 +847,81 @@ class RSRZTests(Base):
         loop = self.loop('HL_1FJG_003')
         assess = self.loader.assessment_data('1FJG')
         assert self.loader.is_fictional_pair(assess.pairs, assess.rsrz, loop) is True
+
+
+class UnitIndexTest(Base):
+    loader_class = Loader
+
+    def setUp(self):
+        super(UnitIndexTest, self).setUp()
+        self.index = self.loader.unit_index('1GID')
+
+    def test_it_gives_the_same_unit_info_as_a_query(self):
+        unit = '1GID|1|A|G|103'
+        assert self.index.unit_info(unit) == self.loader.unit_info(unit)
+
+    def test_it_gives_the_same_position_as_a_query(self):
+        unit = '1GID|1|A|G|103'
+        assert self.index.position_info(unit) == \
+            self.loader.position_info(unit)
+
+    def tearDown(self):
+        self.loader.index = None
+        super(UnitIndexTest, self).tearDown()
+
+    def test_it_finds_non_cWW_pairs_like_a_query(self):
+        loop = self.loop('HL_1GID_001')
+        queried = self.loader.has_no_non_cWW(loop)
+        self.loader.index = self.index
+        assert self.loader.has_no_non_cWW(loop) == queried
+
+    def test_it_finds_units_between_like_a_query(self):
+        loop = self.loop('HL_1GID_001')
+        first, last = loop['unit_ids'][0], loop['unit_ids'][-1]
+        queried = self.loader.units_between(first, last)
+        self.loader.index = self.index
+        assert queried
+        assert self.loader.units_between(first, last) == queried
+
+
+class UnitIndexAlternateIdTest(TestCase):
+    def setUp(self):
+        def unit(unit_id, number, alt_id, chain_index):
+            return {
+                'unit_id': unit_id,
+                'pdb_id': '1S72',
+                'model': 1,
+                'chain': '0',
+                'number': number,
+                'unit': 'A',
+                'alt_id': alt_id,
+                'ins_code': None,
+                'chain_index': chain_index,
+                'sym_op': '1_555',
+            }
+
+        units = [
+            unit('1S72|1|0|A|4', 4, None, 4),
+            unit('1S72|1|0|A|5||A', 5, 'A', 5),
+            unit('1S72|1|0|A|5||B', 5, 'B', 5),
+            unit('1S72|1|0|A|6', 6, None, 6),
+        ]
+        positions = [
+            {'unit_id': '1S72|1|0|A|5||A', 'index': 4, 'exp_seq_id': 1,
+             'chain': '0', 'model': 1, 'sym_op': '1_555'},
+        ]
+        self.index = UnitIndex('1S72', units, positions, [])
+
+    def test_it_keeps_every_alternate_id_between_units(self):
+        assert self.index.units_between('1S72|1|0|A|4', '1S72|1|0|A|6') == [
+            '1S72|1|0|A|5||A',
+            '1S72|1|0|A|5||B',
+        ]
+
+    def test_it_finds_positions_of_units_without_an_alternate_id(self):
+        assert '1S72|1|0|A|5' not in self.index
+        assert self.index.covers('1S72|1|0|A|5')
+        assert self.index.position_info('1S72|1|0|A|5') == {
+            'index': 4, 'exp_seq_id': 1, 'chain': '0', 'model': 1,
+            'sym_op': '1_555',
+        }
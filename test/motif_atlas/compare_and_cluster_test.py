@@ -0,0 +1,213 @@
+import shutil
+import tempfile
+from unittest import TestCase
+
+from pymotifs.motif_atlas.compare_and_cluster import FLANKING_BP_CONFLICT
+from pymotifs.motif_atlas.compare_and_cluster import MISMATCHED_BULGE
+from pymotifs.motif_atlas.compare_and_cluster import NO_CANDIDATES
+from pymotifs.motif_atlas.compare_and_cluster import SEARCH_SPACE_CONFLICT
+from pymotifs.motif_atlas.compare_and_cluster import LoopSignature
+from pymotifs.motif_atlas.compare_and_cluster import append_search_results_one_pdb
+from pymotifs.motif_atlas.compare_and_cluster import count_flanking_pairs
+from pymotifs.motif_atlas.compare_and_cluster import format_eta
+from pymotifs.motif_atlas.compare_and_cluster import prefilter_pair
+from pymotifs.motif_atlas.compare_and_cluster import shard_search_spaces
+from pymotifs.motif_atlas.search_results import SearchResultStore
+
+
+def search_spaces(sizes):
+    spaces = {}
+    for loop_id, size in sizes.items():
+        index_to_id = dict((i, 'unit%d' % i) for i in range(size))
+        spaces[loop_id] = {'ifedata': {'index_to_id': index_to_id}}
+    return spaces
+
+
+def signature(length, bulged=0, strands=2, bulge='', flanking=None):
+    single_bulge = bulged == 1 and length == 5
+    if flanking is None:
+        flanking = strands
+    return LoopSignature(strands=strands, length=length, bulged=bulged,
+                         core=length - bulged, single_bulge=single_bulge,
+                         bulge=bulge if single_bulge else '',
+                         flanking=flanking)
+
+
+def ifedata(sequence, interactions):
+    ids = ['1S72|1|0|%s|%d' % (base, i) for i, base in enumerate(sequence)]
+    return {'ids': ids, 'pairToInteractions': interactions}
+
+
+class PrefilterPairTest(TestCase):
+    def test_it_keeps_identical_loops(self):
+        for loop_type, strands in [('HL', 1), ('IL', 2), ('J3', 3)]:
+            loop = signature(8, bulged=1, strands=strands)
+            assert prefilter_pair(loop_type, loop, loop) is None
+
+    def test_it_keeps_single_bulges_with_the_same_base(self):
+        query = signature(5, bulged=1, bulge='A')
+        assert prefilter_pair('IL', query, signature(5, 1, bulge='A')) is None
+
+    def test_it_rejects_single_bulges_with_another_base(self):
+        query = signature(5, bulged=1, bulge='A')
+        val = prefilter_pair('IL', query, signature(5, 1, bulge='G'))
+        assert val == MISMATCHED_BULGE
+
+    def test_it_rejects_single_bulge_queries_in_other_loops(self):
+        query = signature(5, bulged=1, bulge='A')
+        assert prefilter_pair('IL', query, signature(5)) == MISMATCHED_BULGE
+
+    def test_it_rejects_other_queries_in_single_bulges(self):
+        val = prefilter_pair('IL', signature(5), signature(5, 1, bulge='A'))
+        assert val == MISMATCHED_BULGE
+
+    def test_it_only_treats_internal_loops_as_single_bulges(self):
+        query = signature(5, bulged=1, bulge='A')
+        val = prefilter_pair('J3', query, signature(5, 1, bulge='G', strands=3))
+        assert val is None
+
+    def test_it_rejects_much_larger_junctions(self):
+        query = signature(10, strands=3)
+        assert prefilter_pair('J3', query, signature(25, 15, strands=3)) is None
+        val = prefilter_pair('J3', query, signature(26, 16, strands=3))
+        assert val == SEARCH_SPACE_CONFLICT
+
+    def test_it_rejects_small_internal_loops_in_huge_ones(self):
+        assert prefilter_pair('IL', signature(20), signature(36, 16)) is None
+        val = prefilter_pair('IL', signature(19), signature(36, 17))
+        assert val == SEARCH_SPACE_CONFLICT
+
+    def test_it_rejects_search_spaces_with_a_larger_core(self):
+        val = prefilter_pair('IL', signature(8, 1), signature(8))
+        assert val == SEARCH_SPACE_CONFLICT
+
+    def test_it_keeps_search_spaces_with_more_bulged_bases(self):
+        assert prefilter_pair('IL', signature(8), signature(10, 2)) is None
+
+    def test_it_rejects_search_spaces_shorter_than_the_core(self):
+        val = prefilter_pair('IL', signature(8), signature(7))
+        assert val == SEARCH_SPACE_CONFLICT
+
+    def test_it_rejects_search_spaces_without_enough_flanking_pairs(self):
+        query = signature(10, strands=3)
+        assert prefilter_pair('J3', query, signature(10, strands=3, flanking=3)) is None
+        val = prefilter_pair('J3', query, signature(10, strands=3, flanking=2))
+        assert val == FLANKING_BP_CONFLICT
+
+    def test_it_records_hairpins_without_a_flanking_pair_as_not_found(self):
+        query = signature(5, strands=1)
+        val = prefilter_pair('HL', query, signature(5, strands=1, flanking=0))
+        assert val == NO_CANDIDATES
+
+    def test_it_rejects_single_bulges_without_flanking_pairs(self):
+        query = signature(5, bulged=1, bulge='A')
+        val = prefilter_pair('IL', query, signature(5, 1, bulge='A', flanking=1))
+        assert val == MISMATCHED_BULGE
+
+    def test_it_rejects_much_longer_hairpins(self):
+        query = signature(5, strands=1)
+        assert prefilter_pair('HL', query, signature(15, 10, strands=1)) is None
+        val = prefilter_pair('HL', query, signature(16, 11, strands=1))
+        assert val == SEARCH_SPACE_CONFLICT
+
+
+class CountFlankingPairsTest(TestCase):
+    def test_it_counts_each_cww_pair_once(self):
+        data = ifedata('GAAC', {(0, 3): ['cWW'], (3, 0): ['cWW'],
+                                (1, 2): ['tSH']})
+        assert count_flanking_pairs(data) == 1
+
+    def test_it_counts_near_cww_pairs(self):
+        data = ifedata('GAAC', {(0, 3): ['ncWW', 's35']})
+        assert count_flanking_pairs(data) == 1
+
+    def test_it_skips_pairs_of_standard_bases_that_cannot_close_a_strand(self):
+        data = ifedata('GAAA', {(0, 3): ['cWW']})
+        assert count_flanking_pairs(data) == 0
+
+    def test_it_keeps_wobble_pairs(self):
+        data = ifedata('GAAU', {(0, 3): ['cWW']})
+        assert count_flanking_pairs(data) == 1
+
+
+class ShardSearchSpacesTest(TestCase):
+    def setUp(self):
+        self.sizes = {
+            'IL_1S72_001': 40, 'IL_1S72_002': 30,
+            'IL_4V9F_001': 50,
+            'IL_1FJG_001': 20, 'IL_1FJG_002': 10,
+            'IL_2AW7_001': 25,
+            'IL_3J9M_001': 15, 'IL_3J9M_002': 5,
+        }
+        self.spaces = search_spaces(self.sizes)
+
+    def work(self, shard):
+        return sum(self.sizes[loop_id] for loop_id in shard)
+
+    def test_it_covers_each_search_space_once(self):
+        shards = shard_search_spaces(self.spaces, 3)
+        ids = [loop_id for shard in shards for loop_id in shard]
+        assert sorted(ids) == sorted(self.spaces.keys())
+
+    def test_it_keeps_each_pdb_in_one_shard(self):
+        shards = shard_search_spaces(self.spaces, 3)
+        for shard in shards:
+            for other in shards:
+                if shard is not other:
+                    pdbs = set(i.split('_')[1] for i in shard)
+                    assert not pdbs & set(i.split('_')[1] for i in other)
+
+    def test_it_balances_the_work(self):
+        shards = shard_search_spaces(self.spaces, 3)
+        assert sorted(self.work(shard) for shard in shards) == [55, 70, 70]
+
+    def test_it_orders_each_shard_in_search_order(self):
+        forward = shard_search_spaces(self.spaces, 2)
+        backward = shard_search_spaces(self.spaces, 2, reversed_search=True)
+        assert all(shard == sorted(shard) for shard in forward)
+        assert [sorted(s) for s in backward] == forward
+        assert all(shard == sorted(shard, reverse=True) for shard in backward)
+
+    def test_it_drops_empty_shards(self):
+        shards = shard_search_spaces(self.spaces, 10)
+        assert len(shards) == 5
+
+    def test_it_uses_one_shard_if_given_none(self):
+        assert shard_search_spaces(self.spaces, 0) == [sorted(self.spaces)]
+
+
+class FormatEtaTest(TestCase):
+    def test_it_formats_seconds(self):
+        assert format_eta(59) == '0:00:59'
+
+    def test_it_formats_hours_and_minutes(self):
+        assert format_eta(3 * 3600 + 7 * 60 + 5) == '3:07:05'
+
+    def test_it_truncates_fractions(self):
+        assert format_eta(61.9) == '0:01:01'
+
+
+class AppendSearchResultsTest(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.store = SearchResultStore(self.path, 'IL')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_it_saves_only_unsaved_pairs(self):
+        results = {('IL_1S72_001', 'IL_4V9F_002'): 7,
+                   ('IL_1S72_003', 'IL_4V9F_002'): 9}
+        unsaved = set([('IL_1S72_003', 'IL_4V9F_002')])
+        count = append_search_results_one_pdb('IL', '4V9F', results, unsaved, self.path)
+        assert count == 1
+        assert unsaved == set()
+        assert self.store.load('4V9F') == {('IL_1S72_003', 'IL_4V9F_002'): 9}
+
+    def test_it_saves_pairs_searched_again(self):
+        pair = ('IL_1S72_001', 'IL_4V9F_002')
+        self.store.append('4V9F', {pair: 7})
+        results = self.store.load('4V9F')
+        results[pair] = 3
+        append_search_results_one_pdb('IL', '4V9F', results, set([pair]), self.path)
+        assert self.store.load('4V9F') == {pair: 3}
@@ -0,0 +1,75 @@
+import gzip
+import pickle
+import shutil
+import tempfile
+from unittest import TestCase
+
+from pymotifs.motif_atlas.search_results import MATCH
+from pymotifs.motif_atlas.search_results import MAX_CHUNKS
+from pymotifs.motif_atlas.search_results import SearchResultStore
+from pymotifs.motif_atlas.search_results import distance_matrices
+from pymotifs.motif_atlas.search_results import results_to_columns
+
+
+def match(discrepancy):
+    return [{'dq': [], 'discrepancy': discrepancy,
+             'query_unit_ids': ['a'], 'target_unit_ids': ['b']}]
+
+
+class SearchResultStoreTest(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.store = SearchResultStore(self.path, 'IL')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_it_can_load_what_was_appended(self):
+        results = {('IL_1S72_001', 'IL_4V9F_002'): match(0.3),
+                   ('IL_1S72_003', 'IL_4V9F_002'): 7}
+        self.store.append('4V9F', results)
+        assert self.store.load('4V9F') == results
+
+    def test_later_chunks_replace_earlier_results(self):
+        self.store.append('4V9F', {('IL_1S72_001', 'IL_4V9F_002'): 0})
+        self.store.append('4V9F', {('IL_1S72_001', 'IL_4V9F_002'): match(0.5)})
+        assert self.store.load('4V9F') == {('IL_1S72_001', 'IL_4V9F_002'): match(0.5)}
+
+    def test_it_compacts_many_chunks(self):
+        for i in range(MAX_CHUNKS + 1):
+            self.store.append('4V9F', {('IL_1S72_%03d' % i, 'IL_4V9F_002'): i})
+        assert len(self.store.chunks('4V9F')) == 1
+        assert len(self.store.load('4V9F')) == MAX_CHUNKS + 1
+
+    def test_it_reads_old_pickle_files(self):
+        with gzip.open(self.store.legacy_file('4V9F'), 'wb') as f:
+            pickle.dump({('IL_1S72_001', 'IL_4V9F_002'): 9}, f)
+        self.store.append('4V9F', {('IL_1S72_003', 'IL_4V9F_002'): 1})
+        assert self.store.load('4V9F') == {('IL_1S72_001', 'IL_4V9F_002'): 9,
+                                           ('IL_1S72_003', 'IL_4V9F_002'): 1}
+
+
+class DistanceMatricesTest(TestCase):
+    def setUp(self):
+        results = {
+            ('a', 'b'): match(0.4), ('b', 'a'): [{'dq': [1], 'discrepancy': 0.2}],
+            ('a', 'c'): [{'dq': [7], 'discrepancy': 99}], ('c', 'a'): [{'dq': [0], 'discrepancy': 99}],
+            ('b', 'c'): match(0.6), ('c', 'b'): match(0.5),
+        }
+        columns = results_to_columns(results)
+        self.columns = [(columns['loop_ids'], columns['query'], columns['search'],
+                         columns['code'], columns['discrepancy'])]
+
+    def test_it_finds_matches(self):
+        disc_m, MM, dq_matrix = distance_matrices(self.columns, ['a', 'b', 'c'])
+        assert MM.tolist() == [[0, 1, 0], [1, 0, 1], [0, 1, 0]]
+        assert disc_m[0][1] == 0.2
+        assert disc_m[2][1] == 0.5
+        assert dq_matrix == [[-1, -1, 7], [-1, -1, -1], [0, -1, -1]]
+
+    def test_it_requires_all_pairs(self):
+        with self.assertRaises(KeyError):
+            distance_matrices(self.columns, ['a', 'b', 'c', 'd'])
+
+    def test_the_match_code_is_not_a_disqualification(self):
+        assert self.columns[0][3].tolist().count(MATCH) == 3
@@ -0,0 +1,113 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+from unittest import TestCase
+
+from pymotifs.motif_atlas.varna import MANIFEST_NAME
+from pymotifs.motif_atlas.varna import DiagramRenderer
+from pymotifs.motif_atlas.varna import diagram_hash
+from pymotifs.motif_atlas.varna import previous_diagram_dir
+
+
+"""A stand in for VARNA. It records each call and writes the sequence to the
+output file, unless the sequence is FAIL."""
+FAKE_VARNA = '''
+import sys
+args = sys.argv[1:]
+with open(args[0], 'a') as raw:
+    raw.write(args[-1] + '\\n')
+sequence = args[args.index('-sequenceDBN') + 1]
+if sequence != 'FAIL':
+    with open(args[-1], 'w') as raw:
+        raw.write(sequence)
+'''
+
+
+def info(sequence, structure='(..)', aux=''):
+    return {'sequenceDBN': sequence, 'structureDBN': structure,
+            'auxBPs': aux, 'output_dir': '.'}
+
+
+class DiagramRendererTest(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.script = os.path.join(self.path, 'varna.py')
+        self.calls = os.path.join(self.path, 'calls.txt')
+        with open(self.script, 'w') as raw:
+            raw.write(FAKE_VARNA)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def release(self, name):
+        directory = os.path.join(self.path, name)
+        os.makedirs(directory)
+        return directory
+
+    def renderer(self, output_dir, **kwargs):
+        command = [sys.executable, self.script, self.calls]
+        return DiagramRenderer(output_dir, command=command, **kwargs)
+
+    def read(self, output_dir, num, fmt):
+        filename = os.path.join(output_dir, '2ds', 'Group_%03d.%s' % (num, fmt))
+        with open(filename, 'r') as raw:
+            return raw.read()
+
+    def called(self):
+        if not os.path.exists(self.calls):
+            return []
+        with open(self.calls, 'r') as raw:
+            return [os.path.basename(l.strip()) for l in raw]
+
+    def test_it_draws_each_group_in_each_format(self):
+        output_dir = self.release('HL_3.87_2024-08-02_20:30')
+        renderer = self.renderer(output_dir, workers=2)
+        renderer.add(1, info('GAAA'))
+        renderer.add(2, info('UUCG'))
+        assert renderer.render() == {1: 'drawn', 2: 'drawn'}
+        assert self.read(output_dir, 1, 'svg') == 'GAAA'
+        assert self.read(output_dir, 2, 'png') == 'UUCG'
+        assert sorted(self.called()) == ['Group_001.png', 'Group_001.svg',
+                                         'Group_002.png', 'Group_002.svg']
+
+    def test_it_records_drawn_groups_in_the_manifest(self):
+        output_dir = self.release('HL_3.87_2024-08-02_20:30')
+        renderer = self.renderer(output_dir)
+        renderer.add(1, info('GAAA'))
+        renderer.add(2, info('FAIL'))
+        assert renderer.render() == {1: 'drawn', 2: 'failed'}
+        with open(os.path.join(output_dir, '2ds', MANIFEST_NAME)) as raw:
+            assert json.load(raw) == {'001': diagram_hash(info('GAAA'))}
+        with open(os.path.join(output_dir, 'problemtic_varna_commands.txt')) as raw:
+            assert len(raw.readlines()) == 2
+
+    def test_it_reuses_unchanged_diagrams_of_the_previous_release(self):
+        old = self.release('HL_3.86_2024-07-01_10:00')
+        renderer = self.renderer(old)
+        renderer.add(1, info('GAAA'))
+        renderer.add(2, info('UUCG'))
+        renderer.render()
+        os.remove(self.calls)
+
+        new = self.release('HL_3.87_2024-08-02_20:30')
+        assert previous_diagram_dir(new) == os.path.join(old, '2ds')
+        renderer = self.renderer(new, previous_dir=previous_diagram_dir(new))
+        renderer.add(1, info('UUCG'))
+        renderer.add(2, info('GNRA'))
+        assert renderer.render() == {1: 'reused', 2: 'drawn'}
+        assert self.read(new, 1, 'png') == 'UUCG'
+        assert sorted(self.called()) == ['Group_002.png', 'Group_002.svg']
+
+    def test_it_only_uses_releases_of_the_same_loop_type(self):
+        self.release('IL_3.86_2024-07-01_10:00/2ds')
+        with open(os.path.join(self.path, 'IL_3.86_2024-07-01_10:00', '2ds',
+                               MANIFEST_NAME), 'w') as raw:
+            raw.write('{}')
+        new = self.release('HL_3.87_2024-08-02_20:30')
+        assert previous_diagram_dir(new) is None
+
+    def test_hash_depends_on_all_inputs(self):
+        assert diagram_hash(info('GAAA')) != diagram_hash(info('GAAA', aux='x'))
+        assert diagram_hash(info('GAAA')) != diagram_hash(info('GAAA', '....'))
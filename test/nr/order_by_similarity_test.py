@@ -0,0 +1,34 @@
+import random
+
+import numpy as np
+
+from pymotifs.nr import orderBySimilarity as obs
+
+
+def distances(size, seed):
+    points, distance = obs.generateUniformDataset(size, 3, seed)
+    # rounding creates ties, which must be broken the same way
+    return np.round(distance, 1)
+
+
+def test_tree_penalty_matches_the_loop():
+    distance = distances(30, 17)
+    assert np.array_equal(obs.treePenalty(distance),
+                          obs.treePenaltyLoop(distance))
+
+
+def test_greedy_insertion_matches_the_loop():
+    for seed in range(1, 6):
+        distance = distances(40, seed)
+        order = list(range(40))
+        random.Random(seed).shuffle(order)
+        val = obs.greedyInsertionPathLength(distance, order)
+        ans = obs.greedyInsertionPathLengthLoop(distance, order)
+        assert val == ans
+
+
+def test_seeded_ordering_does_not_depend_on_workers():
+    distance = distances(25, 3)
+    val = obs.treePenalizedPathLength(distance, 10, seed=11, workers=2)
+    ans = obs.treePenalizedPathLength(distance, 10, seed=11)
+    assert val == ans
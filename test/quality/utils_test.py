@@ -1,3 +1,7 @@
+import gzip
+import hashlib
+import unittest
+
 from pymotifs import core
 import pymotifs.quality.utils as ut
 
@@ -144,6 +148,30 @@ class UnusualUnitsTest(ParserTest):
         }
 
 
+class StreamingParserTest(unittest.TestCase):
+    filename = 'test/files/validation/4v7w_validation.xml.gz'
+
+    def test_computes_md5_of_the_whole_report(self):
+        with gzip.open(self.filename, 'rb') as raw:
+            ans = hashlib.md5(raw.read()).hexdigest()
+        assert ut.Parser(self.filename).digest == ans
+
+    def test_gives_the_same_entity_for_each_kind_of_source(self):
+        with open(self.filename, 'rb') as raw:
+            from_content = ut.Parser(raw.read()).entity()
+            from_file = ut.Parser(raw).entity()
+        assert ut.Parser(self.filename).entity() == from_content
+        assert from_file == from_content
+
+    def test_gives_each_residue_with_its_clashes(self):
+        residues = list(ut.Parser(self.filename).residues())
+        root = ut.Parser(self.filename).root
+        ans = root.findall('ModelledSubgroup')
+        assert len(residues) == len(ans)
+        assert residues[0][0] == ans[0].attrib
+        assert residues[0][1] == [c.attrib for c in ans[0].findall('clash')]
+
+
 class UtilsTest(StageTest):
     loader_class = ut.Utils
 
@@ -0,0 +1,255 @@
+import logging
+import unittest as ut
+
+from contextlib import contextmanager
+
+from unittest import mock
+
+import numpy as np
+
+from test import StageTest
+
+from pymotifs import models as mod
+from pymotifs.units.fused import Loader
+
+
+def by_stage(loader, data):
+    rows = dict((stage.name, []) for stage in loader.stages)
+    for stage, row in data:
+        rows[stage.name].append(row)
+    return [rows[stage.name] for stage in loader.stages]
+
+
+class FusedDataTest(StageTest):
+    loader_class = Loader
+
+    def setUp(self):
+        super(FusedDataTest, self).setUp()
+        self.data = by_stage(self.loader, self.loader.data('157D'))
+
+    def test_it_computes_rows_for_each_member(self):
+        assert len(self.data) == len(self.loader.members)
+
+    def test_it_computes_units_first(self):
+        assert len(self.data[0]) == 24
+        assert set(u.pdb_id for u in self.data[0]) == set(['157D'])
+
+    def test_it_computes_the_same_rows_as_each_stage(self):
+        for stage, rows in zip(self.loader.stages, self.data):
+            if stage.name == 'units.info':
+                continue
+            expected = list(stage.data('157D'))
+            assert len(rows) == len(expected)
+
+    def test_it_computes_coordinates_for_each_unit(self):
+        units = [u.unit_id for u in self.data[0]]
+        assert [c.unit_id for c in self.data[2]] == units
+
+
+class Row(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.__dict__ == other.__dict__
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__, sorted(self.__dict__.items()))
+
+
+class UnitInfo(Row):
+    pass
+
+
+class UnitCenters(Row):
+    pass
+
+
+class UnitRotations(Row):
+    pass
+
+
+class UnitCoordinates(Row):
+    pass
+
+
+class Centers(object):
+    def __init__(self, centers):
+        self.centers = centers
+
+    def definitions(self):
+        return sorted(self.centers)
+
+    def __getitem__(self, name):
+        return self.centers[name]
+
+
+class Residue(object):
+    def __init__(self, number, sequence, rotation=True):
+        self.pdb = '157D'
+        self.model = 1
+        self.chain = 'A'
+        self.number = number
+        self.sequence = sequence
+        self.insertion_code = None
+        self.symmetry = '1_555'
+        self.index = number - 1
+        self.type = 'RNA linking'
+        self.centers = Centers({'glycosidic': [number, 0.0, 1.0],
+                                'base': [number, 2.0, 3.0],
+                                'phosphate': []})
+        self.rotation_matrix = np.eye(3) * number if rotation else None
+
+    def unit_id(self):
+        return '157D|1|A|%s|%d' % (self.sequence, self.number)
+
+
+class Structure(object):
+    def __init__(self, residues):
+        self._residues = residues
+
+    def residues(self):
+        return iter(self._residues)
+
+
+class FusedTest(ut.TestCase):
+    def setUp(self):
+        self.structure = Structure([Residue(1, 'C'), Residue(2, 'G', False),
+                                    Residue(3, 'HOH')])
+        patcher = mock.patch.multiple(mod, create=True, UnitInfo=UnitInfo,
+                                      UnitCenters=UnitCenters,
+                                      UnitRotations=UnitRotations,
+                                      UnitCoordinates=UnitCoordinates)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.loader = self.create(Loader)
+        self.loader.stages = [self.create(klass) for klass in Loader.members]
+        for stage in self.loader.stages:
+            stage.coordinates = lambda pdb, unit: 'ATOM %s' % unit.unit_id()
+
+    def create(self, klass):
+        stage = klass.__new__(klass)
+        stage.config = {}
+        stage.name = klass.__module__.replace('pymotifs.', '')
+        stage.logger = logging.getLogger(klass.__module__)
+        stage.structure = lambda pdb: self.structure
+        return stage
+
+
+class FusedRowsTest(FusedTest):
+    def test_it_produces_the_rows_of_each_stage(self):
+        rows = by_stage(self.loader, self.loader.data('157D'))
+        expected = [list(stage.data('157D')) for stage in self.loader.stages]
+        assert [len(r) for r in rows] == [3, 8, 3]
+        assert rows == expected
+
+    def test_it_produces_the_rows_of_each_residue_together(self):
+        data = self.loader.data('157D')
+        first = [next(data) for _ in range(5)]
+        assert [stage.name for stage, _ in first] == [
+            'units.info',
+            'units.center_rotation',
+            'units.center_rotation',
+            'units.center_rotation',
+            'units.coordinates',
+        ]
+        assert set(row.unit_id for _, row in first) == set(['157D|1|A|C|1'])
+
+    def test_it_walks_the_residues_once(self):
+        walked = []
+        residues = self.structure.residues
+        self.structure.residues = lambda: walked.append(True) or residues()
+        list(self.loader.data('157D'))
+        assert len(walked) == 1
+
+    def test_it_computes_rows_as_they_are_read(self):
+        computed = []
+        coordinates = self.loader.stages[2]
+        coordinates.coordinates = lambda pdb, unit: computed.append(unit) or 'ATOM'
+        data = self.loader.data('157D')
+        next(data)
+        assert computed == []
+        list(data)
+        assert len(computed) == 3
+
+
+class Session(object):
+    def __init__(self, existing):
+        self.existing = existing
+        self.events = []
+
+    def query(self, table):
+        return self.existing[table]
+
+    def delete(self, row):
+        self.events.append(('delete', row))
+
+    def add_all(self, rows):
+        self.events.extend(('add', row) for row in rows)
+
+    def flush(self):
+        self.events.append(('flush', None))
+
+
+class FusedStoreTest(FusedTest):
+    def setUp(self):
+        super(FusedStoreTest, self).setUp()
+        self.existing = {
+            'units.info': [UnitInfo(unit_id='old')],
+            'units.center_rotation': [UnitCenters(unit_id='old')],
+            'units.coordinates': [UnitCoordinates(unit_id='old')],
+        }
+        self.sessions = []
+
+        @contextmanager
+        def session():
+            self.sessions.append(Session(self.existing))
+            yield self.sessions[-1]
+
+        self.loader.session = session
+        self.loader.pending_stages = {}
+        self.loader.insert_max = 4
+        for stage in self.loader.stages:
+            stage.query = lambda session, pdb, name=stage.name: \
+                session.query(name)
+            stage.mark = False
+
+    def test_it_removes_and_stores_in_one_session(self):
+        stages = self.loader.stages
+        self.loader.store('157D', self.loader.data('157D'), stages=stages)
+        assert len(self.sessions) == 1
+        events = self.sessions[0].events
+        deleted = [row for event, row in events if event == 'delete']
+        assert deleted == [UnitCoordinates(unit_id='old'),
+                           UnitCenters(unit_id='old'),
+                           UnitInfo(unit_id='old')]
+        first_add = [event for event, _ in events].index('add')
+        assert all(event != 'delete' for event, _ in events[first_add:])
+
+    def test_it_adds_units_before_the_rows_referring_to_them(self):
+        self.loader.store('157D', self.loader.data('157D'))
+        flushed = set()
+        pending = []
+        for event, row in self.sessions[0].events:
+            if event == 'add':
+                if not isinstance(row, UnitInfo):
+                    assert row.unit_id in flushed
+                pending.append(row)
+            elif event == 'flush':
+                flushed.update(r.unit_id for r in pending
+                               if isinstance(r, UnitInfo))
+                pending = []
+        added = [r for e, r in self.sessions[0].events if e == 'add']
+        assert len(added) == 14
+
+    def test_it_finds_the_pending_stages_once(self):
+        calls = []
+        self.loader.must_recompute = lambda pdb, **kwargs: True
+        pending = self.loader.pending
+        self.loader.pending = lambda pdb, **kwargs: \
+            calls.append(pdb) or pending(pdb, **kwargs)
+        assert self.loader.should_process('157D') is True
+        self.loader.process('157D')
+        assert calls == ['157D']
+        assert self.loader.pending_stages == {}
@@ -0,0 +1,115 @@
+import os
+import shutil
+import tempfile
+import unittest as ut
+
+from pymotifs.utils import alignment as aln
+from pymotifs.utils.alignment import AlignmentCache
+
+
+"""Sequences of RNA chains in the PDB, to compare alignments with."""
+YEAST_TRNA_PHE = 'GCGGAUUUAGCUCAGUUGGGAGAGCGCCAGACUGAAGAUCUGGAGGUCCUGUGUUCGAUCCACAGAAUUCGCACCA'
+ECOLI_TRNA_PHE = 'GCCCGGAUAGCUCAGUCGGUAGAGCAGGGGAUUGAAAAUCCCCGUGUCCUUGGUUCGAUUCCGAGUCCGGGCACCA'
+ECOLI_5S = 'UGCCUGGCGGCCGUAGCGCGGUGGUCCCACCUGACCCCAUGCCGAACUCAGAAGUGAAACGCCGUAGCGCCGAUGGUAGUGUGGGGUCUCCCCAUGCGAGAGUAGGGAACUGCCAGGCAU'
+THERMUS_5S = 'AAUCCCCCGUGCCCAUAGCGGCGUGGAACCACCCGUUCCCAUUCCGAACACGGAAGUGAAACGCGCCAGCGCCGAUGGUACUGUGGCGGGCGACCGCCUGGGAGAGUAGGUCGGUGCGGGGGAU'
+
+
+def seq(sequence, start=1):
+    return {'sequence': sequence,
+            'ids': list(range(start, start + len(sequence)))}
+
+
+class PairwiseAlignmentTest(ut.TestCase):
+    def test_it_maps_identical_sequences_one_to_one(self):
+        val = aln.align([seq('ACGU'), seq('ACGU', start=10)])
+        assert val == [[1, 10], [2, 11], [3, 12], [4, 13]]
+
+    def test_it_aligns_mismatches(self):
+        val = aln.align([seq('AAA'), seq('ACA', start=10)])
+        assert val == [[1, 10], [2, 11], [3, 12]]
+
+    def test_it_places_a_fragment_in_the_full_sequence(self):
+        val = aln.align([seq('GGGACUAGCCC'), seq('ACUAG', start=10)])
+        assert val == [[1, None], [2, None], [3, None],
+                       [4, 10], [5, 11], [6, 12], [7, 13], [8, 14],
+                       [9, None], [10, None], [11, None]]
+
+    def test_it_gaps_an_insertion(self):
+        first = 'GCAUCGGAUCCAGCUAGG'
+        second = first[:9] + 'AAAA' + first[9:]
+        val = aln.pairwise_columns(first, second)
+        assert val == [aln.BOTH] * 9 + [aln.SECOND] * 4 + [aln.BOTH] * 9
+
+    def test_it_aligns_homologous_trnas_without_gaps(self):
+        val = aln.pairwise_columns(YEAST_TRNA_PHE, ECOLI_TRNA_PHE)
+        assert val == [aln.BOTH] * 76
+
+    def test_it_can_encode_and_decode_columns(self):
+        columns = [aln.BOTH] * 12 + [aln.FIRST] * 2 + [aln.SECOND] + \
+            [aln.BOTH]
+        encoded = aln.encode_columns(columns)
+        assert encoded == '12M2I1D1M'
+        assert aln.decode_columns(encoded) == columns
+
+
+@ut.skipIf(not os.path.exists(aln.CLUSTALW), 'clustalw is not installed')
+class ClustalComparisonTest(ut.TestCase):
+    def assertAgrees(self, first, second):
+        data = [seq(first), seq(second, start=1000)]
+        pairwise = aln.align_pair(data[0], data[1])
+        clustal = aln.clustal_align(data)
+        expected = set(tuple(p) for p in clustal if None not in p)
+        found = set(tuple(p) for p in pairwise if None not in p)
+        assert len(expected & found) >= 0.95 * len(expected)
+
+    def test_it_agrees_on_trnas(self):
+        self.assertAgrees(YEAST_TRNA_PHE, ECOLI_TRNA_PHE)
+
+    def test_it_agrees_on_5s_rrnas(self):
+        self.assertAgrees(ECOLI_5S, THERMUS_5S)
+
+    def test_it_agrees_on_unobserved_positions(self):
+        observed = YEAST_TRNA_PHE[:36] + YEAST_TRNA_PHE[38:73]
+        self.assertAgrees(YEAST_TRNA_PHE, observed)
+
+
+class AlignmentCacheTest(ut.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'alignments.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_it_stores_alignments_by_ordered_md5(self):
+        cache = AlignmentCache(self.filename)
+        cache.set('a', 'b', [aln.BOTH, aln.FIRST])
+        assert cache.get('a', 'b') == [aln.BOTH, aln.FIRST]
+        assert cache.get('b', 'a') is None
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    def test_it_keeps_alignments_between_runs(self):
+        first = seq('GGGACUAGCCC')
+        second = seq('ACUAG', start=20)
+        cache = AlignmentCache(self.filename)
+        expected = aln.align([first, second], cache=cache)
+        cache.close()
+
+        cache = AlignmentCache(self.filename)
+        assert aln.align([first, second], cache=cache) == expected
+        assert (cache.hits, cache.misses) == (1, 0)
+
+    def test_it_ignores_alignments_made_with_other_settings(self):
+        cache = AlignmentCache(self.filename, settings='old scores')
+        cache.set('a', 'b', [aln.BOTH, aln.FIRST])
+        cache.close()
+
+        cache = AlignmentCache(self.filename)
+        assert cache.get('a', 'b') is None
+        cache.set('a', 'b', [aln.FIRST, aln.BOTH])
+        assert cache.get('a', 'b') == [aln.FIRST, aln.BOTH]
+
+    def test_it_does_not_cache_identical_sequences(self):
+        cache = AlignmentCache(self.filename)
+        aln.align([seq('ACGU'), seq('ACGU', start=5)], cache=cache)
+        assert (cache.hits, cache.misses) == (0, 0)
@@ -23,7 +23,24 @@ class ConnectionTest(ut.TestCase):
         connections['zF'] = ['zB']
         for key in connections.keys():
             connections[key] = set(connections[key])
+        # each set is keyed by the first key of connections in it
         ans = {'A': set(['A', 'C', 'B', 'E', 'D', 'F']),
-               'zD': set(['zD', 'zE', 'zF', 'zA', 'zB', 'zC'])}
+               'zA': set(['zD', 'zE', 'zF', 'zA', 'zB', 'zC'])}
         val = conn(connections)
         self.assertEquals(ans, val)
+
+    def test_handles_vertices_that_are_not_keys(self):
+        connections = {'A': set(['B']), 'C': set(['B']), 'D': set()}
+        val = conn(connections)
+        self.assertEqual({'A': set(['A', 'B', 'C']), 'D': set(['D'])}, val)
+
+    def test_does_not_modify_the_connections(self):
+        connections = {'A': set(['B'])}
+        conn(connections)
+        self.assertEqual({'A': set(['B'])}, connections)
+
+    def test_handles_long_chains(self):
+        connections = dict((i, set([i + 1])) for i in range(10000))
+        val = conn(connections)
+        self.assertEqual([0], list(val.keys()))
+        self.assertEqual(set(range(10001)), val[0])
@@ -0,0 +1,56 @@
+from unittest import TestCase
+
+import numpy as np
+import pytest
+
+from fr3d.geometry.discrepancy import matrix_discrepancy
+
+from pymotifs.utils import discrepancy as disc
+
+
+def rotation(rng):
+    matrix, _ = np.linalg.qr(rng.normal(size=(3, 3)))
+    if np.linalg.det(matrix) < 0:
+        matrix[:, 0] *= -1
+    return matrix
+
+
+def matched(rng, size):
+    centers1 = rng.normal(size=(size, 3)) * 10
+    centers2 = np.dot(centers1, rotation(rng)) + rng.normal(size=(size, 3))
+    rotations1 = np.array([rotation(rng) for _ in range(size)])
+    rotations2 = np.array([rotation(rng) for _ in range(size)])
+    return centers1, rotations1, centers2, rotations2
+
+
+class BatchMatrixDiscrepancyTest(TestCase):
+    def setUp(self):
+        self.rng = np.random.RandomState(1)
+        self.lengths = [3, 4, 25, 120]
+        self.pairs = [matched(self.rng, n) for n in self.lengths]
+
+    def batch(self):
+        stacked = [np.concatenate([p[i] for p in self.pairs])
+                   for i in range(4)]
+        return disc.batch_matrix_discrepancy(*(stacked + [self.lengths]))
+
+    def test_it_matches_computing_each_pair(self):
+        val = self.batch()
+        ans = [matrix_discrepancy(*p) for p in self.pairs]
+        self.assertEquals(len(ans), len(val))
+        for computed, expected in zip(val, ans):
+            self.assertAlmostEqual(expected, computed, places=10)
+
+    def test_it_gives_zero_for_identical_pairs(self):
+        c1, r1, _, _ = self.pairs[2]
+        val = disc.batch_matrix_discrepancy(c1, r1, c1 + 3.0, r1, [len(c1)])
+        self.assertAlmostEqual(0.0, val[0], places=6)
+
+    def test_it_gives_nothing_for_no_pairs(self):
+        val = disc.batch_matrix_discrepancy([], [], [], [], [])
+        self.assertEquals(0, len(val))
+
+    def test_it_complains_about_too_few_nucleotides(self):
+        c1, r1, c2, r2 = matched(self.rng, 2)
+        with pytest.raises(ValueError):
+            disc.batch_matrix_discrepancy(c1, r1, c2, r2, [2])
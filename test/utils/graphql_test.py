@@ -0,0 +1,107 @@
+import json
+import re
+import threading
+import unittest as ut
+
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler
+from six.moves.BaseHTTPServer import HTTPServer
+
+from pymotifs.utils.graphql import EntryFetcher
+from pymotifs.utils.graphql import FetchFailed
+from pymotifs.utils.graphql import RateLimiter
+
+
+class FakeRcsb(BaseHTTPRequestHandler):
+    """A stand in for the RCSB GraphQL service. It knows every PDB id that
+    does not start with 0, and fails the number of times set in `failures`.
+    """
+
+    queries = []
+    failures = 0
+
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        query = json.loads(self.rfile.read(length).decode('utf-8'))['query']
+        FakeRcsb.queries.append(query)
+
+        if FakeRcsb.failures:
+            FakeRcsb.failures -= 1
+            self.send_response(503)
+            self.end_headers()
+            return
+
+        ids = re.findall(r'"(\w{4})"', query)
+        entries = [{'rcsb_id': i, 'struct': {'title': 'T' + i}}
+                   for i in ids if not i.startswith('0')]
+        body = json.dumps({'data': {'entries': entries}}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class EntryFetcherTest(ut.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = HTTPServer(('127.0.0.1', 0), FakeRcsb)
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+        cls.url = 'http://127.0.0.1:%d/graphql' % cls.server.server_port
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        FakeRcsb.queries = []
+        FakeRcsb.failures = 0
+
+    def fetcher(self, **kwargs):
+        kwargs.setdefault('requests_per_second', None)
+        kwargs.setdefault('backoff', 0)
+        return EntryFetcher('struct { title }', url=self.url, **kwargs)
+
+    def test_it_asks_for_many_entries_per_request(self):
+        pdbs = ['1A%02d' % i for i in range(25)]
+        val = self.fetcher(batch_size=10)(pdbs)
+        self.assertEqual(set(pdbs), set(val))
+        self.assertEqual(3, len(FakeRcsb.queries))
+        self.assertEqual('T1A00', val['1A00']['struct']['title'])
+
+    def test_it_leaves_out_unknown_entries(self):
+        val = self.fetcher()(['1GID', '0GID'])
+        self.assertEqual(['1GID'], list(val))
+
+    def test_it_retries_failed_requests(self):
+        FakeRcsb.failures = 2
+        val = self.fetcher(retries=2)(['1GID'])
+        self.assertEqual(['1GID'], list(val))
+        self.assertEqual(3, len(FakeRcsb.queries))
+
+    def test_it_gives_up_after_all_retries(self):
+        FakeRcsb.failures = 5
+        self.assertRaises(FetchFailed, self.fetcher(retries=1), ['1GID'])
+
+    def test_it_keeps_the_batches_that_were_fetched(self):
+        FakeRcsb.failures = 2
+        pdbs = ['1A%02d' % i for i in range(15)]
+        val = self.fetcher(batch_size=10, retries=1, workers=1)(pdbs,
+                                                                strict=False)
+        self.assertEqual(set(pdbs[10:]), set(val))
+
+
+class RateLimiterTest(ut.TestCase):
+    def test_it_spaces_out_events(self):
+        now = [10.0]
+        waits = []
+        limiter = RateLimiter(2, clock=lambda: now[0], sleep=waits.append)
+        limiter.wait()
+        limiter.wait()
+        limiter.wait()
+        self.assertEqual([0.5, 1.0], waits)
@@ -0,0 +1,155 @@
+import datetime as dt
+import os
+import shutil
+import tempfile
+import threading
+import unittest as ut
+
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler
+from six.moves.BaseHTTPServer import HTTPServer
+
+from pymotifs.utils.mirror import FileMirror
+from pymotifs.utils.mirror import Manifest
+from pymotifs.utils.mirror import DOWNLOADED
+from pymotifs.utils.mirror import MISSING
+from pymotifs.utils.mirror import NOT_MODIFIED
+
+
+class FakeFiles(BaseHTTPRequestHandler):
+    """A stand in for a file server. It serves the files in `files` with an
+    ETag, honors If-None-Match and Range requests, and cuts the next response
+    short after `cut` bytes if `cut` is set.
+    """
+
+    files = {}
+    requests = []
+    cut = None
+
+    def do_GET(self):
+        name = self.path.strip('/').split('.')[0]
+        FakeFiles.requests.append((name, dict(self.headers)))
+        if name not in FakeFiles.files:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        body = FakeFiles.files[name]
+        etag = '"%s-%d"' % (name, len(body))
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        start = 0
+        ranged = self.headers.get('Range')
+        if ranged and self.headers.get('If-Range') == etag:
+            start = int(ranged[6:-1])
+            self.send_response(206)
+        else:
+            self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body) - start))
+        self.end_headers()
+
+        if FakeFiles.cut is not None:
+            self.wfile.write(body[start:start + FakeFiles.cut])
+            FakeFiles.cut = None
+            self.close_connection = True
+            return
+        self.wfile.write(body[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+class FileMirrorTest(ut.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = HTTPServer(('127.0.0.1', 0), FakeFiles)
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+        cls.url = 'http://127.0.0.1:%d/{name}.cif.gz' % cls.server.server_port
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        FakeFiles.files = {'1GID': b'a' * 5000, '1S72': b'b' * 3000}
+        FakeFiles.requests = []
+        FakeFiles.cut = None
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def mirror(self, **kwargs):
+        kwargs.setdefault('backoff', 0)
+        return FileMirror(self.url, self.directory, suffix='.cif.gz',
+                          **kwargs)
+
+    def read(self, name):
+        with open(os.path.join(self.directory, name + '.cif.gz'), 'rb') as raw:
+            return raw.read()
+
+    def test_it_fetches_many_files(self):
+        val = self.mirror(workers=2)(['1GID', '1S72', '0GID'])
+        self.assertEqual({'1GID': DOWNLOADED, '1S72': DOWNLOADED,
+                          '0GID': MISSING}, val)
+        self.assertEqual(b'a' * 5000, self.read('1GID'))
+        self.assertEqual(b'b' * 3000, self.read('1S72'))
+        self.assertFalse(os.path.exists(os.path.join(self.directory,
+                                                     '0GID.cif.gz')))
+
+    def test_it_records_fetched_files_in_the_manifest(self):
+        self.mirror()(['1GID'])
+        manifest = Manifest(os.path.join(self.directory, 'manifest.json'))
+        entry = manifest.get('1GID')
+        self.assertEqual('"1GID-5000"', entry['etag'])
+        self.assertEqual(5000, entry['size'])
+        self.assertTrue('partial' not in entry)
+
+    def test_it_does_not_fetch_unchanged_files_again(self):
+        self.mirror()(['1GID'])
+        self.assertEqual(NOT_MODIFIED, self.mirror().fetch('1GID'))
+        headers = FakeFiles.requests[-1][1]
+        self.assertEqual('"1GID-5000"', headers['If-None-Match'])
+
+    def test_it_fetches_changed_files_again(self):
+        self.mirror()(['1GID'])
+        FakeFiles.files['1GID'] = b'c' * 10
+        self.assertEqual(DOWNLOADED, self.mirror().fetch('1GID'))
+        self.assertEqual(b'c' * 10, self.read('1GID'))
+
+    def test_it_resumes_interrupted_downloads(self):
+        FakeFiles.cut = 1000
+        mirror = self.mirror(retries=1, chunk_size=500)
+        self.assertEqual(DOWNLOADED, mirror.fetch('1GID'))
+        self.assertEqual(b'a' * 5000, self.read('1GID'))
+        self.assertEqual(2, len(FakeFiles.requests))
+        self.assertEqual('bytes=1000-', FakeFiles.requests[1][1]['Range'])
+
+    def test_it_leaves_no_file_after_a_failed_download(self):
+        FakeFiles.cut = 1000
+        mirror = self.mirror(retries=0)
+        self.assertEqual({'1GID': None}, mirror(['1GID']))
+        self.assertFalse(os.path.exists(os.path.join(self.directory,
+                                                     '1GID.cif.gz')))
+
+    def test_it_knows_files_revised_after_they_were_checked(self):
+        mirror = self.mirror()
+        mirror(['1GID'])
+        today = dt.datetime.utcnow().date()
+        self.assertTrue(mirror.is_current('1GID', today - dt.timedelta(1)))
+        self.assertFalse(mirror.is_current('1GID', today))
+        self.assertTrue(mirror.is_current('1GID', None))
+        self.assertFalse(mirror.is_current('1S72', None))
+
+    def test_it_can_remove_a_file(self):
+        mirror = self.mirror()
+        mirror(['1GID'])
+        mirror.remove('1GID')
+        self.assertFalse(mirror.is_current('1GID'))
+        self.assertEqual({}, mirror.manifest.get('1GID'))